@@ -0,0 +1,10 @@
+from django.urls import path
+
+from . import async_views
+
+urlpatterns = [
+    path('recipes/', async_views.recipe_list),
+    path('recipes/<int:pk>/', async_views.recipe_detail),
+    path('ingredients/', async_views.ingredient_list),
+    path('users/<int:pk>/', async_views.user_detail),
+]
@@ -0,0 +1,263 @@
+"""Асинхронные обработчики горячих GET-эндпоинтов для ASGI-воркеров.
+
+Подключаются через foodgram.async_urls (ASYNC_READ_VIEWS=True) перед
+представлениями DRF. Частый случай — чтение с перечисленными
+параметрами — обслуживается асинхронным ORM без пула потоков на весь
+запрос; запись, прочие фильтры и ошибки передаются синхронному
+представлению DRF, поэтому поведение API не меняется. Валидаторы
+(ETag, Last-Modified), ответ 304 и кэш ответов берутся у того же
+ViewSet, что и в синхронном представлении.
+"""
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.http import HttpResponse
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from api.authentication import token_cache
+from api.cache import (
+    get_cache, make_key, object_version_name, response_timeout, stats
+)
+from api.conditional import not_modified, set_validators
+from api.pagination import CustomPagination
+from api.serializers import RecipeListSerializer, UserSerializer
+from api.views import IngredientViewSet, RecipeViewSet, UserViewSet
+from recipes.ingredient_index import ingredient_index
+from recipes.models import Recipe
+from users.models import Follow, User
+
+sync_recipe_list = RecipeViewSet.as_view(
+    {'get': 'list', 'post': 'create'}, basename='recipes', detail=False
+)
+sync_recipe_detail = RecipeViewSet.as_view(
+    {
+        'get': 'retrieve', 'put': 'update', 'patch': 'partial_update',
+        'delete': 'destroy',
+    },
+    basename='recipes', detail=True
+)
+sync_ingredient_list = IngredientViewSet.as_view(
+    {'get': 'list'}, basename='ingredients', detail=False
+)
+sync_user_detail = UserViewSet.as_view(
+    {
+        'get': 'retrieve', 'put': 'update', 'patch': 'partial_update',
+        'delete': 'destroy',
+    },
+    basename='users', detail=True
+)
+
+
+class Fallback(Exception):
+    """Запрос должно обработать синхронное представление."""
+
+
+def positive_int(value, default=None):
+    if value is None:
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise Fallback
+    if value < 1:
+        raise Fallback
+    return value
+
+
+async def authenticate(request):
+    # Как TokenAuthentication: None для неверного токена, чтобы ответ
+    # 401 сформировало представление DRF.
+    header = request.headers.get('Authorization')
+    if not header:
+        return AnonymousUser()
+    scheme, _, key = header.partition(' ')
+    if scheme.lower() != 'token' or not key.strip():
+        return None
+    token = await token_cache.aget(key.strip())
+    if token is None or not token.user.is_active:
+        return None
+    return token.user
+
+
+def render(data):
+    return HttpResponse(
+        JSONRenderer().render(data), content_type='application/json'
+    )
+
+
+def get_validators(viewset, request, pk):
+    if pk is None:
+        return viewset.get_namespace_validators(request)
+    return viewset.get_object_validators(request, pk)
+
+
+async def cached_data(viewset, handler, request, drf_request, **kwargs):
+    # Как ResponseCacheMixin.cached_response: общий анонимный ответ
+    # в кэше и флаги пользователя поверх него
+    if not viewset.should_cache_response(drf_request):
+        return await handler(request, **kwargs), None
+    namespace = viewset.response_cache_namespace
+    version_names = [
+        namespace if 'pk' not in kwargs
+        else object_version_name(namespace, kwargs['pk'])
+    ]
+    cache = get_cache()
+    key = await sync_to_async(make_key)(drf_request, version_names)
+    data = await cache.aget(key)
+    hit = data is not None
+    stats.record(hit)
+    user = request.user
+    if not hit:
+        request.user = AnonymousUser()
+        try:
+            data = await handler(request, **kwargs)
+        finally:
+            request.user = user
+        await cache.aset(key, data, response_timeout(cache))
+    if viewset.response_cache_overlay and user.is_authenticated:
+        data = await sync_to_async(viewset.response_cache_overlay)(
+            data, user
+        )
+    return data, 'HIT' if hit else 'MISS'
+
+
+async def versioned_response(viewset_class, cached, handler, request,
+                             **kwargs):
+    viewset = viewset_class()
+    drf_request = Request(request)
+    drf_request.accepted_renderer = JSONRenderer()
+    drf_request.user = request.user
+    validators = await sync_to_async(get_validators)(
+        viewset, drf_request, kwargs.get('pk')
+    )
+    if validators == (None, None):
+        raise Fallback
+    response = not_modified(request, validators)
+    if response is None:
+        if cached:
+            data, cache_status = await cached_data(
+                viewset, handler, request, drf_request, **kwargs
+            )
+        else:
+            data, cache_status = await handler(request, **kwargs), None
+        response = render(data)
+        if cache_status:
+            response['X-Cache'] = cache_status
+    set_validators(response, validators, viewset.conditional_user_flags)
+    return response
+
+
+def async_read_view(sync_view, params=(), viewset_class=None, cached=False):
+    """Асинхронный обработчик GET перед синхронным sync_view.
+
+    viewset_class даёт валидаторы условных запросов, а при cached=True —
+    и кэш ответов; handler возвращает данные ответа или Fallback.
+    """
+    def decorator(handler):
+        async def view(request, *args, **kwargs):
+            if (
+                request.method == 'GET'
+                and set(request.GET) <= set(params)
+                and 'text/html' not in request.headers.get('Accept', '')
+            ):
+                user = await authenticate(request)
+                if user is not None:
+                    # Ленивый request.user из сессии обращался бы к БД
+                    # синхронно, а сериализаторы проверяют авторизацию.
+                    request.user = user
+                    try:
+                        if viewset_class is None:
+                            return render(
+                                await handler(request, *args, **kwargs)
+                            )
+                        return await versioned_response(
+                            viewset_class, cached, handler, request,
+                            **kwargs
+                        )
+                    except Fallback:
+                        pass
+            return await sync_to_async(sync_view)(request, *args, **kwargs)
+
+        view.csrf_exempt = True
+        view.__name__ = handler.__name__
+        return view
+    return decorator
+
+
+def page_link(request, page):
+    url = request.build_absolute_uri()
+    if page == 1:
+        return remove_query_param(url, CustomPagination.page_query_param)
+    return replace_query_param(url, CustomPagination.page_query_param, page)
+
+
+@async_read_view(
+    sync_recipe_list, ('page', 'limit', 'author'), RecipeViewSet, cached=True
+)
+async def recipe_list(request):
+    page = positive_int(request.GET.get('page'), 1)
+    page_size = min(
+        positive_int(request.GET.get('limit'), CustomPagination.page_size),
+        CustomPagination.max_page_size
+    )
+    queryset = Recipe.objects.with_related().with_user_flags(request.user)
+    if 'author' in request.GET:
+        queryset = queryset.filter(
+            author_id=positive_int(request.GET['author'])
+        )
+    count = await queryset.acount()
+    offset = (page - 1) * page_size
+    if page > 1 and offset >= count:
+        raise Fallback
+    # async for в Django 4.2 выполняет выборку и prefetch одним вызовом
+    # в потоке ORM; сериализация уже выбранных данных к БД не обращается.
+    recipes = [
+        recipe async for recipe in queryset[offset:offset + page_size]
+    ]
+    return {
+        'count': count,
+        'next': (
+            page_link(request, page + 1)
+            if offset + page_size < count else None
+        ),
+        'previous': page_link(request, page - 1) if page > 1 else None,
+        'results': RecipeListSerializer(
+            recipes, many=True, context={'request': request}
+        ).data,
+    }
+
+
+@async_read_view(sync_recipe_detail, (), RecipeViewSet, cached=True)
+async def recipe_detail(request, pk):
+    try:
+        recipe = await Recipe.objects.with_related().with_user_flags(
+            request.user
+        ).aget(pk=pk)
+    except Recipe.DoesNotExist:
+        raise Fallback
+    return RecipeListSerializer(recipe, context={'request': request}).data
+
+
+@async_read_view(
+    sync_ingredient_list, ('name', 'limit'), IngredientViewSet
+)
+async def ingredient_list(request):
+    return await sync_to_async(ingredient_index.search)(
+        request.GET.get('name', '').strip(),
+        positive_int(request.GET.get('limit'))
+    )
+
+
+@async_read_view(sync_user_detail)
+async def user_detail(request, pk):
+    try:
+        profile = await User.objects.aget(pk=pk)
+    except User.DoesNotExist:
+        raise Fallback
+    profile.is_subscribed = request.user.is_authenticated and (
+        await Follow.objects.filter(
+            user=request.user, following=profile
+        ).aexists()
+    )
+    return UserSerializer(profile, context={'request': request}).data
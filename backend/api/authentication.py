@@ -0,0 +1,177 @@
+"""Аутентификация по токену DRF без запроса к БД на каждый запрос.
+
+Токен с пользователем ищется в LRU-кэше процесса
+(AUTH_TOKEN_LOCAL_SIZE записей, не дольше AUTH_TOKEN_LOCAL_TTL секунд),
+затем в общем кэше (AUTH_TOKEN_CACHE_TTL секунд) и только потом в БД.
+Удаление токена и сохранение пользователя (выход, смена и сброс
+пароля, блокировка) сбрасывают обе записи; в кэшах других процессов
+отозванный токен живёт не дольше AUTH_TOKEN_LOCAL_TTL секунд. Кэш в
+памяти процесса (LocMemCache без REDIS_URL) общим не считается: сброс
+до других процессов не дошёл бы, поэтому второй уровень тогда не
+используется.
+"""
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from foodgram.caches import is_shared
+
+KEY_PREFIX = 'auth-token'
+# Метка в общем кэше после сброса: запрос, успевший прочитать токен из
+# БД до сброса, не вернёт в кэш устаревшую запись (см. cache.add).
+REVOKED = 'revoked'
+
+
+class AuthStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.db_lookups = 0
+
+    def record(self, source):
+        with self._lock:
+            setattr(self, source, getattr(self, source) + 1)
+
+    def as_dict(self):
+        total = self.local_hits + self.shared_hits + self.db_lookups
+        return {
+            'local_hits': self.local_hits,
+            'shared_hits': self.shared_hits,
+            'db_lookups': self.db_lookups,
+            'db_lookups_per_request': (
+                self.db_lookups / total if total else 0.0
+            ),
+        }
+
+
+def get_cache():
+    # None, если кэш не виден другим процессам
+    cache = caches[settings.AUTH_TOKEN_CACHE_ALIAS]
+    return cache if is_shared(cache) else None
+
+
+def cache_key(key):
+    # В ключах кэша не храним сам токен
+    return f'{KEY_PREFIX}:{hashlib.sha256(key.encode()).hexdigest()}'
+
+
+class TokenCache:
+    """Токены с пользователями: LRU процесса поверх общего кэша.
+
+    Записи хранятся сериализованными, и каждый запрос получает свою
+    копию пользователя — изменения request.user не попадут в кэш.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.stats = AuthStats()
+
+    def get_local(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at < time.monotonic():
+                del self._entries[name]
+                return None
+            self._entries.move_to_end(name)
+        return pickle.loads(data)
+
+    def set_local(self, name, token):
+        data = pickle.dumps(token)
+        with self._lock:
+            self._entries[name] = (
+                time.monotonic() + settings.AUTH_TOKEN_LOCAL_TTL, data
+            )
+            self._entries.move_to_end(name)
+            while len(self._entries) > settings.AUTH_TOKEN_LOCAL_SIZE:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        name = cache_key(key)
+        token = self.get_local(name)
+        if token is not None:
+            self.stats.record('local_hits')
+            return token
+        cache = get_cache()
+        token = cache.get(name) if cache is not None else None
+        if isinstance(token, Token):
+            self.stats.record('shared_hits')
+        else:
+            self.stats.record('db_lookups')
+            try:
+                token = Token.objects.select_related('user').get(key=key)
+            except Token.DoesNotExist:
+                return None
+            if cache is not None:
+                cache.add(name, token, settings.AUTH_TOKEN_CACHE_TTL)
+        self.set_local(name, token)
+        return token
+
+    async def aget(self, key):
+        name = cache_key(key)
+        token = self.get_local(name)
+        if token is not None:
+            self.stats.record('local_hits')
+            return token
+        cache = get_cache()
+        token = await cache.aget(name) if cache is not None else None
+        if isinstance(token, Token):
+            self.stats.record('shared_hits')
+        else:
+            self.stats.record('db_lookups')
+            try:
+                token = await Token.objects.select_related('user').aget(
+                    key=key
+                )
+            except Token.DoesNotExist:
+                return None
+            if cache is not None:
+                await cache.aadd(
+                    name, token, settings.AUTH_TOKEN_CACHE_TTL
+                )
+        self.set_local(name, token)
+        return token
+
+    def invalidate(self, *keys):
+        names = [cache_key(key) for key in keys]
+        with self._lock:
+            for name in names:
+                self._entries.pop(name, None)
+        cache = get_cache()
+        if cache is not None:
+            cache.set_many(
+                {name: REVOKED for name in names},
+                timeout=settings.AUTH_TOKEN_LOCAL_TTL
+            )
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+        if token is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.')
+            )
+        return (token.user, token)
@@ -0,0 +1,209 @@
+import hashlib
+import threading
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import caches
+from rest_framework.response import Response
+
+from foodgram.caches import is_shared
+
+from recipes.models import Favorite, ShoppingCart
+from users.models import Follow
+
+KEY_PREFIX = 'response-cache'
+
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def as_dict(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
+
+
+stats = CacheStats()
+
+
+def get_cache():
+    return caches[settings.RESPONSE_CACHE_ALIAS]
+
+
+def version_timeout(cache):
+    # Кэш в памяти процесса не видит версий, сменённых в других
+    # процессах: версии и ответы в нём живут недолго, и ответ другого
+    # процесса устаревает не дольше чем на RESPONSE_CACHE_LOCAL_TIMEOUT.
+    if is_shared(cache):
+        return None
+    return settings.RESPONSE_CACHE_LOCAL_TIMEOUT
+
+
+def response_timeout(cache):
+    if is_shared(cache):
+        return settings.RESPONSE_CACHE_TIMEOUT
+    return min(
+        settings.RESPONSE_CACHE_TIMEOUT, settings.RESPONSE_CACHE_LOCAL_TIMEOUT
+    )
+
+
+def version_key(name):
+    return f'{KEY_PREFIX}:version:{name}'
+
+
+def object_version_name(namespace, pk):
+    return f'{namespace}:{pk}'
+
+
+def bump_versions(*names):
+    # Новый случайный токен версии делает недоступными все ответы,
+    # закэшированные под старым; сами записи вытеснятся по таймауту.
+    cache = get_cache()
+    cache.set_many(
+        {version_key(name): uuid.uuid4().hex for name in names},
+        timeout=version_timeout(cache)
+    )
+
+
+def get_versions(*names):
+    cache = get_cache()
+    keys = [version_key(name) for name in names]
+    versions = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in versions}
+    if missing:
+        for key, value in missing.items():
+            cache.add(key, value, timeout=version_timeout(cache))
+        versions.update(cache.get_many(list(missing)))
+    return [versions.get(key, '') for key in keys]
+
+
+def make_key(request, version_names):
+    params = sorted(
+        (key, sorted(values)) for key, values in request.query_params.lists()
+    )
+    raw = '|'.join([
+        request.get_host(),
+        request.path,
+        repr(params),
+        request.accepted_renderer.format or '',
+        *get_versions(*version_names),
+    ])
+    return f'{KEY_PREFIX}:{hashlib.sha256(raw.encode()).hexdigest()}'
+
+
+@contextmanager
+def as_anonymous(request):
+    user = request.user
+    request.user = AnonymousUser()
+    try:
+        yield
+    finally:
+        request.user = user
+
+
+def iter_recipes(data):
+    if isinstance(data, dict) and 'results' in data:
+        return data['results']
+    if isinstance(data, list):
+        return data
+    return [data]
+
+
+def apply_user_overlay(data, user):
+    # Флаги, зависящие от пользователя, досчитываются тремя запросами
+    # на страницу поверх общего закэшированного ответа.
+    recipes = [item for item in iter_recipes(data) if 'id' in item]
+    if not recipes:
+        return data
+    recipe_ids = [item['id'] for item in recipes]
+    author_ids = {item['author']['id'] for item in recipes}
+    favorited = set(Favorite.objects.filter(
+        user=user, recipe_id__in=recipe_ids
+    ).values_list('recipe_id', flat=True))
+    in_cart = set(ShoppingCart.objects.filter(
+        user=user, recipe_id__in=recipe_ids
+    ).values_list('recipe_id', flat=True))
+    subscribed = set(Follow.objects.filter(
+        user=user, following_id__in=author_ids
+    ).values_list('following_id', flat=True))
+    for item in recipes:
+        item['is_favorited'] = item['id'] in favorited
+        item['is_in_shopping_cart'] = item['id'] in in_cart
+        item['author']['is_subscribed'] = item['author']['id'] in subscribed
+    return data
+
+
+class ResponseCacheMixin:
+    """Кэш ответов list/retrieve для общих (не персональных) данных.
+
+    Ключ строится из хоста, пути, нормализованных параметров запроса и
+    токенов версий: response_cache_namespace для списков и
+    '<namespace>:<pk>' для отдельных объектов. Сигналы в api.signals
+    меняют версии при изменении данных. Для авторизованных
+    пользователей кэшируется анонимный вариант ответа, а персональные
+    поля накладываются через response_cache_overlay.
+    """
+    response_cache_namespace = None
+    response_cache_overlay = None
+    # Параметры, при которых ответ целиком зависит от пользователя
+    response_cache_bypass_params = ()
+
+    def should_cache_response(self, request):
+        if not settings.RESPONSE_CACHE_TIMEOUT:
+            return False
+        if request.user.is_authenticated and any(
+            request.query_params.get(param) not in (None, '', '0', 'false')
+            for param in self.response_cache_bypass_params
+        ):
+            return False
+        return True
+
+    def cached_response(self, request, handler, version_names, *args,
+                        **kwargs):
+        if not self.should_cache_response(request):
+            return handler(request, *args, **kwargs)
+        cache = get_cache()
+        key = make_key(request, version_names)
+        data = cache.get(key)
+        hit = data is not None
+        stats.record(hit)
+        if not hit:
+            with as_anonymous(request):
+                response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+            data = response.data
+            cache.set(key, data, response_timeout(cache))
+        if self.response_cache_overlay and request.user.is_authenticated:
+            data = self.response_cache_overlay(data, request.user)
+        response = Response(data)
+        response['X-Cache'] = 'HIT' if hit else 'MISS'
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, super().list, [self.response_cache_namespace],
+            *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            request, super().retrieve,
+            [object_version_name(self.response_cache_namespace, kwargs['pk'])],
+            *args, **kwargs
+        )
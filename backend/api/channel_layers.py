@@ -0,0 +1,42 @@
+import asyncio
+import time
+from copy import deepcopy
+
+from channels import layers
+
+
+class InMemoryChannelLayer(layers.InMemoryChannelLayer):
+    """Слой каналов в памяти процесса для разработки, тестов и замеров.
+
+    Встроенный слой при каждом receive и group_send просматривает все
+    каналы в поиске просроченных сообщений, а group_send копирует
+    сообщение и создаёт задачу для каждого канала группы: с тысячами
+    открытых сокетов доставка одного события становится квадратичной.
+    Здесь просмотр выполняется не чаще раза в clean_interval секунд
+    (сроки жизни соблюдаются с этой точностью), а сообщение группы
+    копируется один раз — получатели не должны его менять.
+    """
+
+    clean_interval = 1
+    cleaned_at = 0
+
+    def _clean_expired(self):
+        now = time.monotonic()
+        if now - self.cleaned_at >= self.clean_interval:
+            self.cleaned_at = now
+            super()._clean_expired()
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_group_name(group)
+        self._clean_expired()
+        item = (time.time() + self.expiry, deepcopy(message))
+        for channel in list(self.groups.get(group, ())):
+            queue = self.channels.get(channel)
+            if queue is None:
+                queue = self.channels[channel] = asyncio.Queue(
+                    maxsize=self.get_capacity(channel)
+                )
+            # Переполненный канал пропускаем, как и встроенный слой
+            if not queue.full():
+                queue.put_nowait(item)
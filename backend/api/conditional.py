@@ -0,0 +1,120 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from api.cache import get_versions, object_version_name
+from recipes.models import Recipe
+
+USER_FLAG_FIELDS = (
+    'is_favorited', 'is_in_shopping_cart', 'author_is_subscribed'
+)
+
+
+def make_etag(request, *parts):
+    raw = '|'.join(str(part) for part in (
+        request.get_host(),
+        request.get_full_path(),
+        request.accepted_renderer.format,
+        *parts,
+    ))
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+
+def user_flags_version(user):
+    if not user.is_authenticated:
+        return ''
+    return get_versions(object_version_name('user-flags', user.pk))[0]
+
+
+def not_modified(request, validators):
+    # 304 (или 412), если копия клиента актуальна, иначе None
+    etag, last_modified = validators
+    return get_conditional_response(
+        request, etag=quote_etag(etag) if etag else None,
+        last_modified=last_modified
+    )
+
+
+def set_validators(response, validators, vary_on_user):
+    etag, last_modified = validators
+    if etag:
+        response['ETag'] = quote_etag(etag)
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    if vary_on_user:
+        patch_vary_headers(response, ('Authorization',))
+
+
+class ConditionalGetMixin:
+    """Условные GET-запросы (ETag / Last-Modified) без сериализации.
+
+    Валидаторы считаются до обработчика: если клиентская копия актуальна,
+    возвращается 304 без выборки данных и рендеринга.
+    """
+    conditional_namespace = None
+    # Есть ли в ответе флаги пользователя (избранное, корзина, подписки)
+    conditional_user_flags = False
+
+    def get_namespace_validators(self, request):
+        # Версия пространства имён меняется при любом изменении данных
+        # (api.signals), версия флагов — при изменении избранного,
+        # корзины и подписок пользователя.
+        parts = get_versions(self.conditional_namespace)
+        if self.conditional_user_flags:
+            parts.append(user_flags_version(request.user))
+        return make_etag(request, *parts), None
+
+    def get_object_validators(self, request, pk):
+        return self.get_namespace_validators(request)
+
+    def conditional_response(self, request, validators, handler, *args,
+                             **kwargs):
+        etag, last_modified = validators
+        if etag is None and last_modified is None:
+            return handler(request, *args, **kwargs)
+        response = not_modified(request, validators)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        set_validators(response, validators, self.conditional_user_flags)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, self.get_namespace_validators(request), super().list,
+            *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, self.get_object_validators(request, kwargs['pk']),
+            super().retrieve, *args, **kwargs
+        )
+
+
+class RecipeConditionalGetMixin(ConditionalGetMixin):
+    conditional_namespace = 'recipes'
+    conditional_user_flags = True
+
+    def get_object_validators(self, request, pk):
+        user = request.user
+        fields = ('updated_at',)
+        if user.is_authenticated:
+            fields += USER_FLAG_FIELDS
+        try:
+            row = Recipe.objects.filter(pk=pk).with_user_flags(
+                user
+            ).values_list(*fields).first()
+        except (ValueError, TypeError):
+            return None, None
+        if row is None:
+            return None, None
+        updated_at = row[0]
+        etag = make_etag(request, pk, updated_at.isoformat(), *row[1:])
+        # Флаги пользователя не отражаются в updated_at, поэтому
+        # Last-Modified отдаём только анонимным клиентам.
+        if user.is_authenticated:
+            return etag, None
+        return etag, int(updated_at.timestamp())
@@ -1,5 +1,17 @@
-from channels.generic.websocket import AsyncWebsocketConsumer
+import asyncio
 import json
+from collections import OrderedDict
+from urllib.parse import parse_qs
+
+from channels.consumer import get_handler_name
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from rest_framework.authtoken.models import Token
+
+from api.notifications import author_group, user_group
+from users.models import Follow
+
 
 class EchoConsumer(AsyncWebsocketConsumer):
     async def connect(self):
@@ -9,11 +21,126 @@ class EchoConsumer(AsyncWebsocketConsumer):
         # Просто отправляет обратно то же сообщение
         await self.send(text_data=text_data)
 
+
 class NotifyConsumer(AsyncWebsocketConsumer):
+    """Поток уведомлений пользователя: ws/notify/?token=<key>.
+
+    События из слоя каналов не отправляются в сокет сразу, а копятся
+    NOTIFY_BATCH_DELAY секунд и уходят одним сообщением
+    {"notifications": [...]}; повторы одного события склеиваются.
+    Пока медленный клиент принимает предыдущую пачку, новые события
+    ждут в буфере не больше NOTIFY_MAX_PENDING штук: самые старые
+    вытесняются, а их число приходит в поле dropped, чтобы клиент
+    перечитал данные через API. Сокет, который не принял пачку за
+    NOTIFY_SEND_TIMEOUT секунд, закрывается.
+    """
+
     async def connect(self):
+        self.joined = set()
+        self.pending = OrderedDict()
+        self.dropped = 0
+        self.flusher = None
+        self.user = await self.authenticate()
+        if self.user is None:
+            await self.close(code=4401)
+            return
+        await self.join(user_group(self.user.pk))
+        await asyncio.gather(*(
+            self.join(author_group(author_id))
+            for author_id in await self.followed_authors()
+        ))
         await self.accept()
-        await self.send(text_data=json.dumps({"message": "Добро пожаловать в NotifyConsumer!"}))
 
-    async def receive(self, text_data=None, bytes_data=None):
-        # Отправляет уведомление о получении сообщения
-        await self.send(text_data=json.dumps({"notification": "Сообщение получено!", "data": text_data})) 
\ No newline at end of file
+    async def disconnect(self, code):
+        if getattr(self, 'flusher', None) is not None:
+            self.flusher.cancel()
+        await asyncio.gather(*(
+            self.channel_layer.group_discard(group, self.channel_name)
+            for group in getattr(self, 'joined', ())
+        ))
+
+    async def dispatch(self, message):
+        # Базовый dispatch перед каждым обработчиком закрывает старые
+        # соединения с БД через переход в поток. События слоя каналов
+        # БД не трогают, а при рассылке тысячам сокетов этот переход
+        # оказывается основной стоимостью доставки.
+        if message['type'].startswith('notify.'):
+            await getattr(self, get_handler_name(message))(message)
+        else:
+            await super().dispatch(message)
+
+    async def authenticate(self):
+        # Браузер не передаёт заголовки при открытии WebSocket, поэтому
+        # токен можно указать и в строке запроса.
+        key = parse_qs(self.scope['query_string'].decode()).get('token')
+        if key:
+            return await self.get_user(key[0])
+        header = dict(self.scope['headers']).get(b'authorization', b'')
+        scheme, _, key = header.decode().partition(' ')
+        if scheme.lower() != 'token':
+            return None
+        return await self.get_user(key.strip())
+
+    @database_sync_to_async
+    def get_user(self, key):
+        token = Token.objects.select_related('user').filter(
+            key=key, user__is_active=True
+        ).first()
+        return token.user if token else None
+
+    @database_sync_to_async
+    def followed_authors(self):
+        return list(Follow.objects.filter(user=self.user).values_list(
+            'following_id', flat=True
+        ))
+
+    async def join(self, group):
+        await self.channel_layer.group_add(group, self.channel_name)
+        self.joined.add(group)
+
+    async def leave(self, group):
+        await self.channel_layer.group_discard(group, self.channel_name)
+        self.joined.discard(group)
+
+    async def notify_subscription(self, message):
+        group = author_group(message['author'])
+        if message['subscribed']:
+            await self.join(group)
+        else:
+            await self.leave(group)
+
+    async def notify_event(self, message):
+        event = message['event']
+        previous = self.pending.pop(message['key'], None)
+        if previous is not None and 'count' in event:
+            event = {**event, 'count': previous['count'] + event['count']}
+        self.pending[message['key']] = event
+        while len(self.pending) > settings.NOTIFY_MAX_PENDING:
+            self.pending.popitem(last=False)
+            self.dropped += 1
+        if self.flusher is None:
+            self.flusher = asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        # Обработчики событий не ждут отправки в сокет, иначе медленный
+        # клиент переполнил бы свой канал в слое каналов.
+        try:
+            while self.pending:
+                await asyncio.sleep(settings.NOTIFY_BATCH_DELAY)
+                batch = {'notifications': list(self.pending.values())}
+                if self.dropped:
+                    batch['dropped'] = self.dropped
+                self.pending.clear()
+                self.dropped = 0
+                try:
+                    await asyncio.wait_for(
+                        self.send(text_data=json.dumps(
+                            batch, ensure_ascii=False
+                        )),
+                        settings.NOTIFY_SEND_TIMEOUT
+                    )
+                except asyncio.TimeoutError:
+                    await self.close(code=1013)
+                    return
+        finally:
+            self.flusher = None
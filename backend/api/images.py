@@ -0,0 +1,180 @@
+import binascii
+import io
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from recipes.storage import rendition_path
+
+logger = logging.getLogger(__name__)
+
+# Длина порции base64 кратна 4, чтобы каждую можно было декодировать
+# отдельно и не держать в памяти вторую полную копию изображения.
+DECODE_CHUNK_SIZE = 64 * 1024
+RENDITION_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+
+_executor = None
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def decode_base64_image(data, name):
+    """Декодирует base64 во временный файл порциями.
+
+    Переводы строк и пробелы (base64 с переносом по 76 символов)
+    отбрасываются. Размер проверяется по длине строки до декодирования.
+    """
+    data = ''.join(data.split())
+    if len(data) * 3 // 4 > settings.MAX_IMAGE_UPLOAD_SIZE:
+        raise ImageTooLarge(
+            f'Размер изображения превышает '
+            f'{settings.MAX_IMAGE_UPLOAD_SIZE} байт'
+        )
+    if len(data) % 4:
+        raise binascii.Error('Некорректная длина base64')
+    buffer = tempfile.SpooledTemporaryFile(
+        max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+    )
+    for start in range(0, len(data), DECODE_CHUNK_SIZE):
+        buffer.write(binascii.a2b_base64(
+            data[start:start + DECODE_CHUNK_SIZE], strict_mode=True
+        ))
+    buffer.seek(0)
+    return File(buffer, name=name)
+
+
+def check_image_dimensions(file):
+    # Image.open читает только заголовок — проверяем размеры до
+    # полного декодирования пикселей.
+    position = file.tell()
+    with Image.open(file) as image:
+        width, height = image.size
+    file.seek(position)
+    if width * height > settings.MAX_IMAGE_PIXELS:
+        raise ImageTooLarge(
+            f'Изображение {width}x{height} превышает допустимое '
+            f'число пикселей'
+        )
+
+
+def resize(image, width):
+    if image.width <= width:
+        return image
+    height = round(image.height * width / image.width)
+    return image.resize((width, height), Image.LANCZOS)
+
+
+def build_renditions(name):
+    renditions = {
+        extension: {
+            str(width): rendition_path(name, width, extension)
+            for width in settings.IMAGE_RENDITION_WIDTHS
+        }
+        for extension in RENDITION_FORMATS
+    }
+    # Имя копии выводится из имени исходника, а оно — из хэша
+    # содержимого, поэтому готовые копии (тот же файл у другого
+    # рецепта) не перестраиваются.
+    missing = [
+        (extension, width, path)
+        for extension, paths in renditions.items()
+        for width, path in paths.items()
+        if not default_storage.exists(path)
+    ]
+    if missing:
+        with default_storage.open(name) as source:
+            with Image.open(source) as image:
+                image = ImageOps.exif_transpose(image).convert('RGB')
+                resized_by_width = {}
+                for extension, width, path in missing:
+                    if width not in resized_by_width:
+                        resized_by_width[width] = resize(image, int(width))
+                    resized = resized_by_width[width]
+                    output = io.BytesIO()
+                    resized.save(
+                        output, RENDITION_FORMATS[extension],
+                        quality=settings.IMAGE_RENDITION_QUALITY
+                    )
+                    default_storage.save(path, ContentFile(output.getvalue()))
+    return {'source': name, **renditions}
+
+
+def process_renditions(model, pk, field_name):
+    try:
+        instance = model.objects.filter(pk=pk).first()
+        name = getattr(instance, field_name).name if instance else None
+        if not name:
+            return
+        renditions = build_renditions(name)
+        # Сохраняем, только если исходное изображение не успело смениться
+        if not model.objects.filter(pk=pk, **{field_name: name}).exists():
+            return
+        setattr(instance, f'{field_name}_renditions', renditions)
+        # save() с update_fields, а не update(): сигналы сбрасывают кэш
+        # ответов, а auto_now-поля (updated_at) меняют ETag.
+        instance.save(update_fields=[f'{field_name}_renditions'] + [
+            field.name for field in model._meta.concrete_fields
+            if getattr(field, 'auto_now', False)
+        ])
+    except Exception:
+        logger.exception(
+            'Не удалось построить уменьшенные копии для %s %s',
+            model.__name__, pk
+        )
+
+
+def process_renditions_in_worker(model, pk, field_name):
+    close_old_connections()
+    try:
+        process_renditions(model, pk, field_name)
+    finally:
+        close_old_connections()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_RENDITION_WORKERS,
+            thread_name_prefix='image-renditions'
+        )
+    return _executor
+
+
+def schedule_renditions(instance, field_name):
+    """Ставит построение копий в очередь после коммита транзакции."""
+    model, pk = type(instance), instance.pk
+
+    def submit():
+        if settings.IMAGE_RENDITIONS_SYNC:
+            process_renditions(model, pk, field_name)
+        else:
+            get_executor().submit(
+                process_renditions_in_worker, model, pk, field_name
+            )
+
+    transaction.on_commit(submit)
+
+
+def rendition_urls(field_file, renditions, request=None):
+    if not field_file or not renditions:
+        return {}
+    if renditions.get('source') != field_file.name:
+        return {}
+    urls = {}
+    for extension in RENDITION_FORMATS:
+        for width, path in renditions.get(extension, {}).items():
+            url = default_storage.url(path)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            urls.setdefault(extension, {})[width] = url
+    return urls
@@ -0,0 +1,95 @@
+"""Уведомления в реальном времени через слой каналов Channels.
+
+Сокет NotifyConsumer входит в группу своего пользователя и в группы
+авторов, на которых пользователь подписан. Новый рецепт рассылается
+одной отправкой в группу автора: подписчиков перебирает слой каналов
+и только среди подключённых, а не запрос к БД по всем подписчикам.
+"""
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+
+def user_group(user_id):
+    return f'notify.user.{user_id}'
+
+
+def author_group(author_id):
+    return f'notify.author.{author_id}'
+
+
+def group_send(group, message):
+    layer = get_channel_layer()
+    if layer is None:
+        return
+
+    def send():
+        # Недоступный слой каналов не должен ломать уже
+        # зафиксированный запрос — уведомление просто теряется.
+        try:
+            async_to_sync(layer.group_send)(group, message)
+        except Exception:
+            logger.exception('Не удалось отправить уведомление в %s', group)
+
+    # После коммита, чтобы клиент не запросил ещё не сохранённый объект
+    transaction.on_commit(send)
+
+
+def notify(group, key, event):
+    """Событие для сокетов группы.
+
+    События с одинаковым key, пришедшие за время накопления пачки,
+    склеиваются в одно; счётчик count при этом суммируется.
+    """
+    group_send(group, {'type': 'notify.event', 'key': key, 'event': event})
+
+
+def short_user(user):
+    return {'id': user.pk, 'username': user.username}
+
+
+def short_recipe(recipe):
+    return {'id': recipe.pk, 'name': recipe.name}
+
+
+def new_recipe(recipe):
+    notify(
+        author_group(recipe.author_id), f'recipe.{recipe.pk}',
+        {
+            'type': 'recipe', 'recipe': short_recipe(recipe),
+            'author': short_user(recipe.author),
+        }
+    )
+
+
+def new_favorite(favorite):
+    recipe = favorite.recipe
+    if recipe.author_id == favorite.user_id:
+        return
+    notify(
+        user_group(recipe.author_id), f'favorite.{recipe.pk}',
+        {
+            'type': 'favorite', 'recipe': short_recipe(recipe),
+            'user': short_user(favorite.user), 'count': 1,
+        }
+    )
+
+
+def new_follower(follow):
+    notify(
+        user_group(follow.following_id), f'follower.{follow.user_id}',
+        {'type': 'follower', 'user': short_user(follow.user)}
+    )
+
+
+def subscription_changed(follow, subscribed):
+    # Открытые сокеты подписчика входят в группу автора или выходят из неё
+    group_send(user_group(follow.user_id), {
+        'type': 'notify.subscription',
+        'author': follow.following_id,
+        'subscribed': subscribed,
+    })
@@ -1,6 +1,271 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+ESTIMATE_MIN_ROWS = 10000
+
+
+def estimate_count(queryset):
+    """Оценка числа строк из pg_class.reltuples вместо COUNT(*).
+
+    Годится только для выборки без фильтров из большой таблицы
+    PostgreSQL; иначе None, и считать нужно точно.
+    """
+    query = getattr(queryset, 'query', None)
+    if query is None or query.where or query.distinct:
+        return None
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples::bigint FROM pg_class WHERE relname = %s',
+            [queryset.model._meta.db_table]
+        )
+        row = cursor.fetchone()
+    if not row or row[0] < ESTIMATE_MIN_ROWS:
+        return None
+    return row[0]
+
+
+class KeysetPagination(BasePagination):
+    """Пагинация по ключу (cursor) вместо OFFSET.
+
+    Страница выбирается условием по полям сортировки view.keyset_ordering
+    (последнее поле должно быть уникальным, обычно id), поэтому глубокие
+    страницы стоят столько же, сколько первая, и COUNT(*) не нужен.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = 10
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Некорректный курсор'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if page_size <= 0:
+            return self.page_size
+        return min(page_size, self.max_page_size)
+
+    def encode_cursor(self, values, reverse):
+        payload = json.dumps([values, reverse], default=str)
+        return base64.urlsafe_b64encode(payload.encode()).decode()
+
+    def decode_cursor(self, cursor):
+        try:
+            values, reverse = json.loads(
+                base64.urlsafe_b64decode(cursor.encode())
+            )
+        except (binascii.Error, ValueError, TypeError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return values, bool(reverse)
+
+    def clean_cursor_values(self, model, values):
+        # Курсор приходит от клиента: значения приводятся к типам полей
+        # сортировки, иначе неверный тип валит запрос с 500
+        fields = [
+            model._meta.get_field(field.lstrip('-'))
+            for field in self.ordering
+        ]
+        try:
+            values = [
+                field.to_python(value)
+                for field, value in zip(fields, values)
+            ]
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if None in values:
+            raise NotFound(self.invalid_cursor_message)
+        return values
+
+    def get_position(self, instance):
+        return [
+            getattr(instance, field.lstrip('-')) for field in self.ordering
+        ]
+
+    def get_keyset_filter(self, values, reverse):
+        # (a, b) < (x, y)  ->  a < x OR (a = x AND b < y)
+        condition = Q()
+        equal = {}
+        for field, value in zip(self.ordering, values):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            lookup = f'{name}__lt' if descending else f'{name}__gt'
+            condition |= Q(**equal, **{lookup: value})
+            equal[name] = value
+        return condition
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = getattr(view, 'keyset_ordering', self.ordering)
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_query_param)
+        values, reverse = self.decode_cursor(cursor) if cursor else (
+            None, False
+        )
+
+        ordering = self.ordering
+        if reverse:
+            ordering = [
+                field[1:] if field.startswith('-') else f'-{field}'
+                for field in ordering
+            ]
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            values = self.clean_cursor_values(queryset.model, values)
+            queryset = queryset.filter(self.get_keyset_filter(values, reverse))
+
+        results = list(queryset[:page_size + 1])
+        has_more = len(results) > page_size
+        results = results[:page_size]
+        if reverse:
+            results.reverse()
+            self.has_next = values is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = values is not None
+        self.page = results
+        return results
+
+    def get_link(self, position, reverse):
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param,
+            self.encode_cursor(position, reverse)
+        )
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.get_link(self.get_position(self.page[-1]), False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(
+                self.request.build_absolute_uri(), self.cursor_query_param
+            )
+        return self.get_link(self.get_position(self.page[0]), True)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
 
 class CustomPagination(PageNumberPagination):
     page_size_query_param = 'limit'
     page_size = 10
-    max_page_size = 100
\ No newline at end of file
+    max_page_size = 100
+    # ?cursor= включает пагинацию по ключу, ?count=none отключает COUNT(*),
+    # ?count=estimate заменяет его оценкой по статистике PostgreSQL.
+    # Без них count точный: по нему проверяется номер страницы.
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        self.skip_count = False
+        self.count_estimated = None
+        if self.cursor_query_param in request.query_params:
+            self.keyset = KeysetPagination()
+            self.keyset.page_size = self.get_page_size(request)
+            self.keyset.max_page_size = self.max_page_size
+            return self.keyset.paginate_queryset(queryset, request, view)
+        count_mode = request.query_params.get(self.count_query_param)
+        if count_mode in ('none', 'estimate'):
+            # Страницы не проверяются по числу строк: неточная оценка
+            # не должна превращать существующую страницу в 404
+            results = self.paginate_queryset_without_count(
+                queryset, request, view
+            )
+            self.count = None
+            if count_mode == 'estimate':
+                estimate = estimate_count(queryset)
+                self.count_estimated = estimate is not None
+                self.count = (
+                    queryset.count() if estimate is None else estimate
+                )
+            return results
+        return super().paginate_queryset(queryset, request, view)
+
+    def paginate_queryset_without_count(self, queryset, request, view=None):
+        self.request = request
+        self.skip_count = True
+        page_size = self.get_page_size(request)
+        try:
+            self.page_number = int(
+                request.query_params.get(self.page_query_param, 1)
+            )
+        except ValueError:
+            raise NotFound(self.invalid_page_message)
+        if self.page_number < 1:
+            raise NotFound(self.invalid_page_message)
+        offset = (self.page_number - 1) * page_size
+        results = list(queryset[offset:offset + page_size + 1])
+        self.has_next = len(results) > page_size
+        return results[:page_size]
+
+    def get_next_link(self):
+        if not self.skip_count:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        return replace_query_param(
+            self.request.build_absolute_uri(),
+            self.page_query_param, self.page_number + 1
+        )
+
+    def get_previous_link(self):
+        if not self.skip_count:
+            return super().get_previous_link()
+        if self.page_number <= 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.page_number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(
+            url, self.page_query_param, self.page_number - 1
+        )
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        if self.skip_count:
+            response = {
+                'count': self.count,
+                'next': self.get_next_link(),
+                'previous': self.get_previous_link(),
+                'results': data,
+            }
+            if self.count_estimated is not None:
+                response['count_estimated'] = self.count_estimated
+            return Response(response)
+        return super().get_paginated_response(data)
+
+
+class RankedPagination(PageNumberPagination):
+    # Страницы уже ранжированного списка (MatchResult): к нему
+    # неприменимы ни курсор, ни оценка COUNT(*) по таблице.
+    page_size_query_param = 'limit'
+    page_size = 10
+    max_page_size = 100
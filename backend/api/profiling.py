@@ -0,0 +1,259 @@
+"""Профилирование запросов: время, запросы к БД и сериализаторы.
+
+ProfilingMiddleware считает для каждого запроса число и время запросов
+к БД, время сериализаторов и общую задержку, находит повторяющиеся
+запросы (признак N+1) и отдаёт итог в заголовке Server-Timing —
+персоналу или всем при PROFILING_SERVER_TIMING. Итоги
+последних PROFILING_BUFFER_SIZE запросов процесса хранятся в памяти для
+/api/_debug/requests/ и пишутся в журнал api.profiling: обычные — на
+уровне INFO (их прореживает SamplingFilter), медленные и с повторами —
+WARNING.
+
+Текущий запрос хранится в ContextVar, поэтому учитываются и запросы к
+БД из асинхронных представлений, выполняемые в потоках sync_to_async.
+Запросы при чтении StreamingHttpResponse идут после ответа и не
+учитываются.
+"""
+import functools
+import logging
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from rest_framework.serializers import BaseSerializer
+
+logger = logging.getLogger(__name__)
+
+current_profile = ContextVar('current_profile', default=None)
+
+# ORM передаёт значения параметрами, поэтому SQL одного запроса
+# отличается только длиной списков IN и числами в LIMIT/OFFSET
+IN_LIST = re.compile(r'\bIN \(%s(?:\s*,\s*%s)*\)')
+NUMBER = re.compile(r'\b\d+\b')
+
+
+def fingerprint(sql):
+    return NUMBER.sub('N', IN_LIST.sub('IN (...)', sql))
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = Counter()
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+    def add_query(self, sql, duration):
+        self.queries[sql] += 1
+        self.db_time += duration
+
+    def duplicates(self):
+        fingerprints = Counter()
+        for sql, count in self.queries.items():
+            fingerprints[fingerprint(sql)] += count
+        return [
+            {'sql': sql, 'count': count}
+            for sql, count in fingerprints.most_common()
+            if count >= settings.PROFILING_DUPLICATE_THRESHOLD
+        ]
+
+
+def record_query(execute, sql, params, many, context):
+    profile = current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.add_query(sql, time.perf_counter() - started)
+
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    # Соединения создаются в каждом потоке, обёртку ставим на каждое
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def time_serializer(function):
+    # Вложенные сериализаторы не считаются повторно
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        profile = current_profile.get()
+        if profile is None or profile.serializer_depth:
+            return function(*args, **kwargs)
+        profile.serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profile.serializer_time += time.perf_counter() - started
+            profile.serializer_depth -= 1
+    wrapper.profiled = True
+    return wrapper
+
+
+def instrument_serializers():
+    # У DRF нет точки расширения вокруг сериализации: оборачиваем
+    # is_valid и data базового класса, через них проходят все
+    # сериализаторы, в том числе ListSerializer.
+    if getattr(BaseSerializer.is_valid, 'profiled', False):
+        return
+    BaseSerializer.is_valid = time_serializer(BaseSerializer.is_valid)
+    BaseSerializer.data = property(time_serializer(BaseSerializer.data.fget))
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None
+    view = match.func
+    view_class = getattr(view, 'cls', None) or getattr(
+        view, 'view_class', None
+    )
+    if view_class is None:
+        return f'{view.__module__}.{view.__name__}'
+    method = request.method.lower()
+    action = (getattr(view, 'actions', None) or {}).get(method, method)
+    return f'{view_class.__name__}.{action}'
+
+
+def show_server_timing(request):
+    if settings.PROFILING_SERVER_TIMING:
+        return True
+    user = getattr(request, 'user', None)
+    if isinstance(user, SimpleLazyObject):
+        # Пользователя сессии не загружаем ради заголовка: в асинхронном
+        # обработчике это был бы синхронный запрос к БД
+        user = getattr(request, '_cached_user', None)
+    return user is not None and user.is_staff
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class RequestLog:
+    """Итоги последних запросов процесса для отладочного эндпоинта."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = deque()
+
+    def add(self, record):
+        with self._lock:
+            self._records.append(record)
+            while len(self._records) > settings.PROFILING_BUFFER_SIZE:
+                self._records.popleft()
+
+    def records(self):
+        # Новые сначала
+        with self._lock:
+            return list(reversed(self._records))
+
+    def summary(self):
+        by_view = defaultdict(list)
+        for record in self.records():
+            by_view[record['view']].append(record)
+        return [
+            {
+                'view': view,
+                'requests': len(records),
+                'median_ms': percentile(
+                    [record['total_ms'] for record in records], 0.5
+                ),
+                'p95_ms': percentile(
+                    [record['total_ms'] for record in records], 0.95
+                ),
+                'max_db_queries': max(
+                    record['db_queries'] for record in records
+                ),
+                'with_duplicates': sum(
+                    1 for record in records if record['duplicates']
+                ),
+            }
+            for view, records in sorted(
+                by_view.items(), key=lambda item: -len(item[1])
+            )
+        ]
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+
+request_log = RequestLog()
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_profile.reset(token)
+        return self.finish(request, response, profile)
+
+    def finish(self, request, response, profile):
+        total = time.perf_counter() - profile.started
+        record = {
+            'timestamp': timezone.now().isoformat(),
+            'method': request.method,
+            'path': request.path,
+            'view': view_name(request),
+            'status': response.status_code,
+            'total_ms': round(total * 1000, 2),
+            'db_queries': profile.queries.total(),
+            'db_ms': round(profile.db_time * 1000, 2),
+            'serializer_ms': round(profile.serializer_time * 1000, 2),
+            'duplicates': profile.duplicates(),
+        }
+        if show_server_timing(request):
+            response['Server-Timing'] = (
+                f'db;dur={record["db_ms"]};'
+                f'desc="{record["db_queries"]} queries", '
+                f'serializer;dur={record["serializer_ms"]}, '
+                f'total;dur={record["total_ms"]}'
+            )
+        request_log.add(record)
+        if record['duplicates']:
+            logger.warning('duplicate queries', extra=record)
+        elif record['total_ms'] >= settings.PROFILING_SLOW_REQUEST_MS:
+            logger.warning('slow request', extra=record)
+        else:
+            logger.info('request', extra=record)
+        return response
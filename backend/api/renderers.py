@@ -0,0 +1,75 @@
+import abc
+import csv
+import io
+import json
+
+from rest_framework.renderers import BaseRenderer
+
+
+class ShoppingListRenderer(BaseRenderer, metaclass=abc.ABCMeta):
+    """Базовый рендерер списка покупок.
+
+    Строки списка — кортежи (название, единица измерения, количество).
+    stream() кодирует их по одной, поэтому весь список не собирается
+    в памяти; render() нужен только для ответов с ошибками.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            data = '\n'.join(f'{key}: {value}' for key, value in data.items())
+        return str(data).encode(self.charset)
+
+    @abc.abstractmethod
+    def stream(self, rows):
+        """Кодирует строки списка, возвращает итератор байтов."""
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, rows):
+        separator = ''
+        for name, measurement_unit, amount in rows:
+            yield f'{separator}{name} - {amount} {measurement_unit}'.encode(
+                self.charset
+            )
+            separator = '\n'
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(('name', 'measurement_unit', 'amount'))
+        for row in rows:
+            writer.writerow(row)
+            yield buffer.getvalue().encode(self.charset)
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue().encode(self.charset)
+
+
+class ShoppingListJSONRenderer(ShoppingListRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False).encode(self.charset)
+
+    def stream(self, rows):
+        yield b'['
+        separator = ''
+        for name, measurement_unit, amount in rows:
+            item = json.dumps({
+                'name': name,
+                'measurement_unit': measurement_unit,
+                'amount': amount,
+            }, ensure_ascii=False)
+            yield f'{separator}{item}'.encode(self.charset)
+            separator = ','
+        yield b']'
@@ -1,14 +1,21 @@
-import base64
 import re
 import uuid
 
 from psycopg2 import IntegrityError
-from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F
+from django.conf import settings
 from rest_framework import serializers
 from users.models import User, Follow
+from .images import (
+    ImageTooLarge, check_image_dimensions, decode_base64_image,
+    rendition_urls, schedule_renditions
+)
 from recipes.models import (
-    Recipe, Ingredient, IngredientInRecipe, Favorite, ShoppingCart
+    Recipe, Ingredient, IngredientInRecipe, Favorite, ShoppingCart,
+    ShoppingListItem, SimilarRecipe
 )
+from recipes.recipe_matcher import RANKINGS
 
 MIN_INGREDIENT_AMOUNT = 1
 MAX_INGREDIENT_AMOUNT = 32000
@@ -24,26 +31,46 @@ class Base64ImageField(serializers.ImageField):
                 format, imgstr = data.split(';base64,')
                 ext = format.split('/')[-1]
                 file_name = f'{uuid.uuid4()}.{ext}'
-                data = ContentFile(base64.b64decode(imgstr), name=file_name)
+                data = decode_base64_image(imgstr, file_name)
+                check_image_dimensions(data)
+            except ImageTooLarge as e:
+                raise serializers.ValidationError(str(e))
             except Exception as e:
                 raise serializers.ValidationError(f'Некорректный формат изображения: {str(e)}')
         return super().to_internal_value(data)
 
+class ImageRenditionsField(serializers.Field):
+    # URL уменьшенных копий: {'webp': {'320': url, ...}, 'jpeg': {...}}
+    def __init__(self, source_field, **kwargs):
+        self.source_field = source_field
+        kwargs.update(source='*', read_only=True)
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        return rendition_urls(
+            getattr(instance, self.source_field),
+            getattr(instance, f'{self.source_field}_renditions', None),
+            self.context.get('request')
+        )
+
 class UserSerializer(serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
+    avatar_renditions = ImageRenditionsField('avatar')
 
     class Meta:
         model = User
         fields = (
             'email', 'id', 'username', 'first_name', 'last_name',
-            'is_subscribed', 'avatar'
+            'is_subscribed', 'avatar', 'avatar_renditions'
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context.get('request')
         if not request or not request.user.is_authenticated:
             return False
-        return obj.follower.filter(user=request.user).exists()
+        return obj.following.filter(user=request.user).exists()
 
 class UserRegistrationResponseSerializer(serializers.ModelSerializer):
     class Meta:
@@ -52,28 +79,42 @@ class UserRegistrationResponseSerializer(serializers.ModelSerializer):
 
 class UserWithRecipesSerializer(UserSerializer):
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta(UserSerializer.Meta):
         fields = UserSerializer.Meta.fields + ('recipes', 'recipes_count')
 
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        recipes_limit = request.query_params.get('recipes_limit')
-        recipes = obj.recipes.all()
-        if recipes_limit:
-            recipes = recipes[:int(recipes_limit)]
+        if hasattr(obj, 'latest_recipes'):
+            recipes = obj.latest_recipes
+        else:
+            recipes = obj.recipes.all()
+            recipes_limit = self.context.get('recipes_limit')
+            if recipes_limit:
+                recipes = recipes[:recipes_limit]
         return RecipeMinifiedSerializer(recipes, many=True).data
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
     def validate(self, data):
         request = self.context.get('request')
         if request and request.user == self.instance:
             raise serializers.ValidationError('Нельзя подписаться на себя')
         return data
 
+class RecipesLimitSerializer(serializers.Serializer):
+    recipes_limit = serializers.IntegerField(min_value=1, required=False)
+
+class IdListSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False
+    )
+
+    def validate_ids(self, value):
+        if len(value) > settings.BATCH_MAX_ITEMS:
+            raise serializers.ValidationError(
+                f'Не больше {settings.BATCH_MAX_ITEMS} id за запрос'
+            )
+        return value
+
 class FollowSerializer(serializers.ModelSerializer):
     class Meta:
         model = Follow
@@ -144,6 +185,14 @@ class SetAvatarSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError('Поле avatar не может быть пустым.')
         return value
 
+    def update(self, instance, validated_data):
+        # Пользователь мог прийти из кэша токенов — остальные поля
+        # в БД могут быть новее, их не перезаписываем.
+        instance.avatar = validated_data['avatar']
+        instance.save(update_fields=['avatar'])
+        schedule_renditions(instance, 'avatar')
+        return instance
+
 class SetAvatarResponseSerializer(serializers.ModelSerializer):
     avatar = serializers.ImageField()
 
@@ -156,6 +205,10 @@ class IngredientSerializer(serializers.ModelSerializer):
         model = Ingredient
         fields = ('id', 'name', 'measurement_unit')
 
+class IngredientSearchSerializer(serializers.Serializer):
+    name = serializers.CharField(required=False, allow_blank=True, default='')
+    limit = serializers.IntegerField(min_value=1, required=False)
+
 class IngredientInRecipeSerializer(serializers.ModelSerializer):
     id = serializers.IntegerField(source='ingredient.id')
     name = serializers.CharField(source='ingredient.name')
@@ -167,10 +220,23 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
 
 class RecipeMinifiedSerializer(serializers.ModelSerializer):
     image = Base64ImageField()
+    image_renditions = ImageRenditionsField('image')
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_renditions', 'cooking_time')
+
+class SimilarRecipeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = SimilarRecipe
+        fields = ('similar', 'score')
+
+    def to_representation(self, instance):
+        data = RecipeMinifiedSerializer(
+            instance.similar, context=self.context
+        ).data
+        data['score'] = instance.score
+        return data
 
 class RecipeListSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
@@ -178,6 +244,7 @@ class RecipeListSerializer(serializers.ModelSerializer):
         source='ingredient_in_recipe', many=True, read_only=True
     )
     image = Base64ImageField()
+    image_renditions = ImageRenditionsField('image')
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
 
@@ -185,21 +252,57 @@ class RecipeListSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = (
             'id', 'author', 'ingredients', 'is_favorited',
-            'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time'
+            'is_in_shopping_cart', 'name', 'image', 'image_renditions',
+            'text', 'cooking_time'
         )
 
+    def to_representation(self, instance):
+        # Флаг подписки на автора приходит аннотацией рецепта
+        # (RecipeQuerySet.with_user_flags), передаём его в UserSerializer.
+        if hasattr(instance, 'author_is_subscribed'):
+            instance.author.is_subscribed = instance.author_is_subscribed
+        return super().to_representation(instance)
+
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         request = self.context.get('request')
         if not request or not request.user.is_authenticated:
             return False
         return obj.favorites.filter(user=request.user).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         request = self.context.get('request')
         if not request or not request.user.is_authenticated:
             return False
         return obj.in_shopping_cart.filter(user=request.user).exists()
 
+class RecipeMatchSerializer(RecipeListSerializer):
+    # Покрытие кладовой: значения выставляет filter_by_ingredients
+    matched_count = serializers.IntegerField(read_only=True)
+    missing_count = serializers.IntegerField(read_only=True)
+    jaccard = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeListSerializer.Meta):
+        fields = RecipeListSerializer.Meta.fields + (
+            'matched_count', 'missing_count', 'jaccard'
+        )
+
+class RecipeMatchParamsSerializer(serializers.Serializer):
+    ingredients = serializers.CharField()
+    max_missing = serializers.IntegerField(min_value=0, required=False)
+    ranking = serializers.ChoiceField(choices=RANKINGS, default='coverage')
+
+    def validate_ingredients(self, value):
+        ids = {int(i) for i in value.split(',') if i.strip().isdigit()}
+        if not ids:
+            raise serializers.ValidationError(
+                'Укажите id ингредиентов через запятую'
+            )
+        return ids
+
 class IngredientAmountSerializer(serializers.Serializer):
     id = serializers.IntegerField()
     amount = serializers.IntegerField(
@@ -256,21 +359,85 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         except IntegrityError as e:
             raise serializers.ValidationError(f'Ошибка при добавлении ингредиентов: {str(e)}')
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop('ingredients')
-        recipe = Recipe.objects.create(author=self.context['request'].user, **validated_data)
+        author = self.context['request'].user
+        recipe = Recipe.objects.create(author=author, **validated_data)
         self.create_ingredients(recipe, ingredients_data)
+        Recipe.objects.filter(pk=recipe.pk).update_search_vector()
+        User.objects.filter(pk=author.pk).update(
+            recipes_count=F('recipes_count') + 1
+        )
+        schedule_renditions(recipe, 'image')
         return recipe
 
+    def update_ingredients(self, recipe, ingredients_data):
+        """Приводит ингредиенты рецепта к ingredients_data.
+
+        Пишутся только отличия: новые строки — bulk_create, изменённые
+        количества — bulk_update, лишние — один DELETE по id. Прежние
+        строки сохраняют id, а таблица и индексы не перезаписываются
+        целиком на каждое редактирование. Возвращает изменения
+        количеств {ingredient_id: delta} и признак смены состава.
+        """
+        amounts = {data['id']: data['amount'] for data in ingredients_data}
+        current = {
+            item.ingredient_id: item
+            for item in IngredientInRecipe.objects.filter(recipe=recipe)
+        }
+        deltas = {}
+        changed = []
+        removed = []
+        for ingredient_id, item in current.items():
+            amount = amounts.get(ingredient_id)
+            if amount is None:
+                removed.append(item.pk)
+                deltas[ingredient_id] = -item.amount
+            elif amount != item.amount:
+                deltas[ingredient_id] = amount - item.amount
+                item.amount = amount
+                changed.append(item)
+        added = [
+            data for data in ingredients_data if data['id'] not in current
+        ]
+        for data in added:
+            deltas[data['id']] = data['amount']
+        if removed:
+            IngredientInRecipe.objects.filter(pk__in=removed).delete()
+        if changed:
+            IngredientInRecipe.objects.bulk_update(changed, ['amount'])
+        if added:
+            self.create_ingredients(recipe, added)
+        return deltas, bool(removed or added)
+
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients_data = validated_data.pop('ingredients', None)
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
-        instance.save()
+        # Только изменённые поля: счётчики в прочитанной строке могли
+        # устареть, их параллельно увеличивают через F()
+        instance.save(update_fields=[*validated_data, 'updated_at'])
 
+        # Поисковый вектор зависит от названия, текста и состава
+        reindex = bool({'name', 'text'} & validated_data.keys())
         if ingredients_data:
-            instance.ingredient_in_recipe.all().delete()
-            self.create_ingredients(instance, ingredients_data)
+            deltas, composition_changed = self.update_ingredients(
+                instance, ingredients_data
+            )
+            reindex = reindex or composition_changed
+            if deltas:
+                ShoppingListItem.objects.apply_deltas(
+                    instance.in_shopping_cart.values_list(
+                        'user_id', flat=True
+                    ),
+                    deltas
+                )
+        if reindex:
+            Recipe.objects.filter(pk=instance.pk).update_search_vector()
+        if 'image' in validated_data:
+            schedule_renditions(instance, 'image')
 
         return instance
 
@@ -0,0 +1,111 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from api import notifications
+from api.authentication import token_cache
+from api.cache import bump_versions, object_version_name
+from recipes.models import (
+    Favorite, Ingredient, IngredientInRecipe, Recipe, ShoppingCart
+)
+from users.models import Follow, User
+
+
+def invalidate_recipes(recipe_ids=()):
+    # Версии меняются после коммита, чтобы параллельный запрос не успел
+    # закэшировать ещё не зафиксированное состояние рецепта.
+    names = ['recipes'] + [
+        object_version_name('recipes', pk) for pk in recipe_ids
+    ]
+    transaction.on_commit(lambda: bump_versions(*names))
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def invalidate_recipe(sender, instance, **kwargs):
+    invalidate_recipes([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=IngredientInRecipe)
+def invalidate_recipe_ingredients(sender, instance, **kwargs):
+    invalidate_recipes([instance.recipe_id])
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredient(sender, instance, **kwargs):
+    transaction.on_commit(lambda: bump_versions(
+        'ingredients', object_version_name('ingredients', instance.pk)
+    ))
+    recipes = Recipe.objects.filter(ingredient_in_recipe__ingredient=instance)
+    invalidate_recipes(list(recipes.values_list('pk', flat=True)))
+    if kwargs.get('signal') is post_save:
+        touch_recipes(recipes)
+
+
+@receiver(post_save, sender=User)
+def invalidate_author(sender, instance, created, **kwargs):
+    # Данные автора (аватар, имя) входят в ответы по его рецептам
+    if not created:
+        invalidate_recipes(instance.recipes.values_list('pk', flat=True))
+        touch_recipes(instance.recipes.all())
+
+
+@receiver([post_save, post_delete], sender=Favorite)
+@receiver([post_save, post_delete], sender=ShoppingCart)
+@receiver([post_save, post_delete], sender=Follow)
+def invalidate_user_flags(sender, instance, **kwargs):
+    name = object_version_name('user-flags', instance.user_id)
+    transaction.on_commit(lambda: bump_versions(name))
+
+
+@receiver(post_delete, sender=Token)
+def revoke_cached_token(sender, instance, **kwargs):
+    # key — первичный ключ, после удаления он у экземпляра сброшен
+    key = instance.key
+    transaction.on_commit(lambda: token_cache.invalidate(key))
+
+
+@receiver(post_save, sender=User)
+def invalidate_cached_tokens(sender, instance, created, **kwargs):
+    # Кэш токенов хранит пользователя целиком: смена пароля, блокировка
+    # или новый аватар должны дойти до следующего запроса.
+    if created:
+        return
+    keys = list(Token.objects.filter(user=instance).values_list(
+        'key', flat=True
+    ))
+    if keys:
+        transaction.on_commit(lambda: token_cache.invalidate(*keys))
+
+
+@receiver(post_save, sender=Recipe)
+def notify_new_recipe(sender, instance, created, **kwargs):
+    if created:
+        notifications.new_recipe(instance)
+
+
+@receiver(post_save, sender=Favorite)
+def notify_new_favorite(sender, instance, created, **kwargs):
+    if created:
+        notifications.new_favorite(instance)
+
+
+@receiver(post_save, sender=Follow)
+def notify_new_follower(sender, instance, created, **kwargs):
+    if created:
+        notifications.new_follower(instance)
+        notifications.subscription_changed(instance, subscribed=True)
+
+
+@receiver(post_delete, sender=Follow)
+def notify_unsubscribed(sender, instance, **kwargs):
+    notifications.subscription_changed(instance, subscribed=False)
+
+
+def touch_recipes(recipes):
+    # updated_at служит валидатором ETag/Last-Modified для рецепта,
+    # поэтому сдвигаем его, когда меняются связанные данные.
+    Recipe.objects.filter(
+        pk__in=list(recipes.values_list('pk', flat=True))
+    ).update(updated_at=timezone.now())
@@ -1,36 +1,124 @@
 from django.contrib.auth import authenticate, logout
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import F, Prefetch, Value
+from django.db.models.functions import Greatest
+from django.http import Http404, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
 from rest_framework.permissions import (
-    IsAuthenticated, IsAuthenticatedOrReadOnly, AllowAny
+    IsAdminUser, IsAuthenticated, IsAuthenticatedOrReadOnly, AllowAny
 )
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.authtoken.models import Token
 from users.models import User, Follow
+from recipes.ingredient_index import ingredient_index
+from recipes.recipe_matcher import recipe_matcher
+from recipes.short_links import make_code
 from recipes.models import (
-    Recipe, Ingredient, IngredientInRecipe, Favorite, ShoppingCart
+    Recipe, Ingredient, Favorite, ShoppingCart, ShoppingListItem,
+    SimilarRecipe, TimelineEntry
 )
 from .serializers import (
     UserSerializer, UserWithRecipesSerializer, SetAvatarSerializer,
-    SetAvatarResponseSerializer, IngredientSerializer, RecipeListSerializer,
-    RecipeCreateSerializer, RecipeMinifiedSerializer,
-    RecipeGetShortLinkSerializer, SetPasswordSerializer,
+    SetAvatarResponseSerializer, IngredientSerializer,
+    IngredientSearchSerializer, RecipeListSerializer,
+    RecipeCreateSerializer, RecipeMinifiedSerializer, RecipeMatchSerializer,
+    RecipeMatchParamsSerializer, SimilarRecipeSerializer,
+    RecipeGetShortLinkSerializer, RecipesLimitSerializer, SetPasswordSerializer,
+    IdListSerializer,
     TokenCreateSerializer, TokenGetResponseSerializer,
     CustomUserCreateSerializer, UserRegistrationResponseSerializer, FollowSerializer
 )
+from .cache import ResponseCacheMixin, apply_user_overlay
+from .profiling import request_log
+from .conditional import ConditionalGetMixin, RecipeConditionalGetMixin
 from .permissions import IsAuthorOrReadOnly
-from .pagination import CustomPagination
+from .pagination import (
+    CustomPagination, KeysetPagination, RankedPagination
+)
+from .renderers import (
+    ShoppingListTextRenderer, ShoppingListCSVRenderer,
+    ShoppingListJSONRenderer
+)
 from .filters import IngredientFilter, RecipeFilter
 from django.conf import settings
 from django.core.mail import send_mail
 from django.utils.crypto import get_random_string
 from django.urls import reverse
 
+SHOPPING_LIST_CHUNK_SIZE = 2000
+# Счётчики рецепта, которые ведутся по спискам пользователей
+RECIPE_LIST_COUNTERS = {
+    Favorite: 'favorites_count', ShoppingCart: 'in_carts_count'
+}
+
+
+def add_to_recipe_list(model, user, recipes):
+    # Возвращает новые записи и id удалённых за это время рецептов;
+    # рецепты, уже бывшие в списке, пропускаются
+    with transaction.atomic():
+        added, missing = model.objects.add_many(user, recipes)
+        recipe_ids = [relation.recipe_id for relation in added]
+        if recipe_ids:
+            counter = RECIPE_LIST_COUNTERS[model]
+            Recipe.objects.filter(pk__in=recipe_ids).update(
+                **{counter: F(counter) + 1}
+            )
+            if model is ShoppingCart:
+                ShoppingListItem.objects.add_recipes([user.id], recipe_ids)
+    return added, missing
+
+
+def remove_from_recipe_list(model, user, recipe_ids):
+    with transaction.atomic():
+        removed = model.objects.remove_many(user, recipe_ids)
+        recipe_ids = [relation.recipe_id for relation in removed]
+        if recipe_ids:
+            counter = RECIPE_LIST_COUNTERS[model]
+            Recipe.objects.filter(pk__in=recipe_ids).update(
+                **{counter: Greatest(F(counter) - 1, 0)}
+            )
+            if model is ShoppingCart:
+                ShoppingListItem.objects.remove_recipes(
+                    [user.id], recipe_ids
+                )
+    return removed
+
+
+def follow_authors(user, authors):
+    with transaction.atomic():
+        added, missing = Follow.objects.add_many(user, authors)
+        if added:
+            User.objects.filter(
+                pk__in=[follow.following_id for follow in added]
+            ).update(followers_count=F('followers_count') + 1)
+    return added, missing
+
+
+def unfollow_authors(user, author_ids):
+    with transaction.atomic():
+        removed = Follow.objects.remove_many(user, author_ids)
+        if removed:
+            User.objects.filter(
+                pk__in=[follow.following_id for follow in removed]
+            ).update(followers_count=Greatest(F('followers_count') - 1, 0))
+    return removed
+
+
+def batch_ids(request):
+    params = IdListSerializer(data=request.data)
+    params.is_valid(raise_exception=True)
+    return list(dict.fromkeys(params.validated_data['ids']))
+
+
+def batch_response(ids, statuses, default):
+    return Response({'results': [
+        {'id': pk, 'status': statuses.get(pk, default)} for pk in ids
+    ]})
+
 
 class CustomUserRegistrationView(APIView):
     permission_classes = [AllowAny]
@@ -54,6 +142,7 @@ class UserViewSet(viewsets.ModelViewSet):
     serializer_class = UserSerializer
     pagination_class = CustomPagination
     permission_classes = [IsAuthenticatedOrReadOnly]
+    keyset_ordering = ('date_joined', 'id')
 
     def get_permissions(self):
         if self.action in ['list', 'retrieve', 'info', 'without_recipes']:
@@ -96,14 +185,35 @@ class UserViewSet(viewsets.ModelViewSet):
                 SetAvatarResponseSerializer(request.user).data,
                 status=status.HTTP_200_OK
             )
-        request.user.avatar.delete()
+        # Файл может использоваться другими записями — его удалит
+        # сборщик мусора StoredFile, когда на него не останется ссылок.
+        request.user.avatar = None
+        request.user.avatar_renditions = {}
+        request.user.save(update_fields=['avatar', 'avatar_renditions'])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
     def subscriptions(self, request):
-        queryset = User.objects.filter(following__user=request.user)
+        params = RecipesLimitSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        recipes_limit = params.validated_data.get('recipes_limit')
+        queryset = User.objects.filter(
+            following__user=request.user
+        ).annotate(
+            is_subscribed=Value(True),
+        ).prefetch_related(
+            Prefetch(
+                'recipes',
+                queryset=Recipe.objects.latest_per_author(recipes_limit),
+                to_attr='latest_recipes'
+            )
+        ).order_by('-following__id')
         page = self.paginate_queryset(queryset)
-        serializer = self.get_serializer(page, many=True)
+        serializer = self.get_serializer(
+            page, many=True,
+            context={**self.get_serializer_context(),
+                     'recipes_limit': recipes_limit}
+        )
         return self.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=['post', 'delete'], permission_classes=[IsAuthenticated])
@@ -111,28 +221,56 @@ class UserViewSet(viewsets.ModelViewSet):
         user = request.user
         following = get_object_or_404(User, id=pk)
         if request.method == 'POST':
+            params = RecipesLimitSerializer(data=request.query_params)
+            params.is_valid(raise_exception=True)
             if user == following:
                 return Response(
                     {'errors': 'Нельзя подписаться на самого себя'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            if Follow.objects.filter(user=user, following=following).exists():
+            added, missing = follow_authors(user, [following])
+            if missing:
+                raise Http404
+            if not added:
                 return Response(
                     {'errors': 'Вы уже подписаны на этого пользователя'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            follow = Follow.objects.create(user=user, following=following)
-            serializer = FollowSerializer(follow, context={'request': request})
+            serializer = FollowSerializer(added[0], context={
+                'request': request,
+                'recipes_limit': params.validated_data.get('recipes_limit'),
+            })
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        if not Follow.objects.filter(user=user, following=following).exists():
+        if not unfollow_authors(user, [following.pk]):
             return Response(
                 {'errors': 'Подписка не существует'},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        follow = Follow.objects.get(user=user, following=following)
-        follow.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(
+        detail=False, methods=['post', 'delete'], url_path='subscribe',
+        url_name='subscribe-batch'
+    )
+    def subscribe_batch(self, request):
+        # {"ids": [...]}: подписка на авторов или отписка одним запросом
+        user = request.user
+        ids = batch_ids(request)
+        if request.method == 'POST':
+            authors = User.objects.in_bulk(ids)
+            statuses = {pk: 'exists' for pk in authors}
+            statuses[user.pk] = 'self'
+            authors.pop(user.pk, None)
+            added, missing = follow_authors(user, authors.values())
+            statuses.update(dict.fromkeys(missing, 'not_found'))
+            for follow in added:
+                statuses[follow.following_id] = 'created'
+            return batch_response(ids, statuses, 'not_found')
+        return batch_response(ids, {
+            follow.following_id: 'deleted'
+            for follow in unfollow_authors(user, ids)
+        }, 'missing')
+
     @action(detail=True, methods=['get'], url_path='info', permission_classes=[AllowAny])
     def info(self, request, pk=None):
         user = get_object_or_404(User, id=pk)
@@ -147,15 +285,34 @@ class UserViewSet(viewsets.ModelViewSet):
         return self.get_paginated_response(serializer.data)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(RecipeConditionalGetMixin, ResponseCacheMixin,
+                    viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     permission_classes = [IsAuthorOrReadOnly]
     pagination_class = CustomPagination
+    keyset_ordering = ('-created_at', '-id')
     filter_backends = [DjangoFilterBackend, filters.OrderingFilter]
     filterset_class = RecipeFilter
+    response_cache_namespace = 'recipes'
+    response_cache_overlay = staticmethod(apply_user_overlay)
+    response_cache_bypass_params = ('is_favorited', 'is_in_shopping_cart')
+    ordering_fields = (
+        'created_at', 'name', 'cooking_time',
+        'favorites_count', 'in_carts_count'
+    )
+
+    def get_queryset(self):
+        return Recipe.objects.with_related().with_user_flags(
+            self.request.user
+        )
 
     def get_permissions(self):
-        # Все GET-запросы доступны всем
+        # Все GET-запросы, кроме личной ленты, доступны всем
+        if self.action in [
+            'feed', 'favorite', 'shopping_cart',
+            'favorite_batch', 'shopping_cart_batch'
+        ]:
+            return [IsAuthenticated()]
         if self.request.method in ['GET', 'HEAD', 'OPTIONS']:
             return [AllowAny()]
         return [IsAuthorOrReadOnly()]
@@ -180,101 +337,212 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         return serializer.save()
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        ShoppingListItem.objects.remove_recipe(
+            instance.in_shopping_cart.values_list('user_id', flat=True),
+            instance
+        )
+        User.objects.filter(pk=instance.author_id).update(
+            recipes_count=Greatest(F('recipes_count') - 1, 0)
+        )
+        instance.delete()
+
     def update(self, request, *args, **kwargs):
         instance = self.get_object()
         serializer = self.get_serializer(instance, data=request.data, partial=True)
         serializer.is_valid(raise_exception=True)
         self.perform_update(serializer)
+        # Ингредиенты были предзагружены до обновления — сбрасываем кэш
+        if getattr(instance, '_prefetched_objects_cache', None):
+            instance._prefetched_objects_cache = {}
         return Response(serializer.data)
 
-    @action(detail=True, methods=['post', 'delete'], permission_classes=[IsAuthenticated])
-    def favorite(self, request, pk=None):
-        user = request.user
+    def change_recipe_list(self, request, pk, model, messages):
         recipe = get_object_or_404(Recipe, id=pk)
         if request.method == 'POST':
-            if recipe.favorites.filter(user=user).exists():
+            added, missing = add_to_recipe_list(
+                model, request.user, [recipe]
+            )
+            if missing:
+                raise Http404
+            if not added:
                 return Response(
-                    {'errors': 'Рецепт уже в избранном'},
+                    {'errors': messages[0]},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            Favorite.objects.create(user=user, recipe=recipe)
             serializer = self.get_serializer(recipe)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
-        if not recipe.favorites.filter(user=user).exists():
+        if not remove_from_recipe_list(model, request.user, [recipe.pk]):
             return Response(
-                {'errors': 'Рецепт не в избранном'},
+                {'errors': messages[1]},
                 status=status.HTTP_400_BAD_REQUEST
             )
-        favorite = Favorite.objects.get(user=user, recipe=recipe)
-        favorite.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-    @action(detail=True, methods=['post', 'delete'], permission_classes=[IsAuthenticated])
-    def shopping_cart(self, request, pk=None):
-        user = request.user
-        recipe = get_object_or_404(Recipe, id=pk)
+    def change_recipe_list_batch(self, request, model):
+        # {"ids": [...]}: результат по каждому id вместо ошибки на первом
+        ids = batch_ids(request)
         if request.method == 'POST':
-            if recipe.in_shopping_cart.filter(user=user).exists():
-                return Response(
-                    {'errors': 'Рецепт уже в списке покупок'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            ShoppingCart.objects.create(user=user, recipe=recipe)
-            serializer = self.get_serializer(recipe)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        if not recipe.in_shopping_cart.filter(user=user).exists():
-            return Response(
-                {'errors': 'Рецепт не в списке покупок'},
-                status=status.HTTP_400_BAD_REQUEST
+            recipes = Recipe.objects.in_bulk(ids)
+            statuses = {pk: 'exists' for pk in recipes}
+            added, missing = add_to_recipe_list(
+                model, request.user, recipes.values()
             )
-        cart = ShoppingCart.objects.get(user=user, recipe=recipe)
-        cart.delete()
-        return Response(status=status.HTTP_204_NO_CONTENT)
-
-    @action(detail=True, methods=['get'])
+            statuses.update(dict.fromkeys(missing, 'not_found'))
+            for relation in added:
+                statuses[relation.recipe_id] = 'created'
+            return batch_response(ids, statuses, 'not_found')
+        return batch_response(ids, {
+            relation.recipe_id: 'deleted'
+            for relation in remove_from_recipe_list(model, request.user, ids)
+        }, 'missing')
+
+    @action(detail=True, methods=['post', 'delete'])
+    def favorite(self, request, pk=None):
+        return self.change_recipe_list(request, pk, Favorite, (
+            'Рецепт уже в избранном', 'Рецепт не в избранном'
+        ))
+
+    @action(
+        detail=False, methods=['post', 'delete'], url_path='favorite',
+        url_name='favorite-batch'
+    )
+    def favorite_batch(self, request):
+        return self.change_recipe_list_batch(request, Favorite)
+
+    @action(detail=True, methods=['post', 'delete'])
+    def shopping_cart(self, request, pk=None):
+        return self.change_recipe_list(request, pk, ShoppingCart, (
+            'Рецепт уже в списке покупок', 'Рецепт не в списке покупок'
+        ))
+
+    @action(
+        detail=False, methods=['post', 'delete'], url_path='shopping_cart',
+        url_name='shopping-cart-batch'
+    )
+    def shopping_cart_batch(self, request):
+        return self.change_recipe_list_batch(request, ShoppingCart)
+
+    @action(detail=True, methods=['get'], url_path='get-link')
     def get_link(self, request, pk=None):
         recipe = get_object_or_404(Recipe, id=pk)
-        short_link = f'{settings.BASE_URL}/s/{recipe.id}'
+        short_link = f'{settings.BASE_URL}/s/{make_code(recipe.id)}'
         return Response({'short-link': short_link}, status=status.HTTP_200_OK)
 
-    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
+    @action(
+        detail=False, methods=['get'], pagination_class=KeysetPagination
+    )
+    def feed(self, request):
+        # Лента собрана заранее (TimelineEntry); рецепты популярных
+        # авторов подтягиваются в неё при чтении.
+        TimelineEntry.objects.sync(request.user)
+        if KeysetPagination.cursor_query_param not in request.query_params:
+            TimelineEntry.objects.trim(request.user)
+        queryset = self.get_queryset().filter(
+            timeline_entries__user=request.user
+        )
+        page = self.paginate_queryset(queryset)
+        serializer = RecipeListSerializer(
+            page, many=True, context={'request': request}
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        # Соседи рассчитываются заранее командой build_similar_recipes
+        recipe = get_object_or_404(Recipe.objects.only('id'), id=pk)
+        similar = SimilarRecipe.objects.filter(
+            recipe=recipe
+        ).select_related('similar').order_by('-score')
+        serializer = SimilarRecipeSerializer(
+            similar, many=True, context={'request': request}
+        )
+        return Response(serializer.data)
+
+    @action(
+        detail=False, methods=['get'], permission_classes=[IsAuthenticated],
+        renderer_classes=[
+            ShoppingListTextRenderer, ShoppingListCSVRenderer,
+            ShoppingListJSONRenderer
+        ]
+    )
     def download_shopping_cart(self, request):
-        user = request.user
-        ingredients = IngredientInRecipe.objects.filter(
-            recipe__in_shopping_cart__user=user
-        ).values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(total_amount=Sum('amount')).order_by('ingredient__name')
-
-        content = '\n'.join([
-            f"{item['ingredient__name']} - {item['total_amount']} {item['ingredient__measurement_unit']}"
-            for item in ingredients
-        ])
-        response = HttpResponse(content, content_type='text/plain')
-        response['Content-Disposition'] = 'attachment; filename="shopping_list.txt"'
+        # Формат выбирается через ?format=txt|csv|json или заголовок Accept;
+        # итоги хранятся в ShoppingListItem, строки читаются курсором порциями.
+        rows = ShoppingListItem.objects.filter(
+            user=request.user
+        ).values_list(
+            'ingredient__name', 'ingredient__measurement_unit', 'total_amount'
+        ).order_by('ingredient__name', 'ingredient__measurement_unit')
+
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(rows.iterator(chunk_size=SHOPPING_LIST_CHUNK_SIZE)),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping_list.{renderer.format}"'
+        )
         return response
 
-    @action(detail=False, methods=['get'], url_path='filter_by_ingredients')
+    @action(
+        detail=False, methods=['get'], url_path='filter_by_ingredients',
+        pagination_class=RankedPagination
+    )
     def filter_by_ingredients(self, request):
-        ingredients_param = request.query_params.get('ingredients')
-        if not ingredients_param:
-            return Response({'error': 'Необходимо указать параметр ingredients'}, status=status.HTTP_400_BAD_REQUEST)
-        try:
-            ingredient_ids = [int(i) for i in ingredients_param.split(',') if i.strip().isdigit()]
-        except ValueError:
-            return Response({'error': 'Некорректный формат параметра ingredients'}, status=status.HTTP_400_BAD_REQUEST)
-        queryset = self.get_queryset().filter(ingredient_in_recipe__ingredient__id__in=ingredient_ids).distinct()
-        page = self.paginate_queryset(queryset)
-        serializer = RecipeListSerializer(page, many=True, context={'request': request})
+        # Ранжирование по кладовой считает индекс в памяти
+        # (recipe_matcher), из БД читается только текущая страница.
+        params = RecipeMatchParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        matches = recipe_matcher.match(
+            params.validated_data['ingredients'],
+            max_missing=params.validated_data.get('max_missing'),
+            ranking=params.validated_data['ranking']
+        )
+        page = self.paginate_queryset(matches)
+        recipes = self.get_queryset().in_bulk(
+            [match['id'] for match in page]
+        )
+        results = []
+        for match in page:
+            recipe = recipes.get(match['id'])
+            if recipe is None:
+                continue
+            recipe.matched_count = match['matched']
+            recipe.missing_count = match['missing']
+            recipe.jaccard = round(match['jaccard'], 4)
+            results.append(recipe)
+        serializer = RecipeMatchSerializer(
+            results, many=True, context={'request': request}
+        )
         return self.get_paginated_response(serializer.data)
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(ConditionalGetMixin, ResponseCacheMixin,
+                        viewsets.ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     filter_backends = [DjangoFilterBackend]
     filterset_class = IngredientFilter
     pagination_class = None
+    response_cache_namespace = 'ingredients'
+    conditional_namespace = 'ingredients'
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request, self.get_namespace_validators(request),
+            self.search_ingredients
+        )
+
+    def search_ingredients(self, request):
+        # Поиск по префиксу обслуживается индексом в памяти, без запросов к БД
+        params = IngredientSearchSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return Response(ingredient_index.search(
+            params.validated_data['name'],
+            params.validated_data.get('limit')
+        ))
 
 
 class AuthTokenView(APIView):
@@ -298,6 +566,22 @@ class AuthTokenView(APIView):
         )
 
 
+class RequestProfileView(APIView):
+    # Итоги последних запросов этого процесса (api/profiling.py):
+    # ?view=RecipeViewSet.list — только одно представление
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        records = request_log.records()
+        view = request.query_params.get('view')
+        if view:
+            records = [record for record in records if record['view'] == view]
+        return Response({
+            'summary': request_log.summary(),
+            'requests': records,
+        })
+
+
 class LogoutView(APIView):
     permission_classes = [IsAuthenticated]
 
@@ -315,7 +599,9 @@ class SetPasswordView(APIView):
         serializer.is_valid(raise_exception=True)
         user = request.user
         user.set_password(serializer.validated_data['new_password'])
-        user.save()
+        # request.user мог прийти из кэша токенов: сохраняем только
+        # пароль, чтобы не затереть свежие счётчики старыми значениями.
+        user.save(update_fields=['password'])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -0,0 +1,9 @@
+# Корневые маршруты для ASGI-воркеров: асинхронные обработчики горячих
+# GET-эндпоинтов (api.async_views) стоят перед обычными маршрутами.
+from django.urls import include, path
+
+from foodgram.urls import urlpatterns as sync_urlpatterns
+
+urlpatterns = [
+    path('api/', include('api.async_urls')),
+] + sync_urlpatterns
@@ -0,0 +1,8 @@
+"""Общие проверки настроек кэша."""
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+
+def is_shared(cache):
+    """Видят ли записи кэша другие процессы (Redis, Memcached, БД)."""
+    return not isinstance(cache, (LocMemCache, DummyCache))
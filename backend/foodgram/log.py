@@ -0,0 +1,39 @@
+"""Форматтер и фильтр журнала, подключаемые через settings.LOGGING."""
+import json
+import logging
+import random
+
+# Атрибуты любой записи журнала; остальные пришли через extra
+STANDARD_ATTRS = set(vars(logging.makeLogRecord({}))) | {
+    'message', 'asctime', 'taskName'
+}
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON с полями из extra."""
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update(
+            (name, value) for name, value in vars(record).items()
+            if name not in STANDARD_ATTRS
+        )
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает долю rate записей ниже WARNING, остальные — все."""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or random.random() < self.rate
@@ -0,0 +1,122 @@
+"""Менеджеры, общие для моделей разных приложений."""
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models.signals import post_delete, post_save
+
+
+class UserRelationManager(models.Manager):
+    """Связи пользователя с объектами (подписки, избранное, корзина).
+
+    Пачка id добавляется одним INSERT ... ON CONFLICT DO NOTHING и
+    удаляется одним DELETE: повтор отсекает уникальное ограничение, а
+    не проверка перед записью. bulk_create(ignore_conflicts=True) не
+    сообщает, какие строки вставлены, а от этого зависят счётчики и
+    ответ по каждому id, поэтому запросы пишутся с RETURNING
+    (PostgreSQL, SQLite 3.35+). Для каждой вставленной и удалённой
+    строки отправляются post_save и post_delete, как при create() и
+    delete(): на них держатся кэши, лента и уведомления. Объект,
+    удалённый между выборкой и вставкой, не срывает пачку: его id
+    возвращается как отсутствующий.
+    """
+
+    @property
+    def target(self):
+        # Второй внешний ключ модели, кроме user: recipe, following
+        return next(
+            field.name for field in self.model._meta.fields
+            if field.many_to_one and field.name != 'user'
+        )
+
+    def columns(self):
+        opts = self.model._meta
+        return (
+            opts.db_table, opts.pk.column, opts.get_field('user').column,
+            opts.get_field(self.target).column
+        )
+
+    def relations(self, user, rows, targets=None):
+        _, pk, user_column, target_column = self.columns()
+        relations = []
+        for row in rows:
+            relation = self.model.from_db(
+                self.db, [pk, user_column, target_column],
+                (row[0], user.pk, row[1])
+            )
+            # Обработчики сигналов не должны догружать объекты из БД
+            relation.user = user
+            if targets is not None:
+                setattr(relation, self.target, targets[row[1]])
+            relations.append(relation)
+        return relations
+
+    def insert(self, user, target_ids):
+        table, pk, user_column, target_column = self.columns()
+        connection = connections[self.db]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} ({user_column}, {target_column}) '
+                f'VALUES {", ".join(["(%s, %s)"] * len(target_ids))} '
+                f'ON CONFLICT DO NOTHING RETURNING {pk}, {target_column}',
+                [value for target_id in target_ids
+                 for value in (user.pk, target_id)]
+            )
+            rows = cursor.fetchall()
+        # Внешние ключи проверяются при COMMIT; проверяем сразу, пока
+        # откатить можно одну эту вставку
+        connection.check_constraints(table_names=[table])
+        return rows
+
+    def add_many(self, user, targets):
+        """Связывает user с объектами targets.
+
+        Возвращает новые связи и множество id объектов, которых уже
+        нет в БД.
+        """
+        targets = {target.pk: target for target in targets}
+        if not targets:
+            return [], set()
+        try:
+            with transaction.atomic(using=self.db):
+                rows = self.insert(user, list(targets))
+        except IntegrityError:
+            target_model = self.model._meta.get_field(
+                self.target
+            ).related_model
+            existing = set(
+                target_model._base_manager.using(self.db)
+                .filter(pk__in=targets).values_list('pk', flat=True)
+            )
+            created, missing = self.add_many(user, [
+                target for target_id, target in targets.items()
+                if target_id in existing
+            ])
+            return created, missing | (targets.keys() - existing)
+        created = self.relations(user, rows, targets)
+        for relation in created:
+            post_save.send(
+                sender=self.model, instance=relation, created=True,
+                update_fields=None, raw=False, using=self.db
+            )
+        return created, set()
+
+    def remove_many(self, user, target_ids):
+        """Удаляет связи user с target_ids, возвращает удалённые."""
+        target_ids = list(dict.fromkeys(target_ids))
+        if not target_ids:
+            return []
+        table, pk, user_column, target_column = self.columns()
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {table} WHERE {user_column} = %s '
+                f'AND {target_column} IN '
+                f'({", ".join(["%s"] * len(target_ids))}) '
+                f'RETURNING {pk}, {target_column}',
+                [user.pk, *target_ids]
+            )
+            rows = cursor.fetchall()
+        deleted = self.relations(user, rows)
+        for relation in deleted:
+            post_delete.send(
+                sender=self.model, instance=relation, using=self.db,
+                origin=relation
+            )
+        return deleted
@@ -1,4 +1,5 @@
 import os
+import sys
 from pathlib import Path
 from dotenv import load_dotenv
 import dj_database_url
@@ -26,6 +27,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     # Сторонние приложения
     'rest_framework',
     'rest_framework.authtoken',
@@ -41,6 +43,8 @@ INSTALLED_APPS = [
 
 # Middleware
 MIDDLEWARE = [
+    # Первым, чтобы время запроса включало остальные middleware
+    'api.profiling.ProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # Для обработки CORS
@@ -56,8 +60,10 @@ MIDDLEWARE = [
 CORS_ALLOWED_ORIGINS = ['http://localhost:3000', 'http://localhost']
 CORS_ALLOW_CREDENTIALS = True
 
-# Корневой URL-конфиг
-ROOT_URLCONF = 'foodgram.urls'
+# Корневой URL-конфиг. Под ASGI-воркерами (uvicorn, daphne) горячие
+# GET-эндпоинты можно обслуживать асинхронными обработчиками
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', 'False') == 'True'
+ROOT_URLCONF = 'foodgram.async_urls' if ASYNC_READ_VIEWS else 'foodgram.urls'
 
 # Настройки шаблонов
 TEMPLATES = [
@@ -100,6 +106,48 @@ DATABASES = {
 #     }
 # }
 
+# Кэш: в памяти процесса по умолчанию, Redis — если задан REDIS_URL
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Слой каналов для уведомлений по WebSocket: в памяти процесса (только
+# для разработки и тестов — не видит событий других процессов) или Redis
+if os.getenv('REDIS_URL'):
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [os.getenv('REDIS_URL')]},
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'api.channel_layers.InMemoryChannelLayer',
+        }
+    }
+
+# Кэш ответов API для рецептов и ингредиентов (0 — выключен)
+RESPONSE_CACHE_ALIAS = 'default'
+RESPONSE_CACHE_TIMEOUT = int(os.getenv('RESPONSE_CACHE_TIMEOUT', 60))
+# Без общего кэша (REDIS_URL) версии и ответы хранятся в памяти
+# каждого процесса, и изменение, сделанное в одном процессе, другие не
+# видят: там ответы живут не дольше RESPONSE_CACHE_LOCAL_TIMEOUT секунд.
+# Для нескольких процессов в продакшене задайте REDIS_URL.
+RESPONSE_CACHE_LOCAL_TIMEOUT = int(
+    os.getenv('RESPONSE_CACHE_LOCAL_TIMEOUT', 5)
+)
+
 # Аутентификация
 AUTH_USER_MODEL = 'users.User'
 AUTHENTICATION_BACKENDS = [
@@ -111,7 +159,7 @@ AUTHENTICATION_BACKENDS = [
 # Настройки REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
@@ -120,6 +168,15 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 6,  # Значение по умолчанию для пагинации
 }
 
+# Кэш токенов аутентификации: в общем кэше на AUTH_TOKEN_CACHE_TTL
+# секунд и в LRU процесса на AUTH_TOKEN_LOCAL_TTL секунд — столько
+# отозванный токен может действовать в других процессах. Без REDIS_URL
+# общего кэша нет, и токены кэшируются только в LRU процесса.
+AUTH_TOKEN_CACHE_ALIAS = 'default'
+AUTH_TOKEN_CACHE_TTL = int(os.getenv('AUTH_TOKEN_CACHE_TTL', 300))
+AUTH_TOKEN_LOCAL_TTL = int(os.getenv('AUTH_TOKEN_LOCAL_TTL', 10))
+AUTH_TOKEN_LOCAL_SIZE = int(os.getenv('AUTH_TOKEN_LOCAL_SIZE', 10000))
+
 # Настройки Djoser
 DJOSER = {
     'LOGIN_FIELD': 'email',
@@ -170,6 +227,19 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+STORAGES = {
+    'default': {
+        'BACKEND': 'recipes.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+# Сколько секунд сборщик не удаляет файл после сохранения: за это время
+# модель, загрузившая его, успевает сослаться на файл
+STORED_FILE_GRACE_PERIOD = int(os.getenv('STORED_FILE_GRACE_PERIOD', 600))
+
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -177,6 +247,90 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 LOGIN_REDIRECT_URL = '/admin/'
 LOGIN_URL = '/admin/login/'
 
+# Как часто (в секундах) перечитывать индекс ингредиентов в памяти процесса
+INGREDIENT_INDEX_TTL = int(os.getenv('INGREDIENT_INDEX_TTL', 300))
+
+# Как часто полностью перестраивать индекс подбора рецептов по кладовой;
+# изменения в этом процессе применяются к нему сразу
+RECIPE_MATCHER_TTL = int(os.getenv('RECIPE_MATCHER_TTL', 600))
+
+# Лента подписок: сколько последних рецептов хранить в ленте и с какого
+# числа подписчиков рецепты автора забираются при чтении, а не
+# раскладываются по лентам при публикации
+FEED_MAX_ENTRIES = int(os.getenv('FEED_MAX_ENTRIES', 500))
+FEED_FANOUT_MAX_FOLLOWERS = int(os.getenv('FEED_FANOUT_MAX_FOLLOWERS', 10000))
+
+# Уведомления по WebSocket: сколько секунд копить события в одну пачку,
+# сколько событий держать для медленного сокета и сколько ждать отправки
+# пачки, прежде чем закрыть сокет
+NOTIFY_BATCH_DELAY = float(os.getenv('NOTIFY_BATCH_DELAY', 0.5))
+NOTIFY_MAX_PENDING = int(os.getenv('NOTIFY_MAX_PENDING', 100))
+NOTIFY_SEND_TIMEOUT = float(os.getenv('NOTIFY_SEND_TIMEOUT', 10))
+
+# Короткие ссылки на рецепты: сколько проверенных кодов держать в памяти
+# процесса и как часто (по числу переходов или секундам) записывать
+# накопленные переходы в БД
+SHORT_LINK_CACHE_SIZE = int(os.getenv('SHORT_LINK_CACHE_SIZE', 10000))
+SHORT_LINK_FLUSH_SIZE = int(os.getenv('SHORT_LINK_FLUSH_SIZE', 1000))
+SHORT_LINK_FLUSH_INTERVAL = int(os.getenv('SHORT_LINK_FLUSH_INTERVAL', 10))
+
+# Сколько id принимают пакетные эндпоинты избранного, корзины и подписок
+BATCH_MAX_ITEMS = int(os.getenv('BATCH_MAX_ITEMS', 100))
+
+# Профилирование запросов (api/profiling.py): заголовок Server-Timing,
+# итоги последних запросов процесса для /api/_debug/requests/, порог
+# повторов одного запроса (N+1) и медленного запроса в миллисекундах.
+# По умолчанию включено только с DEBUG; Server-Timing получает персонал,
+# а всем клиентам — только с PROFILING_SERVER_TIMING=True.
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', str(DEBUG)) == 'True'
+PROFILING_SERVER_TIMING = (
+    os.getenv('PROFILING_SERVER_TIMING', 'False') == 'True'
+)
+PROFILING_BUFFER_SIZE = int(os.getenv('PROFILING_BUFFER_SIZE', 500))
+PROFILING_DUPLICATE_THRESHOLD = int(
+    os.getenv('PROFILING_DUPLICATE_THRESHOLD', 5)
+)
+PROFILING_SLOW_REQUEST_MS = float(os.getenv('PROFILING_SLOW_REQUEST_MS', 500))
+
+# Журнал приложения — строки JSON в stderr; записи ниже WARNING
+# пропускаются с вероятностью LOG_SAMPLE_RATE. Под manage.py test журнал
+# молчит, если LOG_LEVEL не задан явно.
+TESTING = sys.argv[1:2] == ['test']
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'CRITICAL' if TESTING else 'INFO')
+LOG_SAMPLE_RATE = float(os.getenv('LOG_SAMPLE_RATE', 0.01))
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'foodgram.log.JsonFormatter'},
+    },
+    'filters': {
+        'sample': {
+            '()': 'foodgram.log.SamplingFilter', 'rate': LOG_SAMPLE_RATE
+        },
+    },
+    'handlers': {
+        'json': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'json',
+            'filters': ['sample'],
+        },
+    },
+    'loggers': {
+        app: {'handlers': ['json'], 'level': LOG_LEVEL, 'propagate': False}
+        for app in ('api', 'recipes', 'users')
+    },
+}
+
+# Загрузка изображений: лимиты и уменьшенные копии, которые строятся
+# в пуле потоков после коммита транзакции.
+MAX_IMAGE_UPLOAD_SIZE = int(os.getenv('MAX_IMAGE_UPLOAD_SIZE', 5 * 1024 * 1024))
+MAX_IMAGE_PIXELS = int(os.getenv('MAX_IMAGE_PIXELS', 40_000_000))
+IMAGE_RENDITION_WIDTHS = (320, 640)
+IMAGE_RENDITION_QUALITY = int(os.getenv('IMAGE_RENDITION_QUALITY', 80))
+IMAGE_RENDITION_WORKERS = int(os.getenv('IMAGE_RENDITION_WORKERS', 2))
+IMAGE_RENDITIONS_SYNC = os.getenv('IMAGE_RENDITIONS_SYNC', 'False') == 'True'
+
 # Base URL for the application
 BASE_URL = 'https://foodgram.example.org'
 
@@ -1,16 +1,22 @@
 from django.contrib import admin
-from recipes.models import Recipe, Ingredient, IngredientInRecipe, Favorite, ShoppingCart
+from recipes.models import (
+    Recipe, Ingredient, IngredientInRecipe, Favorite, ShoppingCart,
+    ShoppingListItem, SimilarRecipe, StoredFile, TimelineEntry
+)
 
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('name', 'author', 'favorite_count')
+    list_display = (
+        'name', 'author', 'favorites_count', 'in_carts_count',
+        'short_link_clicks'
+    )
     search_fields = ('name', 'author__username')
     list_filter = ('author',)
-
-    def favorite_count(self, obj):
-        return obj.favorites.count()
-    favorite_count.short_description = 'Добавлений в избранное'
+    list_select_related = ('author',)
+    readonly_fields = (
+        'favorites_count', 'in_carts_count', 'short_link_clicks'
+    )
 
 
 @admin.register(Ingredient)
@@ -34,4 +40,31 @@ class FavoriteAdmin(admin.ModelAdmin):
 @admin.register(ShoppingCart)
 class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe')
-    search_fields = ('user__username', 'recipe__name')
\ No newline at end of file
+    search_fields = ('user__username', 'recipe__name')
+
+
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = ('user', 'ingredient', 'total_amount')
+    search_fields = ('user__username', 'ingredient__name')
+
+
+@admin.register(StoredFile)
+class StoredFileAdmin(admin.ModelAdmin):
+    list_display = ('name', 'ref_count')
+    search_fields = ('name',)
+    readonly_fields = ('name', 'ref_count')
+
+
+@admin.register(SimilarRecipe)
+class SimilarRecipeAdmin(admin.ModelAdmin):
+    list_display = ('recipe', 'similar', 'score')
+    search_fields = ('recipe__name',)
+    list_select_related = ('recipe', 'similar')
+
+
+@admin.register(TimelineEntry)
+class TimelineEntryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'recipe', 'created_at')
+    search_fields = ('user__username',)
+    list_select_related = ('user', 'recipe')
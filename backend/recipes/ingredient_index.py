@@ -0,0 +1,59 @@
+import threading
+import time
+from bisect import bisect_left
+
+from django.conf import settings
+
+from recipes.models import Ingredient
+
+
+class IngredientIndex:
+    """Префиксный индекс каталога ингредиентов в памяти процесса.
+
+    Каталог небольшой и почти не меняется, поэтому держим его
+    отсортированным по названию в нижнем регистре и ищем по префиксу
+    через bisect, не обращаясь к БД. Индекс сбрасывается сигналами
+    при изменении Ingredient и перечитывается не реже, чем раз в
+    INGREDIENT_INDEX_TTL секунд (изменения из других процессов).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._loaded_at = 0
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def _load(self):
+        items = list(
+            Ingredient.objects.values('id', 'name', 'measurement_unit')
+        )
+        items.sort(key=lambda item: (item['name'].casefold(), item['id']))
+        return [item['name'].casefold() for item in items], items
+
+    def _get_snapshot(self):
+        snapshot = self._snapshot
+        ttl = getattr(settings, 'INGREDIENT_INDEX_TTL', 300)
+        if snapshot is not None and time.monotonic() - self._loaded_at < ttl:
+            return snapshot
+        with self._lock:
+            if self._snapshot is snapshot:
+                self._snapshot = self._load()
+                self._loaded_at = time.monotonic()
+            return self._snapshot
+
+    def search(self, prefix='', limit=None):
+        keys, items = self._get_snapshot()
+        prefix = prefix.casefold()
+        result = []
+        for position in range(bisect_left(keys, prefix), len(keys)):
+            if limit is not None and len(result) >= limit:
+                break
+            if not keys[position].startswith(prefix):
+                break
+            result.append(items[position])
+        return result
+
+
+ingredient_index = IngredientIndex()
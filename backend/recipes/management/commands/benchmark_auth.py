@@ -0,0 +1,145 @@
+import random
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+from rest_framework.views import APIView
+
+from api.authentication import CachedTokenAuthentication, token_cache
+from users.models import User
+
+
+class AuthProbeView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response({'id': request.user.pk})
+
+
+class QueryCounter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        return execute(sql, params, many, context)
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Send authenticated requests from several threads through DRF '
+        'token authentication with and without the token cache and '
+        'report auth DB queries per request and latency'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--requests', type=int, default=20000)
+        parser.add_argument('--threads', type=int, default=8)
+
+    def handle(self, *args, **options):
+        if min(options['users'], options['requests'], options['threads']) < 1:
+            raise CommandError(
+                '--users, --requests and --threads must be positive'
+            )
+        # Потоки читают токены своими соединениями, поэтому данные
+        # фиксируются в БД и удаляются в конце.
+        prefix = f'auth-benchmark-{uuid.uuid4().hex[:8]}'
+        try:
+            keys = self.create_tokens(prefix, options['users'])
+            sequence = random.choices(keys, k=options['requests'])
+            for authentication in (
+                TokenAuthentication, CachedTokenAuthentication
+            ):
+                token_cache.clear()
+                self.run(authentication, sequence, options['threads'])
+        finally:
+            User.objects.filter(username__startswith=prefix).delete()
+
+    def create_tokens(self, prefix, count):
+        password = make_password(None)
+        users = User.objects.bulk_create(
+            [
+                User(
+                    email=f'{prefix}-{number}@example.com',
+                    username=f'{prefix}-{number}', password=password
+                )
+                for number in range(count)
+            ],
+            batch_size=5000
+        )
+        return [
+            token.key for token in Token.objects.bulk_create(
+                [
+                    Token(key=Token.generate_key(), user=user)
+                    for user in users
+                ],
+                batch_size=5000
+            )
+        ]
+
+    def run(self, authentication, sequence, threads):
+        view = AuthProbeView.as_view(authentication_classes=[authentication])
+        factory = APIRequestFactory()
+        queries = QueryCounter()
+        before = token_cache.stats.as_dict()
+
+        def worker(keys):
+            latencies = []
+            try:
+                with connection.execute_wrapper(queries):
+                    for key in keys:
+                        request = factory.get(
+                            '/', HTTP_AUTHORIZATION=f'Token {key}'
+                        )
+                        started = time.perf_counter()
+                        response = view(request)
+                        latencies.append(time.perf_counter() - started)
+                        if response.status_code != 200:
+                            raise CommandError(
+                                f'Unexpected status {response.status_code}'
+                            )
+            finally:
+                connection.close()
+            return latencies
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            latencies = [
+                latency * 1000
+                for chunk in executor.map(
+                    worker, [sequence[i::threads] for i in range(threads)]
+                )
+                for latency in chunk
+            ]
+        elapsed = time.monotonic() - started
+        after = token_cache.stats.as_dict()
+        self.stdout.write(
+            f'{authentication.__name__}: {len(sequence)} requests in '
+            f'{elapsed:.2f}s ({len(sequence) / elapsed:.0f}/s), '
+            f'{queries.count / len(sequence):.3f} DB queries per request, '
+            f'median {statistics.median(latencies):.3f} ms, '
+            f'p99 {percentile(latencies, 0.99):.3f} ms'
+        )
+        if authentication is CachedTokenAuthentication:
+            self.stdout.write('Token cache: ' + ', '.join(
+                f'{name} {after[name] - before[name]}'
+                for name in ('local_hits', 'shared_hits', 'db_lookups')
+            ))
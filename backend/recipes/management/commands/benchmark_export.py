@@ -0,0 +1,169 @@
+import statistics
+import time
+import tracemalloc
+import uuid
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Sum
+from django.http import HttpResponse
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.views import RecipeViewSet
+from recipes.models import (
+    Ingredient, IngredientInRecipe, Recipe, ShoppingCart, ShoppingListItem
+)
+from users.models import User
+
+FORMATS = ('txt', 'csv', 'json')
+
+
+def materialised_export(user):
+    # Прежняя реализация: агрегирование по корзине и весь список в строке
+    ingredients = IngredientInRecipe.objects.filter(
+        recipe__in_shopping_cart__user=user
+    ).values(
+        'ingredient__name', 'ingredient__measurement_unit'
+    ).annotate(total_amount=Sum('amount')).order_by('ingredient__name')
+    content = '\n'.join([
+        f"{item['ingredient__name']} - {item['total_amount']} "
+        f"{item['ingredient__measurement_unit']}"
+        for item in ingredients
+    ])
+    return HttpResponse(content, content_type='text/plain')
+
+
+class Command(BaseCommand):
+    help = (
+        'Export a large shopping list with the old materialised '
+        'implementation and the streaming one and report time to first '
+        'byte, total time and peak memory; all changes are rolled back'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--items', type=int, default=10000,
+            help='Distinct ingredients in the shopping list'
+        )
+        parser.add_argument('--recipes', type=int, default=500)
+        parser.add_argument(
+            '--per-recipe', type=int, default=40,
+            help='Ingredients per recipe'
+        )
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        if min(
+            options['items'], options['recipes'], options['per_recipe'],
+            options['repeat']
+        ) < 1:
+            raise CommandError(
+                '--items, --recipes, --per-recipe and --repeat must be '
+                'positive'
+            )
+        with transaction.atomic():
+            self.run(options)
+            transaction.set_rollback(True)
+
+    def run(self, options):
+        user = self.create_cart(options)
+        self.stdout.write(
+            f'{options["recipes"]} recipes in cart, '
+            f'{ShoppingListItem.objects.filter(user=user).count()} '
+            f'shopping list items'
+        )
+        self.measure(
+            'Materialised (txt)', lambda: materialised_export(user),
+            options['repeat']
+        )
+        # Рендереры действия роутер передаёт в as_view
+        view = RecipeViewSet.as_view(
+            {'get': 'download_shopping_cart'},
+            **RecipeViewSet.download_shopping_cart.kwargs
+        )
+        factory = APIRequestFactory()
+        for export_format in FORMATS:
+            def export(export_format=export_format):
+                request = factory.get(
+                    '/api/recipes/download_shopping_cart/',
+                    {'format': export_format}
+                )
+                force_authenticate(request, user=user)
+                return view(request)
+            self.measure(
+                f'Streaming ({export_format})', export, options['repeat']
+            )
+
+    def create_cart(self, options):
+        prefix = f'export-benchmark-{uuid.uuid4().hex[:8]}'
+        user, author = User.objects.bulk_create([
+            User(
+                email=f'{prefix}-{name}@example.com',
+                username=f'{prefix}-{name}', password=make_password(None)
+            )
+            for name in ('reader', 'author')
+        ])
+        ingredients = Ingredient.objects.bulk_create(
+            [
+                Ingredient(name=f'{prefix}-{number}', measurement_unit='г')
+                for number in range(options['items'])
+            ],
+            batch_size=5000
+        )
+        recipes = Recipe.objects.bulk_create(
+            [
+                Recipe(
+                    author=author, name=f'Рецепт {number}', text='Текст',
+                    image='recipes/images/benchmark.png', cooking_time=10
+                )
+                for number in range(options['recipes'])
+            ],
+            batch_size=5000
+        )
+        # Ингредиенты идут по кругу, так что список покрывает все --items
+        per_recipe = min(options['per_recipe'], options['items'])
+        IngredientInRecipe.objects.bulk_create(
+            [
+                IngredientInRecipe(
+                    recipe=recipe,
+                    ingredient=ingredients[
+                        (number * per_recipe + offset) % len(ingredients)
+                    ],
+                    amount=offset + 1
+                )
+                for number, recipe in enumerate(recipes)
+                for offset in range(per_recipe)
+            ],
+            batch_size=5000
+        )
+        # bulk_create не вызывает сигналы — список пересчитывается целиком
+        ShoppingCart.objects.bulk_create(
+            [ShoppingCart(user=user, recipe=recipe) for recipe in recipes],
+            batch_size=5000
+        )
+        ShoppingListItem.objects.rebuild([user.pk])
+        return user
+
+    def measure(self, name, export, repeat):
+        first_byte, total, peak, size = [], [], [], 0
+        for _ in range(repeat):
+            tracemalloc.start()
+            started = time.perf_counter()
+            response = export()
+            chunks = iter(
+                response.streaming_content if response.streaming
+                else [response.content]
+            )
+            size = len(next(chunks, b''))
+            first_byte.append((time.perf_counter() - started) * 1000)
+            for chunk in chunks:
+                size += len(chunk)
+            total.append((time.perf_counter() - started) * 1000)
+            peak.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+        self.stdout.write(
+            f'{name}: first byte {statistics.median(first_byte):.1f} ms, '
+            f'total {statistics.median(total):.1f} ms, peak memory '
+            f'{max(peak) / 1024 / 1024:.1f} MB, {size / 1024:.0f} KB'
+        )
@@ -0,0 +1,91 @@
+import statistics
+import time
+import uuid
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.models import Recipe, TimelineEntry
+from users.models import Follow, User
+
+
+def timed(function, *args):
+    started = time.monotonic()
+    function(*args)
+    return (time.monotonic() - started) * 1000
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure feed fan-out on write and on read for an author with '
+        'many followers; all changes are rolled back'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--followers', type=int, default=100000)
+        parser.add_argument('--recipes', type=int, default=10)
+
+    def handle(self, *args, **options):
+        if options['followers'] < 1 or options['recipes'] < 1:
+            raise CommandError('--followers and --recipes must be positive')
+        with transaction.atomic():
+            self.run(options['followers'], options['recipes'])
+            transaction.set_rollback(True)
+
+    def run(self, followers, recipes):
+        prefix = f'feed-benchmark-{uuid.uuid4().hex[:8]}'
+        password = make_password(None)
+        author, *users = User.objects.bulk_create(
+            [
+                User(
+                    email=f'{prefix}-{number}@example.com',
+                    username=f'{prefix}-{number}', password=password
+                )
+                for number in range(followers + 1)
+            ],
+            batch_size=5000
+        )
+        # bulk_create не вызывает сигналы — ленты заполняет сам замер
+        Follow.objects.bulk_create(
+            [Follow(user=user, following=author) for user in users],
+            batch_size=5000
+        )
+        created = Recipe.objects.bulk_create([
+            Recipe(
+                author=author, name=f'Рецепт {number}', text='Текст',
+                image='recipes/images/benchmark.png', cooking_time=10
+            )
+            for number in range(recipes)
+        ])
+        reader = users[-1]
+
+        push = [timed(TimelineEntry.objects.fan_out, recipe)
+                for recipe in created]
+        read = [timed(self.read_feed, reader) for _ in range(20)]
+        TimelineEntry.objects.filter(recipe__in=created).delete()
+        pull = []
+        for _ in range(20):
+            Follow.objects.filter(user=reader).update(feed_synced_at=None)
+            TimelineEntry.objects.filter(user=reader).delete()
+            pull.append(timed(self.pull_feed, reader, author))
+
+        self.stdout.write(
+            f'{followers} followers, {recipes} recipes\n'
+            f'Fan-out on write: median {statistics.median(push):.1f} ms '
+            f'per recipe, {statistics.median(push) / followers * 1000:.2f} '
+            f'us per follower\n'
+            f'Feed page from timeline: median '
+            f'{statistics.median(read):.1f} ms\n'
+            f'Fan-out on read (sync + page): median '
+            f'{statistics.median(pull):.1f} ms'
+        )
+
+    def read_feed(self, user):
+        list(Recipe.objects.filter(timeline_entries__user=user).order_by(
+            '-created_at', '-id'
+        )[:10])
+
+    def pull_feed(self, user, author):
+        TimelineEntry.objects.add_recent(user.pk, author.pk)
+        self.read_feed(user)
@@ -0,0 +1,122 @@
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+async def read_response(reader):
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed')
+    status = int(status_line.split()[1])
+    headers = {}
+    while (line := await reader.readline()) not in (b'\r\n', b''):
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    if 'content-length' in headers:
+        await reader.readexactly(int(headers['content-length']))
+    elif headers.get('transfer-encoding') == 'chunked':
+        while size := int((await reader.readline()).split(b';')[0], 16):
+            await reader.readexactly(size + 2)
+        await reader.readline()
+    else:
+        await reader.read()
+    return status, headers.get('connection', '').lower() != 'close'
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-test a running server over keep-alive HTTP/1.1 connections '
+        'and report throughput and latency percentiles'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', nargs='+')
+        parser.add_argument('--concurrency', type=int, default=100)
+        parser.add_argument('--requests', type=int, default=10000)
+        parser.add_argument(
+            '--header', action='append', default=[],
+            help='Extra request header, e.g. "Authorization: Token ..."'
+        )
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 1:
+            raise CommandError('--concurrency and --requests must be positive')
+        targets = [urlsplit(url) for url in options['url']]
+        if any(
+            target.scheme != 'http' or target.netloc != targets[0].netloc
+            for target in targets
+        ):
+            raise CommandError('All URLs must be http:// on one host')
+        self.host = targets[0].hostname
+        self.port = targets[0].port or 80
+        headers = ''.join(
+            f'{header}\r\n'
+            for header in ['Accept: application/json', *options['header']]
+        )
+        self.requests = [
+            (
+                f'GET {target.path or "/"}'
+                f'{"?" + target.query if target.query else ""} HTTP/1.1\r\n'
+                f'Host: {target.netloc}\r\n{headers}\r\n'
+            ).encode()
+            for target in targets
+        ]
+        self.remaining = options['requests']
+        self.latencies = []
+        self.errors = 0
+        started = time.monotonic()
+        asyncio.run(self.run(options['concurrency']))
+        elapsed = time.monotonic() - started
+        latencies = sorted(self.latencies)
+        if not latencies:
+            raise CommandError('No successful requests')
+
+        def percentile(fraction):
+            index = min(int(len(latencies) * fraction), len(latencies) - 1)
+            return latencies[index] * 1000
+
+        self.stdout.write(
+            f'{len(latencies)} requests, {self.errors} errors in '
+            f'{elapsed:.2f}s: {len(latencies) / elapsed:.0f} req/s\n'
+            f'Latency: median {statistics.median(latencies) * 1000:.1f} ms, '
+            f'p95 {percentile(0.95):.1f} ms, p99 {percentile(0.99):.1f} ms'
+        )
+
+    async def run(self, concurrency):
+        await asyncio.gather(*(
+            self.client(number) for number in range(concurrency)
+        ))
+
+    async def client(self, number):
+        connection = None
+        while self.remaining > 0:
+            self.remaining -= 1
+            request = self.requests[
+                (number + self.remaining) % len(self.requests)
+            ]
+            started = time.monotonic()
+            try:
+                if connection is None:
+                    connection = await asyncio.open_connection(
+                        self.host, self.port
+                    )
+                reader, writer = connection
+                writer.write(request)
+                status, keep_alive = await read_response(reader)
+            except (OSError, ConnectionError, ValueError,
+                    asyncio.IncompleteReadError):
+                self.errors += 1
+                connection = None
+                continue
+            if status >= 400:
+                self.errors += 1
+            else:
+                self.latencies.append(time.monotonic() - started)
+            if not keep_alive:
+                writer.close()
+                connection = None
+        if connection is not None:
+            connection[1].close()
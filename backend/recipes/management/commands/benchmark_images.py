@@ -0,0 +1,139 @@
+import base64
+import io
+import statistics
+import tempfile
+import time
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import override_settings
+from PIL import Image
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from api.images import build_renditions
+from api.views import RecipeViewSet
+from recipes.models import Ingredient, Recipe
+from users.models import User
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def photo(width, height):
+    # Шум сжимается примерно как фотография, а не как заливка цветом
+    return Image.merge('RGB', [
+        Image.effect_noise((width, height), 64) for _ in range(3)
+    ])
+
+
+class Command(BaseCommand):
+    help = (
+        'Upload base64 recipe photos through the API, build their '
+        'renditions and report upload and build latency and bytes served '
+        'with and without renditions; media goes to a temporary '
+        'directory and database changes are rolled back'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--width', type=int, default=3000)
+        parser.add_argument('--height', type=int, default=2000)
+        parser.add_argument('--uploads', type=int, default=10)
+        parser.add_argument(
+            '--line-length', type=int, default=0,
+            help='Wrap base64 at this many characters (0 - no wrapping)'
+        )
+
+    def handle(self, *args, **options):
+        if min(options['width'], options['height'], options['uploads']) < 1:
+            raise CommandError(
+                '--width, --height and --uploads must be positive'
+            )
+        if options['line_length'] < 0:
+            raise CommandError('--line-length must not be negative')
+        with tempfile.TemporaryDirectory() as media_root:
+            with override_settings(MEDIA_ROOT=media_root):
+                with transaction.atomic():
+                    self.run(options)
+                    transaction.set_rollback(True)
+
+    def run(self, options):
+        prefix = f'images-benchmark-{uuid.uuid4().hex[:8]}'
+        user = User.objects.create(
+            email=f'{prefix}@example.com', username=prefix,
+            password=make_password(None)
+        )
+        ingredient = Ingredient.objects.create(
+            name=prefix, measurement_unit='г'
+        )
+        view = RecipeViewSet.as_view({'post': 'create'})
+        # Сериализатор строит абсолютные URL — нужен разрешённый хост
+        factory = APIRequestFactory(SERVER_NAME=settings.ALLOWED_HOSTS[0])
+        image = photo(options['width'], options['height'])
+        uploads, builds, sizes = [], [], {}
+        for number in range(options['uploads']):
+            # Каждая загрузка уникальна, иначе хранилище отдаст тот же файл
+            image.paste(
+                (number * 37 % 256, number * 91 % 256, number % 256),
+                (0, 0, 16, 16)
+            )
+            output = io.BytesIO()
+            image.save(output, 'JPEG', quality=90)
+            encoded = base64.b64encode(output.getvalue()).decode()
+            if options['line_length']:
+                encoded = '\n'.join(
+                    encoded[start:start + options['line_length']]
+                    for start in range(
+                        0, len(encoded), options['line_length']
+                    )
+                )
+            request = factory.post('/api/recipes/', {
+                'ingredients': [{'id': ingredient.id, 'amount': 1}],
+                'image': 'data:image/jpeg;base64,' + encoded,
+                'name': f'Рецепт {number}',
+                'text': 'Описание',
+                'cooking_time': 5,
+            }, format='json')
+            force_authenticate(request, user=user)
+            body_size = len(request.body)
+            started = time.monotonic()
+            response = view(request)
+            uploads.append((time.monotonic() - started) * 1000)
+            if response.status_code != 201:
+                raise CommandError(f'Upload failed: {response.data}')
+
+            name = Recipe.objects.get(pk=response.data['id']).image.name
+            started = time.monotonic()
+            renditions = build_renditions(name)
+            builds.append((time.monotonic() - started) * 1000)
+            sizes.setdefault('original', []).append(
+                default_storage.size(name)
+            )
+            for extension in ('webp', 'jpeg'):
+                for width, path in renditions[extension].items():
+                    sizes.setdefault(f'{extension} {width}', []).append(
+                        default_storage.size(path)
+                    )
+
+        self.stdout.write(
+            f'{options["uploads"]} uploads of {options["width"]}x'
+            f'{options["height"]} JPEG, '
+            f'{body_size / 1024:.0f} KB request body'
+        )
+        for name, timings in (('Upload', uploads), ('Renditions', builds)):
+            self.stdout.write(
+                f'{name}: median {statistics.median(timings):.1f} ms, '
+                f'p99 {percentile(timings, 0.99):.1f} ms'
+            )
+        original = statistics.median(sizes['original'])
+        for name, values in sizes.items():
+            size = statistics.median(values)
+            self.stdout.write(
+                f'{name}: {size / 1024:.0f} KB '
+                f'({size / original:.0%} of original)'
+            )
@@ -0,0 +1,103 @@
+import random
+import statistics
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from recipes.ingredient_index import IngredientIndex
+from recipes.models import Ingredient
+
+WORDS = (
+    'сахар', 'соль', 'сыр', 'мука', 'масло', 'молоко', 'перец', 'лук',
+    'морковь', 'капуста', 'картофель', 'говядина', 'курица', 'яйцо',
+    'рис', 'гречка', 'томат', 'чеснок', 'укроп', 'петрушка'
+)
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Run ingredient autocomplete queries through the ORM '
+        '(name__istartswith) and through the in-memory prefix index and '
+        'report latency and DB queries per lookup; all changes are '
+        'rolled back'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ingredients', type=int, default=2000,
+            help='Synthetic ingredients added to the catalogue'
+        )
+        parser.add_argument('--queries', type=int, default=2000)
+        parser.add_argument('--limit', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if min(
+            options['ingredients'], options['queries'], options['limit']
+        ) < 1:
+            raise CommandError(
+                '--ingredients, --queries and --limit must be positive'
+            )
+        with transaction.atomic():
+            self.run(options)
+            transaction.set_rollback(True)
+
+    def run(self, options):
+        generator = random.Random(options['seed'])
+        suffix = uuid.uuid4().hex[:8]
+        Ingredient.objects.bulk_create(
+            [
+                Ingredient(
+                    name=f'{generator.choice(WORDS)} {number} {suffix}',
+                    measurement_unit='г'
+                )
+                for number in range(options['ingredients'])
+            ],
+            batch_size=5000
+        )
+        # Префиксы длиной 1–4 символа, как при наборе в поле поиска
+        prefixes = [
+            word[:generator.randint(1, 4)]
+            for word in generator.choices(WORDS, k=options['queries'])
+        ]
+        limit = options['limit']
+        self.stdout.write(
+            f'{Ingredient.objects.count()} ingredients, '
+            f'{len(prefixes)} lookups, limit {limit}'
+        )
+        self.measure('ORM', prefixes, lambda prefix: list(
+            Ingredient.objects.filter(name__istartswith=prefix).order_by(
+                'name', 'id'
+            ).values('id', 'name', 'measurement_unit')[:limit]
+        ))
+        # Отдельный экземпляр, чтобы не трогать индекс процесса
+        index = IngredientIndex()
+        started = time.perf_counter()
+        index.search('')
+        self.stdout.write(
+            f'Index load: {(time.perf_counter() - started) * 1000:.1f} ms'
+        )
+        self.measure(
+            'Index', prefixes, lambda prefix: index.search(prefix, limit)
+        )
+
+    def measure(self, name, prefixes, search):
+        timings = []
+        with CaptureQueriesContext(connection) as queries:
+            for prefix in prefixes:
+                started = time.perf_counter()
+                search(prefix)
+                timings.append((time.perf_counter() - started) * 1000)
+        self.stdout.write(
+            f'{name}: median {statistics.median(timings):.3f} ms, '
+            f'p99 {percentile(timings, 0.99):.3f} ms, '
+            f'{len(queries) / len(prefixes):.2f} queries per lookup'
+        )
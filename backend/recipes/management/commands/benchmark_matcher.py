@@ -0,0 +1,120 @@
+import random
+import statistics
+import sys
+import time
+from itertools import accumulate
+
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.recipe_matcher import RANKINGS, RecipeMatcher
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the pantry matcher on a synthetic catalogue '
+        '(the database is not used)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100000)
+        parser.add_argument('--ingredients', type=int, default=2000)
+        parser.add_argument('--per-recipe', type=int, default=8)
+        parser.add_argument('--pantry', type=int, default=15)
+        parser.add_argument('--queries', type=int, default=50)
+        parser.add_argument('--max-missing', type=int, default=None)
+        parser.add_argument('--ranking', choices=RANKINGS,
+                            default='coverage')
+        parser.add_argument('--page-size', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--baseline', action='store_true',
+            help='Also time a per-recipe set intersection scan'
+        )
+
+    def handle(self, *args, **options):
+        if min(options['recipes'], options['ingredients'],
+               options['per_recipe'], options['pantry'],
+               options['queries']) < 1:
+            raise CommandError('Sizes must be positive')
+        generator = random.Random(options['seed'])
+        ingredients = range(1, options['ingredients'] + 1)
+        # Популярность ингредиентов по закону Ципфа: соль и масло
+        # встречаются почти везде, специи — в единичных рецептах.
+        weights = list(accumulate(1 / rank for rank in ingredients))
+
+        started = time.monotonic()
+        recipes = [
+            set(generator.choices(
+                ingredients, cum_weights=weights,
+                k=generator.randint(1, options['per_recipe'] * 2 - 1)
+            ))
+            for _ in range(options['recipes'])
+        ]
+        generated = time.monotonic() - started
+
+        matcher = RecipeMatcher()
+        started = time.monotonic()
+        matcher.build(
+            (recipe_id, ingredient_id)
+            for recipe_id, recipe in enumerate(recipes, start=1)
+            for ingredient_id in recipe
+        )
+        built = time.monotonic() - started
+        memory = sum(
+            sys.getsizeof(posting)
+            for posting in matcher._postings.values()
+        ) + sum(sys.getsizeof(plane) for plane in matcher._size_planes)
+
+        pantries = [
+            set(generator.choices(
+                ingredients, cum_weights=weights, k=options['pantry']
+            ))
+            for _ in range(options['queries'])
+        ]
+        timings = []
+        found = 0
+        for pantry in pantries:
+            started = time.monotonic()
+            result = matcher.match(
+                pantry, options['max_missing'], options['ranking']
+            )
+            result[:options['page_size']]
+            timings.append(time.monotonic() - started)
+            found += len(result)
+
+        self.stdout.write(
+            f'Generated {options["recipes"]} recipes in {generated:.2f}s\n'
+            f'Index built in {built:.2f}s, '
+            f'postings {memory / 2 ** 20:.1f} MB\n'
+            f'{options["queries"]} queries, {found / len(pantries):.0f} '
+            f'matches on average\n'
+            f'Latency: median {statistics.median(timings) * 1000:.1f} ms, '
+            f'p95 {percentile(timings, 0.95) * 1000:.1f} ms'
+        )
+        if options['baseline']:
+            self.baseline(recipes, pantries, options['max_missing'])
+
+    def baseline(self, recipes, pantries, max_missing):
+        timings = []
+        for pantry in pantries:
+            started = time.monotonic()
+            sorted(
+                (
+                    (len(recipe) - matched, -matched, -recipe_id)
+                    for recipe_id, recipe in enumerate(recipes, start=1)
+                    if (matched := len(recipe & pantry))
+                    and (max_missing is None
+                         or len(recipe) - matched <= max_missing)
+                )
+            )
+            timings.append(time.monotonic() - started)
+        self.stdout.write(
+            f'Baseline scan: median '
+            f'{statistics.median(timings) * 1000:.1f} ms, '
+            f'p95 {percentile(timings, 0.95) * 1000:.1f} ms'
+        )
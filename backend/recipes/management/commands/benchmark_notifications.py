@@ -0,0 +1,145 @@
+import asyncio
+import json
+import resource
+import statistics
+import time
+import uuid
+
+from asgiref.sync import async_to_sync, sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+from api.notifications import author_group, notify
+from foodgram.asgi import application
+from users.models import Follow, User
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Hold many notification sockets open in this process through the '
+        'ASGI application and the configured channel layer, and measure '
+        'how fast a burst of events from a followed author reaches them'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sockets', type=int, default=10000)
+        parser.add_argument('--rounds', type=int, default=5)
+        parser.add_argument(
+            '--burst', type=int, default=5,
+            help='Events sent per round; each socket should get one batch'
+        )
+
+    def handle(self, *args, **options):
+        if min(options['sockets'], options['rounds'], options['burst']) < 1:
+            raise CommandError(
+                '--sockets, --rounds and --burst must be positive'
+            )
+        # Потребители читают токены в своих потоках через
+        # database_sync_to_async, поэтому данные фиксируются в БД
+        # и удаляются в конце, а не откатываются транзакцией.
+        prefix = f'notify-benchmark-{uuid.uuid4().hex[:8]}'
+        try:
+            author, keys = self.create_users(prefix, options['sockets'])
+            async_to_sync(self.run)(author, keys, options)
+        finally:
+            User.objects.filter(username__startswith=prefix).delete()
+
+    def create_users(self, prefix, sockets):
+        password = make_password(None)
+        author, *users = User.objects.bulk_create(
+            [
+                User(
+                    email=f'{prefix}-{number}@example.com',
+                    username=f'{prefix}-{number}', password=password
+                )
+                for number in range(sockets + 1)
+            ],
+            batch_size=5000
+        )
+        Follow.objects.bulk_create(
+            [Follow(user=user, following=author) for user in users],
+            batch_size=5000
+        )
+        tokens = Token.objects.bulk_create(
+            [Token(key=Token.generate_key(), user=user) for user in users],
+            batch_size=5000
+        )
+        return author, [token.key for token in tokens]
+
+    async def run(self, author, keys, options):
+        started = time.monotonic()
+        sockets = []
+        for start in range(0, len(keys), 500):
+            sockets += await asyncio.gather(*(
+                self.connect(key) for key in keys[start:start + 500]
+            ))
+        connected = time.monotonic() - started
+        self.stdout.write(
+            f'{len(sockets)} sockets connected in {connected:.1f}s '
+            f'({len(sockets) / connected:.0f}/s), '
+            f'channel layer {settings.CHANNEL_LAYERS["default"]["BACKEND"]}'
+        )
+
+        for number in range(options['rounds']):
+            sent = time.monotonic()
+            for event in range(options['burst']):
+                await sync_to_async(notify)(
+                    author_group(author.pk), f'recipe.{number}.{event}',
+                    {'type': 'recipe', 'recipe': {'id': event}}
+                )
+            emitted = (time.monotonic() - sent) * 1000
+            results = await asyncio.gather(*(
+                self.receive(socket, options['burst']) for socket in sockets
+            ))
+            latencies = [
+                (received - sent) * 1000 for received, _ in results
+            ]
+            frames = [count for _, count in results]
+            self.stdout.write(
+                f'Round {number + 1}: {options["burst"]} events sent in '
+                f'{emitted:.0f} ms; all delivered after median '
+                f'{statistics.median(latencies):.0f} ms, p99 '
+                f'{percentile(latencies, 0.99):.0f} ms, max '
+                f'{max(latencies):.0f} ms; '
+                f'{statistics.mean(frames):.1f} frames per socket'
+            )
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+        self.stdout.write(f'Peak RSS {peak} MB')
+        await asyncio.gather(*(
+            self.disconnect(socket) for socket in sockets
+        ))
+
+    async def connect(self, key):
+        socket = ApplicationCommunicator(application, {
+            'type': 'websocket', 'path': '/ws/notify/',
+            'query_string': f'token={key}'.encode(), 'headers': [],
+            'subprotocols': [],
+        })
+        await socket.send_input({'type': 'websocket.connect'})
+        message = await socket.receive_output(timeout=60)
+        if message['type'] != 'websocket.accept':
+            raise CommandError(f'Socket rejected: {message}')
+        return socket
+
+    async def receive(self, socket, events):
+        # Склеенные события приходят пачками: число кадров на сокет
+        # показывает, сколько отправок понадобилось на всю серию.
+        frames = 0
+        while events > 0:
+            message = await socket.receive_output(timeout=60)
+            events -= len(json.loads(message['text'])['notifications'])
+            frames += 1
+        return time.monotonic(), frames
+
+    async def disconnect(self, socket):
+        await socket.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await socket.wait(timeout=10)
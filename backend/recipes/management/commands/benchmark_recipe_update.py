@@ -0,0 +1,162 @@
+import random
+import statistics
+import time
+import uuid
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.serializers import RecipeCreateSerializer
+from recipes.models import Ingredient, IngredientInRecipe, Recipe
+from users.models import User
+
+STAT_COLUMNS = ('n_tup_ins', 'n_tup_upd', 'n_tup_hot_upd', 'n_tup_del')
+
+
+def recreate_ingredients(recipe, ingredients_data):
+    # Прежняя реализация: все строки удаляются и вставляются заново
+    IngredientInRecipe.objects.filter(recipe=recipe).delete()
+    IngredientInRecipe.objects.bulk_create([
+        IngredientInRecipe(
+            recipe=recipe, ingredient_id=data['id'], amount=data['amount']
+        )
+        for data in ingredients_data
+    ])
+
+
+def diff_ingredients(recipe, ingredients_data):
+    RecipeCreateSerializer().update_ingredients(recipe, ingredients_data)
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class Command(BaseCommand):
+    help = (
+        'Edit recipes with many ingredients by delete-and-recreate and by '
+        'diff-based updates and report edit latency and dead row versions '
+        '(PostgreSQL); all changes are rolled back'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ingredients', type=int, default=60)
+        parser.add_argument('--edits', type=int, default=200)
+        parser.add_argument(
+            '--changed', type=int, default=5,
+            help='Ingredient amounts changed per edit'
+        )
+        parser.add_argument(
+            '--replaced', type=int, default=1,
+            help='Ingredients swapped for other ones per edit'
+        )
+
+    def handle(self, *args, **options):
+        if min(options['ingredients'], options['edits']) < 1:
+            raise CommandError('--ingredients and --edits must be positive')
+        if min(options['changed'], options['replaced']) < 0 or (
+            options['changed'] + options['replaced'] > options['ingredients']
+        ):
+            raise CommandError(
+                '--changed and --replaced must be non-negative and not '
+                'exceed --ingredients together'
+            )
+        with transaction.atomic():
+            self.run(options)
+            transaction.set_rollback(True)
+
+    def run(self, options):
+        prefix = f'update-benchmark-{uuid.uuid4().hex[:8]}'
+        author = User.objects.create(
+            email=f'{prefix}@example.com', username=prefix,
+            password=make_password(None)
+        )
+        pool = [
+            ingredient.pk for ingredient in Ingredient.objects.bulk_create([
+                Ingredient(name=f'{prefix}-{number}', measurement_unit='г')
+                for number in range(options['ingredients'] * 2)
+            ])
+        ]
+        edits = self.make_edits(pool, options)
+        self.stdout.write(
+            f'{options["ingredients"]} ingredients, {options["edits"]} '
+            f'edits, {options["changed"]} amounts changed and '
+            f'{options["replaced"]} ingredients replaced per edit'
+        )
+        for name, strategy in (
+            ('Delete and recreate', recreate_ingredients),
+            ('Diff', diff_ingredients),
+        ):
+            recipe = Recipe.objects.create(
+                author=author, name=f'{prefix} {name}', text='Текст',
+                image='recipes/images/benchmark.png', cooking_time=10
+            )
+            recreate_ingredients(recipe, edits[0])
+            self.measure(name, strategy, recipe, edits[1:])
+
+    def make_edits(self, pool, options):
+        amounts = {
+            ingredient_id: random.randint(1, 1000)
+            for ingredient_id in pool[:options['ingredients']]
+        }
+        edits = []
+        for _ in range(options['edits'] + 1):
+            edits.append([
+                {'id': ingredient_id, 'amount': amount}
+                for ingredient_id, amount in amounts.items()
+            ])
+            used = list(amounts)
+            replaced = random.sample(used, options['replaced'])
+            for ingredient_id in replaced:
+                del amounts[ingredient_id]
+            unused = [pk for pk in pool if pk not in amounts]
+            for ingredient_id in random.sample(unused, options['replaced']):
+                amounts[ingredient_id] = random.randint(1, 1000)
+            kept = [pk for pk in used if pk in amounts]
+            for ingredient_id in random.sample(kept, options['changed']):
+                amounts[ingredient_id] += 1
+        return edits
+
+    def row_stats(self):
+        # Счётчики текущей транзакции: каждое обновление и удаление
+        # оставляет в таблице мёртвую версию строки
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT {", ".join(STAT_COLUMNS)} '
+                f'FROM pg_stat_xact_user_tables WHERE relname = %s',
+                [IngredientInRecipe._meta.db_table]
+            )
+            return dict(zip(STAT_COLUMNS, cursor.fetchone()))
+
+    def measure(self, name, strategy, recipe, edits):
+        before = self.row_stats()
+        latencies = []
+        for ingredients_data in edits:
+            started = time.perf_counter()
+            with transaction.atomic():
+                strategy(recipe, ingredients_data)
+            latencies.append((time.perf_counter() - started) * 1000)
+        after = self.row_stats()
+        self.stdout.write(
+            f'{name}: median {statistics.median(latencies):.2f} ms, '
+            f'p99 {percentile(latencies, 0.99):.2f} ms per edit'
+        )
+        if before is None:
+            self.stdout.write('  Row version statistics need PostgreSQL')
+            return
+        per_edit = {
+            column: (after[column] - before[column]) / len(edits)
+            for column in STAT_COLUMNS
+        }
+        self.stdout.write(
+            f'  per edit: {per_edit["n_tup_ins"]:.1f} inserted, '
+            f'{per_edit["n_tup_upd"]:.1f} updated '
+            f'({per_edit["n_tup_hot_upd"]:.1f} HOT), '
+            f'{per_edit["n_tup_del"]:.1f} deleted, '
+            f'{per_edit["n_tup_upd"] + per_edit["n_tup_del"]:.1f} '
+            f'dead row versions'
+        )
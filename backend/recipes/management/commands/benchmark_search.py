@@ -0,0 +1,158 @@
+import random
+import statistics
+import time
+import uuid
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, models, transaction
+
+from recipes.models import Ingredient, IngredientInRecipe, Recipe
+from users.models import User
+
+DISHES = (
+    'борщ', 'щи', 'солянка', 'рассольник', 'плов', 'пельмени', 'вареники',
+    'блины', 'сырники', 'запеканка', 'котлеты', 'гуляш', 'рагу', 'салат',
+    'омлет', 'пирог', 'каша', 'суп', 'паста', 'ризотто'
+)
+ADJECTIVES = (
+    'домашний', 'быстрый', 'постный', 'праздничный', 'летний', 'зимний',
+    'острый', 'сытный', 'лёгкий', 'бабушкин'
+)
+INGREDIENTS = (
+    'свёкла', 'капуста', 'картофель', 'морковь', 'лук', 'чеснок', 'говядина',
+    'свинина', 'курица', 'рис', 'гречка', 'творог', 'сметана', 'молоко',
+    'яйцо', 'мука', 'сыр', 'томат', 'грибы', 'укроп'
+)
+WORDS = DISHES + ADJECTIVES + INGREDIENTS
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+def substring_search(queryset, query):
+    # Прежний поиск: icontains по названию, описанию и ингредиентам
+    return queryset.filter(
+        models.Q(name__icontains=query)
+        | models.Q(text__icontains=query)
+        | models.Q(models.Exists(IngredientInRecipe.objects.filter(
+            recipe=models.OuterRef('pk'), ingredient__name__icontains=query
+        )))
+    ).order_by('-created_at')
+
+
+def misspell(word, generator):
+    position = generator.randrange(1, len(word))
+    return word[:position] + word[position + 1:]
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a synthetic recipe catalogue and time recipe search '
+        '(full-text and trigram indexes on PostgreSQL) against a '
+        'substring scan; all changes are rolled back'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=1000000)
+        parser.add_argument('--per-recipe', type=int, default=6)
+        parser.add_argument('--queries', type=int, default=100)
+        parser.add_argument('--page-size', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument(
+            '--skip-baseline', action='store_true',
+            help='Do not time the substring scan'
+        )
+
+    def handle(self, *args, **options):
+        if min(
+            options['recipes'], options['per_recipe'], options['queries'],
+            options['page_size']
+        ) < 1:
+            raise CommandError('Sizes must be positive')
+        if connection.vendor != 'postgresql':
+            self.stderr.write(
+                'Full-text and trigram search need PostgreSQL; both runs '
+                'use the substring fallback on this database'
+            )
+        with transaction.atomic():
+            self.run(options)
+            transaction.set_rollback(True)
+
+    def run(self, options):
+        generator = random.Random(options['seed'])
+        started = time.monotonic()
+        self.generate(options, generator)
+        if connection.vendor == 'postgresql':
+            # Статистика для планировщика по только что вставленным строкам
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE recipes_recipe')
+        self.stdout.write(
+            f'Generated {options["recipes"]} recipes in '
+            f'{time.monotonic() - started:.1f}s'
+        )
+        words = generator.choices(WORDS, k=options['queries'])
+        for name, queries in (
+            ('words', words),
+            ('misspelt words', [misspell(word, generator) for word in words]),
+        ):
+            self.measure(
+                f'Search, {name}', queries, Recipe.objects.search,
+                options['page_size']
+            )
+            if not options['skip_baseline']:
+                self.measure(
+                    f'Substring scan, {name}', queries,
+                    lambda query: substring_search(Recipe.objects, query),
+                    options['page_size']
+                )
+
+    def generate(self, options, generator):
+        prefix = f'search-benchmark-{uuid.uuid4().hex[:8]}'
+        author = User.objects.create(
+            email=f'{prefix}@example.com', username=prefix,
+            password=make_password(None)
+        )
+        ingredients = Ingredient.objects.bulk_create([
+            Ingredient(name=f'{name} {prefix}', measurement_unit='г')
+            for name in INGREDIENTS
+        ])
+        per_recipe = min(options['per_recipe'], len(ingredients))
+        # Пачками, чтобы миллион объектов не держать в памяти разом
+        for offset in range(0, options['recipes'], 5000):
+            recipes = Recipe.objects.bulk_create([
+                Recipe(
+                    author=author,
+                    name=(
+                        f'{generator.choice(ADJECTIVES).capitalize()} '
+                        f'{generator.choice(DISHES)} {number}'
+                    ),
+                    text=' '.join(generator.choices(WORDS, k=12)),
+                    image='recipes/images/benchmark.png', cooking_time=10
+                )
+                for number in range(
+                    offset, min(offset + 5000, options['recipes'])
+                )
+            ])
+            IngredientInRecipe.objects.bulk_create([
+                IngredientInRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=100
+                )
+                for recipe in recipes
+                for ingredient in generator.sample(ingredients, per_recipe)
+            ])
+        # bulk_create не заполняет поисковый вектор
+        Recipe.objects.filter(author=author).update_search_vector()
+
+    def measure(self, name, queries, search, page_size):
+        timings = []
+        for query in queries:
+            started = time.monotonic()
+            list(search(query).values_list('id', flat=True)[:page_size])
+            timings.append((time.monotonic() - started) * 1000)
+        self.stdout.write(
+            f'{name}: median {statistics.median(timings):.1f} ms, '
+            f'p99 {percentile(timings, 0.99):.1f} ms'
+        )
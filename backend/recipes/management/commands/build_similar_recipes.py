@@ -0,0 +1,136 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+
+from recipes.models import IngredientInRecipe, Recipe, SimilarRecipe
+from recipes.similarity import build_vectors, init_worker, neighbours_chunk
+
+
+def chunked(items, size):
+    items = iter(items)
+    return iter(lambda: list(islice(items, size)), [])
+
+
+class Command(BaseCommand):
+    help = (
+        'Compute similar recipes by TF-IDF ingredient vectors; only '
+        'recipes changed since the last run are recomputed by default'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Recompute neighbours of every recipe'
+        )
+        parser.add_argument('--top-k', type=int, default=10)
+        parser.add_argument('--chunk-size', type=int, default=200)
+        parser.add_argument(
+            '--max-df', type=float, default=0.5,
+            help='Ignore ingredients present in a larger share of recipes'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=None,
+            help='Processes computing neighbours (default: CPU count, '
+                 '0 computes in this process)'
+        )
+
+    def handle(self, *args, **options):
+        if options['top_k'] < 1 or options['chunk_size'] < 1:
+            raise CommandError('--top-k and --chunk-size must be positive')
+        if not 0 < options['max_df'] <= 1:
+            raise CommandError('--max-df must be in (0, 1]')
+        self.options = options
+        # Рецепты, изменённые во время расчёта, останутся устаревшими
+        # относительно этой отметки и попадут в следующий прогон.
+        computed_at = timezone.now()
+        started = time.monotonic()
+        vectors, postings = build_vectors(
+            IngredientInRecipe.objects.order_by('recipe_id').values_list(
+                'recipe_id', 'ingredient_id', 'amount'
+            ).iterator(chunk_size=10000),
+            max_df=options['max_df']
+        )
+
+        changed = Recipe.objects.filter(
+            Q(similar_updated_at__isnull=True)
+            | Q(updated_at__gt=F('similar_updated_at'))
+        )
+        targets = list(changed.values_list('pk', flat=True))
+        total = Recipe.objects.count()
+        full = options['full'] or len(targets) * 2 > total
+        thresholds = None
+        stale = set()
+        if full:
+            targets = list(Recipe.objects.values_list('pk', flat=True))
+        else:
+            # Сходство симметрично: изменённый рецепт мог войти в чужой
+            # top-K или выпасть из него — такие списки тоже пересчитываем.
+            thresholds = dict(
+                SimilarRecipe.objects.exclude(recipe__in=changed)
+                .values('recipe_id').order_by()
+                .annotate(count=Count('pk'), min_score=Min('score'))
+                .filter(count__gte=options['top_k'])
+                .values_list('recipe_id', 'min_score')
+            )
+            stale = set(
+                SimilarRecipe.objects.filter(similar__in=changed)
+                .values_list('recipe_id', flat=True)
+            )
+
+        if options['workers'] == 0:
+            init_worker(vectors, postings, thresholds, options['top_k'])
+            computed = self.compute(map, targets, stale, computed_at)
+        else:
+            with ProcessPoolExecutor(
+                max_workers=options['workers'], initializer=init_worker,
+                initargs=(vectors, postings, thresholds, options['top_k'])
+            ) as executor:
+                computed = self.compute(
+                    executor.map, targets, stale, computed_at
+                )
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Full" if full else "Incremental"} run: neighbours of '
+            f'{computed} recipes computed in '
+            f'{time.monotonic() - started:.2f}s'
+        ))
+
+    def compute(self, map_chunks, targets, stale, computed_at):
+        affected = set(stale)
+        computed = self.store(
+            map_chunks(neighbours_chunk, chunked(
+                targets, self.options['chunk_size']
+            )),
+            computed_at, affected
+        )
+        affected -= set(targets)
+        if affected:
+            computed += self.store(
+                map_chunks(neighbours_chunk, chunked(
+                    sorted(affected), self.options['chunk_size']
+                )),
+                computed_at
+            )
+        return computed
+
+    def store(self, results, computed_at, affected=None):
+        computed = 0
+        for chunk in results:
+            SimilarRecipe.objects.replace(
+                {
+                    recipe_id: [
+                        (similar_id, round(score, 6))
+                        for similar_id, score in top
+                    ]
+                    for recipe_id, top, _ in chunk
+                },
+                computed_at
+            )
+            if affected is not None:
+                for _, _, entering in chunk:
+                    affected.update(entering)
+            computed += len(chunk)
+        return computed
@@ -0,0 +1,90 @@
+import base64
+import json
+import mimetypes
+import sys
+import time
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db.models import Prefetch
+
+from recipes.models import IngredientInRecipe, Recipe
+
+
+def inline_image(name):
+    content_type = mimetypes.guess_type(name)[0] or 'image/png'
+    with default_storage.open(name) as file:
+        data = base64.b64encode(file.read()).decode()
+    return f'data:{content_type};base64,{data}'
+
+
+class Command(BaseCommand):
+    help = 'Export recipes to JSONL (one recipe per line)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default='-',
+            help='Output file, "-" for stdout'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--inline-images', action='store_true',
+            help='Embed images as base64 instead of storage paths'
+        )
+
+    def serialize(self, recipe, inline_images):
+        return {
+            'author': {
+                'email': recipe.author.email,
+                'username': recipe.author.username,
+                'first_name': recipe.author.first_name,
+                'last_name': recipe.author.last_name,
+            },
+            'name': recipe.name,
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+            'image': (
+                inline_image(recipe.image.name) if inline_images
+                else recipe.image.name
+            ),
+            'ingredients': [
+                {
+                    'name': item.ingredient.name,
+                    'measurement_unit': item.ingredient.measurement_unit,
+                    'amount': item.amount,
+                }
+                for item in recipe.ingredient_in_recipe.all()
+            ],
+        }
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.select_related('author').only(
+            'name', 'text', 'cooking_time', 'image', 'author__email',
+            'author__username', 'author__first_name', 'author__last_name'
+        ).prefetch_related(Prefetch(
+            'ingredient_in_recipe',
+            IngredientInRecipe.objects.select_related('ingredient')
+        )).order_by('pk')
+        output = (
+            sys.stdout if options['path'] == '-'
+            else open(options['path'], 'w', encoding='utf-8')
+        )
+        started = time.monotonic()
+        exported = 0
+        try:
+            for recipe in recipes.iterator(chunk_size=options['batch_size']):
+                output.write(json.dumps(
+                    self.serialize(recipe, options['inline_images']),
+                    ensure_ascii=False
+                ) + '\n')
+                exported += 1
+                if exported % options['batch_size'] == 0:
+                    self.report(exported, started)
+        finally:
+            if output is not sys.stdout:
+                output.close()
+        self.report(exported, started)
+
+    def report(self, exported, started):
+        rate = exported / max(time.monotonic() - started, 1e-9)
+        self.stderr.write(f'Exported {exported} recipes, {rate:.0f} rows/s')
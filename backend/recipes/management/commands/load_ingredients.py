@@ -1,38 +1,233 @@
 import csv
+import json
 import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
 
-from django.core.management.base import BaseCommand
-from recipes.models import Ingredient
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.cache import bump_versions
+from api.signals import invalidate_recipes, touch_recipes
+from recipes.ingredient_index import ingredient_index
+from recipes.models import Ingredient, Recipe
+
+DIFF_LINES_SHOWN = 50
+JSON_READ_SIZE = 64 * 1024
+JSON_SEPARATORS = ' \t\r\n,[]'
+
+
+def read_csv(file):
+    for number, row in enumerate(csv.reader(file), start=1):
+        if not row:
+            continue
+        if len(row) != 2:
+            raise CommandError(f'Line {number}: expected name,unit')
+        yield row[0], row[1]
+
+
+def read_json(file):
+    # Потоковое чтение JSON-массива объектов (или JSON Lines) без
+    # загрузки всего файла: объекты разбираются по одному raw_decode.
+    decoder = json.JSONDecoder()
+    buffer = ''
+    while True:
+        chunk = file.read(JSON_READ_SIZE)
+        buffer += chunk
+        position = 0
+        while True:
+            while (
+                position < len(buffer)
+                and buffer[position] in JSON_SEPARATORS
+            ):
+                position += 1
+            if position == len(buffer):
+                break
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError as error:
+                if not chunk:
+                    raise CommandError(f'Invalid JSON: {error}')
+                break
+            try:
+                yield item['name'], item['measurement_unit']
+            except (KeyError, TypeError):
+                raise CommandError(f'Invalid ingredient: {item!r}')
+        buffer = buffer[position:]
+        if not chunk:
+            return
+
+
+READERS = {'csv': read_csv, 'json': read_json, 'jsonl': read_json}
+
+
+def plan_chunk(rows, update_units):
+    """Делит порцию на новые, изменённые и совпадающие ингредиенты."""
+    rows = list(dict.fromkeys(rows))
+    existing = {}
+    for pk, name, unit in Ingredient.objects.filter(
+        name__in={name for name, _ in rows}
+    ).values_list('id', 'name', 'measurement_unit'):
+        existing.setdefault(name, {})[unit] = pk
+    units_in_file = {}
+    for name, unit in rows:
+        units_in_file.setdefault(name, set()).add(unit)
+    added, changed, unchanged = [], [], 0
+    for name, unit in rows:
+        units = existing.get(name, {})
+        if unit in units:
+            unchanged += 1
+        elif update_units and len(units) == 1 and len(
+            units_in_file[name]
+        ) == 1:
+            [(old_unit, pk)] = units.items()
+            changed.append((pk, name, old_unit, unit))
+        else:
+            added.append((name, unit))
+    return added, changed, unchanged
+
+
+def apply_chunk(added, changed):
+    with transaction.atomic():
+        Ingredient.objects.bulk_update(
+            [
+                Ingredient(pk=pk, name=name, measurement_unit=unit)
+                for pk, name, _, unit in changed
+            ],
+            ['measurement_unit']
+        )
+        # Upsert: строка, которую успел вставить параллельный загрузчик,
+        # не вызывает ошибку уникальности.
+        Ingredient.objects.bulk_create(
+            [
+                Ingredient(name=name, measurement_unit=unit)
+                for name, unit in added
+            ],
+            update_conflicts=True,
+            unique_fields=['name', 'measurement_unit'],
+            update_fields=['measurement_unit']
+        )
 
 
 class Command(BaseCommand):
-    help = 'Load ingredients from CSV file'
+    help = 'Load or update the ingredient catalogue from CSV or JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--path', default=os.path.join(
+                settings.BASE_DIR, 'data', 'ingredients.csv'
+            )
+        )
+        parser.add_argument(
+            '--format', choices=sorted(READERS),
+            help='Input format (default: by file extension)'
+        )
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Threads upserting chunks in parallel'
+        )
+        parser.add_argument(
+            '--update-units', action='store_true',
+            help='Change the unit of an existing ingredient instead of '
+                 'adding a new one when the name matches a single row'
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Show what would change without writing'
+        )
 
     def handle(self, *args, **options):
-        csv_file = os.path.join('data', 'ingredients.csv')
-        
-        if not os.path.exists(csv_file):
-            self.stdout.write(
-                self.style.ERROR(f'File {csv_file} does not exist')
+        path = options['path']
+        if not os.path.exists(path):
+            raise CommandError(f'File {path} does not exist')
+        file_format = options['format'] or os.path.splitext(path)[1][1:]
+        if file_format not in READERS:
+            raise CommandError(f'Unknown format: {file_format}')
+        if options['chunk_size'] < 1 or options['workers'] < 1:
+            raise CommandError('--chunk-size and --workers must be positive')
+
+        self.options = options
+        self.totals = {'rows': 0, 'added': 0, 'changed': 0, 'unchanged': 0}
+        self.changed_ids = []
+        self.diff_lines = 0
+        started = time.monotonic()
+        with open(path, encoding='utf-8') as file:
+            rows = (
+                (name.strip(), unit.strip())
+                for name, unit in READERS[file_format](file)
+                if name.strip()
             )
-            return
+            chunks = iter(
+                lambda: list(islice(rows, options['chunk_size'])), []
+            )
+            if options['workers'] == 1:
+                for chunk in chunks:
+                    self.collect(len(chunk), self.process(chunk))
+            else:
+                self.process_parallel(chunks)
+        elapsed = time.monotonic() - started
 
-        with open(csv_file, encoding='utf-8') as file:
-            reader = csv.reader(file)
-            ingredients = []
-            for row in reader:
-                name, measurement_unit = row
-                ingredients.append(
-                    Ingredient(
-                        name=name.strip(),
-                        measurement_unit=measurement_unit.strip()
-                    )
+        if not options['dry_run']:
+            ingredient_index.invalidate()
+            bump_versions('ingredients')
+            if self.changed_ids:
+                recipes = Recipe.objects.filter(
+                    ingredient_in_recipe__ingredient__in=self.changed_ids
                 )
-            
-            Ingredient.objects.bulk_create(ingredients, ignore_conflicts=True)
-            
-            self.stdout.write(
-                self.style.SUCCESS(
-                    f'Successfully loaded {len(ingredients)} ingredients'
-                )
-            ) 
\ No newline at end of file
+                invalidate_recipes(list(recipes.values_list('pk', flat=True)))
+                touch_recipes(recipes)
+        totals = self.totals
+        self.stdout.write(self.style.SUCCESS(
+            f'{"Would load" if options["dry_run"] else "Loaded"} '
+            f'{totals["rows"]} rows: {totals["added"]} added, '
+            f'{totals["changed"]} units changed, '
+            f'{totals["unchanged"]} unchanged in {elapsed:.2f}s '
+            f'({totals["rows"] / max(elapsed, 1e-9):.0f} rows/s)'
+        ))
+
+    def process(self, chunk):
+        added, changed, unchanged = plan_chunk(
+            chunk, self.options['update_units']
+        )
+        if not self.options['dry_run']:
+            apply_chunk(added, changed)
+        return added, changed, unchanged
+
+    def process_in_thread(self, chunk):
+        try:
+            return self.process(chunk)
+        finally:
+            connection.close()
+
+    def process_parallel(self, chunks):
+        workers = self.options['workers']
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = {}
+            for chunk in chunks:
+                future = executor.submit(self.process_in_thread, chunk)
+                pending[future] = len(chunk)
+                # Держим в очереди ограниченное число порций
+                if len(pending) >= workers * 2:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        self.collect(pending.pop(future), future.result())
+            for future in list(pending):
+                self.collect(pending.pop(future), future.result())
+
+    def collect(self, size, result):
+        added, changed, unchanged = result
+        self.totals['rows'] += size
+        self.totals['added'] += len(added)
+        self.totals['changed'] += len(changed)
+        self.totals['unchanged'] += unchanged
+        self.changed_ids.extend(pk for pk, *_ in changed)
+        if self.options['dry_run']:
+            lines = [f'+ {name} ({unit})' for name, unit in added] + [
+                f'~ {name}: {old} -> {new}' for _, name, old, new in changed
+            ]
+            for line in lines[:max(DIFF_LINES_SHOWN - self.diff_lines, 0)]:
+                self.stdout.write(line)
+            self.diff_lines += len(lines)
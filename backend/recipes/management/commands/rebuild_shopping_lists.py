@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or verify materialised shopping lists'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only report mismatches, do not change data',
+        )
+        parser.add_argument(
+            '--user',
+            type=int,
+            action='append',
+            dest='user_ids',
+            help='Limit to the given user id (may be repeated)',
+        )
+
+    def handle(self, *args, **options):
+        user_ids = options['user_ids']
+        if not options['verify']:
+            count = ShoppingListItem.objects.rebuild(user_ids)
+            self.stdout.write(
+                self.style.SUCCESS(f'Rebuilt {count} shopping list items')
+            )
+            return
+
+        expected = {
+            (row['user_id'], row['ingredient_id']): row['total_amount']
+            for row in ShoppingListItem.objects.calculate(user_ids).iterator()
+        }
+        stored = ShoppingListItem.objects.all()
+        if user_ids is not None:
+            stored = stored.filter(user_id__in=user_ids)
+        actual = {
+            (user_id, ingredient_id): total_amount
+            for user_id, ingredient_id, total_amount in stored.values_list(
+                'user_id', 'ingredient_id', 'total_amount'
+            ).iterator()
+        }
+        mismatches = 0
+        for key in sorted(expected.keys() | actual.keys()):
+            if expected.get(key) != actual.get(key):
+                mismatches += 1
+                self.stdout.write(
+                    f'user={key[0]} ingredient={key[1]}: '
+                    f'expected {expected.get(key)}, stored {actual.get(key)}'
+                )
+        if mismatches:
+            self.stdout.write(
+                self.style.ERROR(f'Found {mismatches} mismatched items')
+            )
+        else:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f'All {len(expected)} shopping list items are consistent'
+                )
+            )
@@ -0,0 +1,170 @@
+import posixpath
+from collections import Counter, defaultdict
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.models import StoredFile
+from recipes.signals import STORED_FILE_FIELDS
+from recipes.storage import (
+    RENDITIONS_DIR, content_hash, hashed_name, rendition_path,
+    rendition_source_stem, walk
+)
+
+
+def megabytes(names, sizes):
+    return f'{sum(sizes[name] for name in names) / 1024 / 1024:.1f} MB'
+
+
+class Command(BaseCommand):
+    help = (
+        'Report media volume wasted by orphaned and duplicate files; '
+        'optionally reclaim it'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--delete', action='store_true',
+            help='Delete files that nothing references'
+        )
+        parser.add_argument(
+            '--dedupe', action='store_true',
+            help='Move referenced files to content-addressed names'
+        )
+
+    def get_references(self):
+        references = Counter()
+        for model, fields in STORED_FILE_FIELDS.items():
+            for field in fields:
+                references.update(
+                    model.objects.exclude(**{f'{field}__isnull': True})
+                    .exclude(**{field: ''})
+                    .values_list(field, flat=True)
+                )
+        return references
+
+    @transaction.atomic
+    def sync_stored_files(self, references):
+        # Пересчёт ref_count, как recount для счётчиков
+        stored = dict(StoredFile.objects.values_list('name', 'ref_count'))
+        changed = [
+            StoredFile(name=name, ref_count=references.get(name, 0))
+            for name, ref_count in stored.items()
+            if ref_count != references.get(name, 0)
+        ]
+        StoredFile.objects.bulk_create(
+            [
+                StoredFile(name=name, ref_count=count)
+                for name, count in references.items() if name not in stored
+            ],
+            batch_size=1000
+        )
+        StoredFile.objects.bulk_create(
+            changed, batch_size=1000, update_conflicts=True,
+            unique_fields=['name'], update_fields=['ref_count']
+        )
+        return len(changed)
+
+    def get_directories(self):
+        directories = {
+            model._meta.get_field(field).upload_to.rstrip('/')
+            for model, fields in STORED_FILE_FIELDS.items()
+            for field in fields
+        }
+        return sorted(directories) + [RENDITIONS_DIR]
+
+    def dedupe(self, digests):
+        moved = 0
+        for model, fields in STORED_FILE_FIELDS.items():
+            for field in fields:
+                renditions_field = f'{field}_renditions'
+                for instance in model.objects.filter(
+                    **{f'{field}__in': list(digests)}
+                ):
+                    old = getattr(instance, field).name
+                    new = hashed_name(old, digest=digests[old])
+                    if new == old:
+                        continue
+                    if not default_storage.exists(new):
+                        with default_storage.open(old) as content:
+                            default_storage.save(new, content)
+                    setattr(instance, field, new)
+                    setattr(instance, renditions_field, self.move_renditions(
+                        getattr(instance, renditions_field), new
+                    ))
+                    # Старый файл освобождается сигналами и удаляется
+                    # StoredFile.objects.collect после коммита.
+                    with transaction.atomic():
+                        instance.save(
+                            update_fields=[field, renditions_field]
+                        )
+                    moved += 1
+        return moved
+
+    def move_renditions(self, renditions, name):
+        if not renditions:
+            return {}
+        moved = {'source': name}
+        for extension, paths in renditions.items():
+            if extension == 'source':
+                continue
+            for width, path in paths.items():
+                new_path = rendition_path(name, width, extension)
+                if not default_storage.exists(new_path):
+                    with default_storage.open(path) as content:
+                        default_storage.save(
+                            new_path, ContentFile(content.read())
+                        )
+                moved.setdefault(extension, {})[width] = new_path
+        return moved
+
+    def handle(self, *args, **options):
+        references = self.get_references()
+        fixed = self.sync_stored_files(references)
+        # Недавно загруженные файлы ещё ждут сохранения своей модели
+        kept = references.keys() | StoredFile.objects.pending()
+        referenced_stems = {posixpath.splitext(name)[0] for name in kept}
+
+        sizes = {}
+        for directory in self.get_directories():
+            for name in walk(default_storage, directory):
+                sizes[name] = default_storage.size(name)
+
+        orphans = [
+            name for name in sizes
+            if name not in kept and not (
+                name.startswith(f'{RENDITIONS_DIR}/')
+                and rendition_source_stem(name) in referenced_stems
+            )
+        ]
+        digests = {}
+        by_hash = defaultdict(list)
+        for name in sizes:
+            if name in references:
+                with default_storage.open(name) as content:
+                    digests[name] = content_hash(content)
+                by_hash[digests[name]].append(name)
+        duplicates = [
+            name for names in by_hash.values() for name in names[1:]
+        ]
+
+        self.stdout.write(
+            f'Files: {len(sizes)}, {megabytes(sizes, sizes)}\n'
+            f'Orphaned: {len(orphans)}, {megabytes(orphans, sizes)}\n'
+            f'Duplicates: {len(duplicates)}, '
+            f'{megabytes(duplicates, sizes)}\n'
+            f'Reference counts fixed: {fixed}'
+        )
+
+        if options['dedupe']:
+            moved = self.dedupe(digests)
+            self.stdout.write(f'Moved to content-addressed names: {moved}')
+        if options['delete']:
+            deleted = StoredFile.objects.collect_orphans(orphans)
+            collected = StoredFile.objects.collect()
+            self.stdout.write(self.style.SUCCESS(
+                f'Deleted {len(deleted)} orphaned files and '
+                f'{len(collected)} unreferenced blobs'
+            ))
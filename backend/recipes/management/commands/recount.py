@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import Follow, User
+
+
+def count_of(model, field):
+    return Coalesce(models.Subquery(
+        model.objects.filter(**{field: models.OuterRef('pk')}).order_by()
+        .values(field).annotate(count=models.Count('pk')).values('count')
+    ), 0)
+
+
+class Command(BaseCommand):
+    help = 'Recalculate denormalised recipe and user counters'
+
+    @transaction.atomic
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.update(
+            favorites_count=count_of(Favorite, 'recipe'),
+            in_carts_count=count_of(ShoppingCart, 'recipe'),
+        )
+        users = User.objects.update(
+            recipes_count=count_of(Recipe, 'author'),
+            followers_count=count_of(Follow, 'following'),
+        )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Recounted counters for {recipes} recipes and {users} users'
+            )
+        )
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.16 on 2026-10-18 06:18
+
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def fill_stored_files(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    User = apps.get_model('users', 'User')
+    StoredFile = apps.get_model('recipes', 'StoredFile')
+    references = Counter(
+        Recipe.objects.exclude(image='').values_list('image', flat=True)
+    )
+    references.update(
+        User.objects.exclude(avatar__isnull=True).exclude(avatar='')
+        .values_list('avatar', flat=True)
+    )
+    StoredFile.objects.bulk_create(
+        [
+            StoredFile(name=name, ref_count=count)
+            for name, count in references.items()
+        ],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_image_renditions'),
+        ('users', '0007_user_avatar_renditions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Путь к файлу')),
+                ('ref_count', models.PositiveIntegerField(default=0, verbose_name='Количество ссылок')),
+            ],
+            options={
+                'verbose_name': 'Файл',
+                'verbose_name_plural': 'Файлы',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.RunPython(fill_stored_files, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2.16 on 2026-10-18 06:23
+
+from django.db import migrations, models
+
+
+def merge_into(model, field, duplicate_id, keeper_id, owner, amount):
+    # Строки дубликата переносим на основной ингредиент; если у владельца
+    # (рецепта или пользователя) уже есть строка с ним — складываем.
+    for row in model.objects.filter(**{field: duplicate_id}):
+        existing = model.objects.filter(
+            **{owner: getattr(row, owner), field: keeper_id}
+        ).first()
+        if existing is None:
+            setattr(row, field, keeper_id)
+            row.save(update_fields=[field])
+        else:
+            setattr(
+                existing, amount,
+                getattr(existing, amount) + getattr(row, amount)
+            )
+            existing.save(update_fields=[amount])
+            row.delete()
+
+
+def deduplicate_ingredients(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientInRecipe = apps.get_model('recipes', 'IngredientInRecipe')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(
+        keeper_id=models.Min('id'), count=models.Count('id')
+    ).filter(count__gt=1).order_by()
+    for group in duplicates:
+        duplicate_ids = list(Ingredient.objects.filter(
+            name=group['name'], measurement_unit=group['measurement_unit']
+        ).exclude(id=group['keeper_id']).values_list('id', flat=True))
+        for duplicate_id in duplicate_ids:
+            merge_into(
+                IngredientInRecipe, 'ingredient_id', duplicate_id,
+                group['keeper_id'], 'recipe_id', 'amount'
+            )
+            merge_into(
+                ShoppingListItem, 'ingredient_id', duplicate_id,
+                group['keeper_id'], 'user_id', 'total_amount'
+            )
+        Ingredient.objects.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_storedfile'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            deduplicate_ingredients, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.16 on 2026-10-18 07:37
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0016_recipe_short_link_clicks'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedfile',
+            name='touched_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Последнее сохранение файла'),
+        ),
+    ]
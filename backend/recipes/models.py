@@ -1,11 +1,28 @@
+import posixpath
+from datetime import timedelta
+
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, SearchVector, SearchVectorField,
+    TrigramSimilarity
+)
+from django.conf import settings
+from django.core.files.storage import default_storage
 from django.core.validators import MinValueValidator, MaxValueValidator
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models.functions import Greatest, RowNumber
+from django.utils import timezone
 
-from users.models import User
+from foodgram.managers import UserRelationManager
+from recipes.storage import (
+    RENDITIONS_DIR, delete_file, rendition_source_stem
+)
+from users.models import User, Follow
 
 
 MIN_COOKING_TIME = 1
 MAX_COOKING_TIME = 32000
+SEARCH_CONFIG = 'russian'
 
 
 class Ingredient(models.Model):
@@ -22,17 +39,108 @@ class Ingredient(models.Model):
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
         ordering = ['name']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient_name_unit'
+            )
+        ]
 
     def __str__(self):
         return f'{self.name} ({self.measurement_unit})'
 
 
+class RecipeQuerySet(models.QuerySet):
+    def with_related(self):
+        return self.select_related('author').defer(
+            'search_vector'
+        ).prefetch_related(
+            models.Prefetch(
+                'ingredient_in_recipe',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient'
+                )
+            )
+        )
+
+    def with_user_flags(self, user):
+        # Для анонимного пользователя все флаги заведомо False,
+        # сериализаторы обрабатывают это без запросов к БД.
+        if not user or not user.is_authenticated:
+            return self
+        return self.annotate(
+            is_favorited=models.Exists(Favorite.objects.filter(
+                user=user, recipe=models.OuterRef('pk')
+            )),
+            is_in_shopping_cart=models.Exists(ShoppingCart.objects.filter(
+                user=user, recipe=models.OuterRef('pk')
+            )),
+            author_is_subscribed=models.Exists(Follow.objects.filter(
+                user=user, following=models.OuterRef('author')
+            )),
+        )
+
+    def latest_per_author(self, limit=None):
+        # Последние limit рецептов каждого автора одним запросом:
+        # ROW_NUMBER() OVER (PARTITION BY author_id ORDER BY created_at DESC)
+        if limit is None:
+            return self
+        return self.annotate(
+            author_row_number=models.Window(
+                expression=RowNumber(),
+                partition_by=[models.F('author')],
+                order_by=[models.F('created_at').desc(), models.F('id').desc()]
+            )
+        ).filter(author_row_number__lte=limit)
+
+    def search(self, query):
+        if connections[self.db].vendor != 'postgresql':
+            # Запасной вариант для SQLite (тесты, локальная разработка)
+            return self.filter(
+                models.Q(name__icontains=query)
+                | models.Q(text__icontains=query)
+                | models.Q(models.Exists(IngredientInRecipe.objects.filter(
+                    recipe=models.OuterRef('pk'),
+                    ingredient__name__icontains=query
+                )))
+            )
+        search_query = SearchQuery(
+            query, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        # Оба условия обслуживаются GIN-индексами (см. миграцию 0006)
+        return self.filter(
+            models.Q(search_vector=search_query)
+            | models.Q(name__trigram_similar=query)
+        ).annotate(
+            search_rank=SearchRank(models.F('search_vector'), search_query)
+            + TrigramSimilarity('name', query)
+        ).order_by('-search_rank', '-created_at')
+
+    def update_search_vector(self):
+        if connections[self.db].vendor != 'postgresql':
+            return 0
+        ingredient_names = models.Subquery(
+            IngredientInRecipe.objects.filter(
+                recipe=models.OuterRef('pk')
+            ).order_by().values('recipe').annotate(
+                names=StringAgg('ingredient__name', ' ')
+            ).values('names')
+        )
+        return self.update(search_vector=(
+            SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+            + SearchVector(ingredient_names, weight='C', config=SEARCH_CONFIG)
+        ))
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         related_name='recipes',
-        verbose_name='Автор рецепта'
+        verbose_name='Автор рецепта',
+        # Поиск по автору обслуживает recipe_author_created_idx
+        db_index=False
     )
     name = models.CharField(
         max_length=256,
@@ -42,6 +150,12 @@ class Recipe(models.Model):
         upload_to='recipes/images/',
         verbose_name='Фото блюда'
     )
+    image_renditions = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Уменьшенные копии фото'
+    )
     text = models.TextField(
         verbose_name='Описание рецепта'
     )
@@ -62,11 +176,51 @@ class Recipe(models.Model):
         auto_now_add=True,
         verbose_name='Дата публикации'
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата изменения'
+    )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Добавлений в избранное'
+    )
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Добавлений в список покупок'
+    )
+    short_link_clicks = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Переходов по короткой ссылке'
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый вектор'
+    )
+    similar_updated_at = models.DateTimeField(
+        null=True,
+        editable=False,
+        verbose_name='Дата расчёта похожих рецептов'
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ['-created_at']
+        indexes = [
+            models.Index(
+                fields=['-created_at', '-id'],
+                name='recipe_created_at_id_idx'
+            ),
+            # Страница автора и последние рецепты в подписках
+            models.Index(
+                fields=['author', '-created_at', '-id'],
+                name='recipe_author_created_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -83,7 +237,8 @@ class IngredientInRecipe(models.Model):
         Ingredient,
         on_delete=models.CASCADE,
         related_name='ingredient_in_recipe',
-        verbose_name='Ингредиент'
+        verbose_name='Ингредиент',
+        db_index=False
     )
     amount = models.PositiveIntegerField(
         validators=[MinValueValidator(MIN_COOKING_TIME)],
@@ -100,6 +255,14 @@ class IngredientInRecipe(models.Model):
                 name='unique_ingredient_in_recipe'
             )
         ]
+        indexes = [
+            # Рецепты по ингредиентам (filter_by_ingredients) читаются
+            # только из индекса, без обращения к таблице
+            models.Index(
+                fields=['ingredient', 'recipe'],
+                name='ingredient_recipe_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.ingredient} в {self.recipe}'
@@ -119,6 +282,8 @@ class Favorite(models.Model):
         verbose_name='Рецепт'
     )
 
+    objects = UserRelationManager()
+
     class Meta:
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
@@ -148,6 +313,8 @@ class ShoppingCart(models.Model):
         verbose_name='Рецепт'
     )
 
+    objects = UserRelationManager()
+
     class Meta:
         verbose_name = 'Список покупок'
         verbose_name_plural = 'Списки покупок'
@@ -160,4 +327,445 @@ class ShoppingCart(models.Model):
         ]
 
     def __str__(self):
-        return f'{self.user} добавил {self.recipe} в список покупок'
\ No newline at end of file
+        return f'{self.user} добавил {self.recipe} в список покупок'
+
+
+class ShoppingListItemManager(models.Manager):
+    def calculate(self, user_ids=None):
+        # Эталонный расчёт списка покупок по корзинам — для пересборки
+        # и проверки материализованных строк.
+        queryset = ShoppingCart.objects.all()
+        if user_ids is not None:
+            queryset = queryset.filter(user_id__in=user_ids)
+        return queryset.values(
+            'user_id', ingredient_id=models.F(
+                'recipe__ingredient_in_recipe__ingredient'
+            )
+        ).annotate(
+            total_amount=models.Sum('recipe__ingredient_in_recipe__amount')
+        ).filter(ingredient_id__isnull=False).order_by()
+
+    def rebuild(self, user_ids=None):
+        with transaction.atomic():
+            stale = self.all()
+            if user_ids is not None:
+                stale = stale.filter(user_id__in=user_ids)
+            stale.delete()
+            return len(self.bulk_create(
+                (self.model(**row) for row in self.calculate(user_ids)),
+                batch_size=1000
+            ))
+
+    def apply_deltas(self, user_ids, deltas):
+        # deltas: {ingredient_id: изменение количества} для каждого
+        # пользователя из user_ids; строки обновляются одним UPDATE с F().
+        deltas = {
+            ingredient_id: delta
+            for ingredient_id, delta in deltas.items() if delta
+        }
+        user_ids = list(user_ids)
+        if not deltas or not user_ids:
+            return
+        with transaction.atomic():
+            self.bulk_create([
+                self.model(
+                    user_id=user_id, ingredient_id=ingredient_id,
+                    total_amount=0
+                )
+                for user_id in user_ids
+                for ingredient_id, delta in deltas.items() if delta > 0
+            ], ignore_conflicts=True)
+            items = self.filter(user_id__in=user_ids, ingredient_id__in=deltas)
+            items.update(total_amount=Greatest(
+                models.F('total_amount') + models.Case(
+                    *[
+                        models.When(ingredient_id=ingredient_id, then=delta)
+                        for ingredient_id, delta in deltas.items()
+                    ],
+                    default=0
+                ),
+                0
+            ))
+            items.filter(total_amount=0).delete()
+
+    def recipe_totals(self, recipe_ids):
+        return dict(
+            IngredientInRecipe.objects.filter(recipe_id__in=recipe_ids)
+            .values('ingredient_id').annotate(total=models.Sum('amount'))
+            .order_by().values_list('ingredient_id', 'total')
+        )
+
+    def add_recipes(self, user_ids, recipe_ids):
+        if recipe_ids:
+            self.apply_deltas(user_ids, self.recipe_totals(recipe_ids))
+
+    def remove_recipes(self, user_ids, recipe_ids):
+        if recipe_ids:
+            self.apply_deltas(user_ids, {
+                ingredient_id: -total
+                for ingredient_id, total in
+                self.recipe_totals(recipe_ids).items()
+            })
+
+    def add_recipe(self, user_ids, recipe):
+        self.add_recipes(user_ids, [recipe.pk])
+
+    def remove_recipe(self, user_ids, recipe):
+        self.remove_recipes(user_ids, [recipe.pk])
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Ингредиент'
+    )
+    total_amount = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Общее количество'
+    )
+
+    objects = ShoppingListItemManager()
+
+    class Meta:
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Позиции списка покупок'
+        ordering = ['user', 'ingredient']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient} - {self.total_amount} для {self.user}'
+
+
+class StoredFileManager(models.Manager):
+    def acquire(self, name, count=1):
+        if not name:
+            return
+        if not self.filter(name=name).update(
+            ref_count=models.F('ref_count') + count
+        ):
+            _, created = self.get_or_create(
+                name=name, defaults={'ref_count': count}
+            )
+            if not created:
+                self.filter(name=name).update(
+                    ref_count=models.F('ref_count') + count
+                )
+
+    def touch(self, name):
+        """Отмечает файл, только что сохранённый или найденный хранилищем.
+
+        Ссылку на файл модель получит лишь после сохранения, а до этого
+        collect не трогает строку STORED_FILE_GRACE_PERIOD секунд.
+        Возвращает False, если строки не было (файл мог быть удалён).
+        """
+        if self.filter(name=name).update(touched_at=timezone.now()):
+            return True
+        _, created = self.get_or_create(
+            name=name, defaults={'touched_at': timezone.now()}
+        )
+        if not created:
+            self.filter(name=name).update(touched_at=timezone.now())
+        return False
+
+    def release(self, name):
+        if not name:
+            return
+        self.filter(name=name).update(
+            ref_count=Greatest(models.F('ref_count') - 1, 0)
+        )
+        transaction.on_commit(lambda: self.collect([name]))
+
+    def cutoff(self):
+        return timezone.now() - timedelta(
+            seconds=settings.STORED_FILE_GRACE_PERIOD
+        )
+
+    def pending(self):
+        """Имена недавно сохранённых файлов, которые collect не трогает."""
+        return set(
+            self.filter(touched_at__gte=self.cutoff())
+            .values_list('name', flat=True)
+        )
+
+    def collect(self, names=None):
+        """Удаляет файлы, на которые не осталось ссылок.
+
+        Строка проверяется повторно под блокировкой и удаляется вместе с
+        файлом в одной транзакции: параллельная загрузка того же
+        содержимого ждёт блокировку в touch и, не найдя строки, пишет
+        файл заново. Недавно отмеченные (touch) строки пропускаются —
+        их файлы ждут сохранения модели; такие файлы соберёт следующий
+        вызов (reclaim_media --delete).
+        """
+        unreferenced = models.Q(ref_count=0, touched_at__lt=self.cutoff())
+        queryset = self.filter(unreferenced)
+        if names is not None:
+            queryset = queryset.filter(name__in=names)
+        collected = []
+        for name in queryset.values_list('name', flat=True):
+            with transaction.atomic():
+                stored = self.select_for_update().filter(
+                    unreferenced, name=name
+                ).first()
+                if stored is None:
+                    continue
+                stored.delete()
+                delete_file(name)
+            collected.append(name)
+        return collected
+
+    def collect_orphans(self, names):
+        """Удаляет файлы, найденные обходом хранилища без ссылок.
+
+        Список мог устареть, пока шёл обход, поэтому файлы удаляются
+        через collect: для файла без строки заводится строка с истёкшей
+        паузой, и ссылки с touched_at проверяются повторно под
+        блокировкой. Уменьшенные копии без исходного файла удаляются,
+        только если строки исходника по-прежнему нет.
+        """
+        renditions_prefix = f'{RENDITIONS_DIR}/'
+        sources = [
+            name for name in names if not name.startswith(renditions_prefix)
+        ]
+        expired = self.cutoff() - timedelta(seconds=1)
+        self.bulk_create(
+            [
+                self.model(name=name, ref_count=0, touched_at=expired)
+                for name in sources
+            ],
+            batch_size=1000, ignore_conflicts=True
+        )
+        collected = self.collect(sources)
+        # Копии исходников из списка удаляет вместе с ними collect
+        source_stems = {posixpath.splitext(name)[0] for name in sources}
+        for name in names:
+            if not name.startswith(renditions_prefix):
+                continue
+            stem = rendition_source_stem(name)
+            if stem in source_stems:
+                continue
+            with transaction.atomic():
+                if self.select_for_update().filter(
+                    name__startswith=f'{stem}.'
+                ).exists():
+                    continue
+                default_storage.delete(name)
+            collected.append(name)
+        return collected
+
+
+class StoredFile(models.Model):
+    name = models.CharField(
+        max_length=255,
+        unique=True,
+        verbose_name='Путь к файлу'
+    )
+    ref_count = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Количество ссылок'
+    )
+    touched_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Последнее сохранение файла'
+    )
+
+    objects = StoredFileManager()
+
+    class Meta:
+        verbose_name = 'Файл'
+        verbose_name_plural = 'Файлы'
+        ordering = ['name']
+
+    def __str__(self):
+        return f'{self.name} ({self.ref_count})'
+
+
+class SimilarRecipeManager(models.Manager):
+    def replace(self, neighbours, computed_at):
+        """Заменяет списки похожих рецептов.
+
+        neighbours: {recipe_id: [(similar_id, score), ...]}. Рецепты,
+        изменённые после computed_at (начала расчёта), останутся
+        устаревшими и попадут в следующий инкрементальный прогон.
+        """
+        with transaction.atomic():
+            self.filter(recipe_id__in=neighbours).delete()
+            self.bulk_create(
+                (
+                    self.model(
+                        recipe_id=recipe_id, similar_id=similar_id,
+                        score=score
+                    )
+                    for recipe_id, similar in neighbours.items()
+                    for similar_id, score in similar
+                ),
+                batch_size=1000
+            )
+            Recipe.objects.filter(pk__in=neighbours).update(
+                similar_updated_at=computed_at
+            )
+
+
+class SimilarRecipe(models.Model):
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_recipes',
+        verbose_name='Рецепт',
+        # Выборку по рецепту обслуживает similar_recipe_score_idx
+        db_index=False
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Похожий рецепт'
+    )
+    score = models.FloatField(verbose_name='Сходство')
+
+    objects = SimilarRecipeManager()
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        ordering = ['recipe', '-score']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'similar'],
+                name='unique_similar_recipe'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['recipe', '-score'],
+                name='similar_recipe_score_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.similar} похож на {self.recipe} ({self.score:.2f})'
+
+
+class TimelineEntryManager(models.Manager):
+    """Ленты подписок: рецепты раскладываются по лентам подписчиков
+    при публикации (fan-out on write).
+
+    Рецепты авторов, у которых не меньше FEED_FANOUT_MAX_FOLLOWERS
+    подписчиков, при публикации не раскладываются — подписчик забирает
+    их при чтении ленты (sync). Лента обрезается до FEED_MAX_ENTRIES
+    последних рецептов.
+    """
+
+    def fan_out(self, recipe):
+        # Одним INSERT ... SELECT по подписчикам, без выборки в Python
+        follow_table = Follow._meta.db_table
+        connection = connections[self.db]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {self.model._meta.db_table} '
+                f'(user_id, recipe_id, created_at) '
+                f'SELECT user_id, %s, %s FROM {follow_table} '
+                f'WHERE following_id = %s ON CONFLICT DO NOTHING',
+                [
+                    recipe.pk,
+                    connection.ops.adapt_datetimefield_value(
+                        recipe.created_at
+                    ),
+                    recipe.author_id,
+                ]
+            )
+
+    def add_recent(self, user_id, author_id, since=None):
+        recipes = Recipe.objects.filter(author_id=author_id)
+        if since is not None:
+            recipes = recipes.filter(created_at__gt=since)
+        recent = recipes.order_by('-created_at', '-id').values_list(
+            'pk', 'created_at'
+        )[:settings.FEED_MAX_ENTRIES]
+        self.bulk_create(
+            [
+                self.model(user_id=user_id, recipe_id=pk, created_at=created)
+                for pk, created in recent
+            ],
+            ignore_conflicts=True
+        )
+
+    def sync(self, user):
+        follows = Follow.objects.filter(
+            user=user, following__followers_count__gte=(
+                settings.FEED_FANOUT_MAX_FOLLOWERS
+            )
+        ).values_list('pk', 'following_id', 'feed_synced_at')
+        synced_at = timezone.now()
+        synced = []
+        for pk, author_id, since in follows:
+            self.add_recent(user.pk, author_id, since)
+            synced.append(pk)
+        Follow.objects.filter(pk__in=synced).update(feed_synced_at=synced_at)
+
+    def trim(self, user):
+        boundary = self.filter(user=user).order_by(
+            '-created_at', '-recipe_id'
+        ).values_list('created_at', 'recipe_id')[
+            settings.FEED_MAX_ENTRIES:settings.FEED_MAX_ENTRIES + 1
+        ]
+        if boundary:
+            [(created_at, recipe_id)] = boundary
+            self.filter(
+                models.Q(created_at__lt=created_at)
+                | models.Q(created_at=created_at, recipe_id__lte=recipe_id),
+                user=user
+            ).delete()
+
+
+class TimelineEntry(models.Model):
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Пользователь',
+        # Выборку по пользователю обслуживает timeline_user_created_idx
+        db_index=False
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Рецепт'
+    )
+    created_at = models.DateTimeField(verbose_name='Дата публикации')
+
+    objects = TimelineEntryManager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи лент'
+        ordering = ['user', '-created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_timeline_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-created_at', '-recipe'],
+                name='timeline_user_created_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe} в ленте {self.user}'
@@ -0,0 +1,299 @@
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+
+from recipes.models import IngredientInRecipe
+
+RANKINGS = ('coverage', 'jaccard')
+
+
+def positions_to_bitset(positions):
+    if not positions:
+        return 0
+    buffer = bytearray(positions[-1] // 8 + 1)
+    for position in positions:
+        buffer[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(buffer, 'little')
+
+
+def add_bitset(planes, bitset):
+    # Битовые срезы счётчиков: planes[j] хранит j-й бит значения
+    # каждого рецепта, прибавление маски — перенос по срезам.
+    carry = bitset
+    for j, plane in enumerate(planes):
+        if not carry:
+            return
+        planes[j], carry = plane ^ carry, plane & carry
+    if carry:
+        planes.append(carry)
+
+
+def subtract_planes(left, right):
+    result, borrow = [], 0
+    for j in range(len(left)):
+        a = left[j]
+        b = right[j] if j < len(right) else 0
+        result.append(a ^ b ^ borrow)
+        borrow = (~a & b) | (~(a ^ b) & borrow)
+    return result
+
+
+def equal_to(planes, value, mask):
+    """Маска позиций из mask, где значение в срезах равно value."""
+    if value >> len(planes):
+        return 0
+    for j, plane in enumerate(planes):
+        mask &= plane if value >> j & 1 else ~plane
+        if not mask:
+            break
+    return mask
+
+
+def iter_bits_descending(bitset):
+    while bitset:
+        position = bitset.bit_length() - 1
+        yield position
+        bitset ^= 1 << position
+
+
+class MatchResult:
+    """Ранжированный результат: группы (missing, matched) с масками.
+
+    Позиции извлекаются из масок лениво при срезе, поэтому Paginator
+    получает число совпадений через bit_count и читает только страницу.
+    """
+
+    def __init__(self, buckets, recipe_ids, pantry_size):
+        self.buckets = buckets
+        self.recipe_ids = recipe_ids
+        self.pantry_size = pantry_size
+        self.total = sum(count for *_, count in buckets)
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop, _ = index.indices(self.total)
+        result = []
+        for missing, matched, mask, count in self.buckets:
+            if start >= count:
+                start -= count
+                stop -= count
+                continue
+            for number, position in enumerate(iter_bits_descending(mask)):
+                if number >= stop:
+                    break
+                if number >= start:
+                    result.append({
+                        'id': self.recipe_ids[position],
+                        'matched': matched,
+                        'missing': missing,
+                        'jaccard': matched / (missing + self.pantry_size),
+                    })
+            if stop <= count:
+                break
+            start, stop = 0, stop - count
+        return result
+
+
+class RecipeMatcher:
+    """Инвертированный индекс ингредиент -> рецепты в памяти процесса.
+
+    Рецепту соответствует позиция, списку рецептов ингредиента —
+    контейнер как в roaring-битмапах: отсортированный array позиций для
+    редких ингредиентов и int-битсет для частых. Запрос складывает
+    битсеты кладовой в битовые срезы счётчиков и ранжирует рецепты по
+    числу недостающих ингредиентов и совпавших. Изменённые рецепты
+    помечаются сигналами и перечитываются перед следующим запросом;
+    целиком индекс перестраивается не реже, чем раз в
+    RECIPE_MATCHER_TTL секунд (изменения из других процессов).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._dirty = set()
+        self._loaded_at = None
+        self._clear()
+
+    def _clear(self):
+        self._recipe_ids = []
+        self._positions = {}
+        self._ingredients = []
+        self._postings = {}
+        self._size_planes = []
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def mark_dirty(self, recipe_ids):
+        with self._lock:
+            self._dirty.update(recipe_ids)
+
+    def build(self, rows):
+        """Строит индекс по парам (recipe_id, ingredient_id),
+        упорядоченным по recipe_id."""
+        with self._lock:
+            self._clear()
+            postings = {}
+            sizes = array('H')
+            for recipe_id, group in groupby(rows, key=itemgetter(0)):
+                ingredients = frozenset(
+                    ingredient_id for _, ingredient_id in group
+                )
+                position = len(self._recipe_ids)
+                self._recipe_ids.append(recipe_id)
+                self._positions[recipe_id] = position
+                self._ingredients.append(ingredients)
+                sizes.append(len(ingredients))
+                for ingredient_id in ingredients:
+                    postings.setdefault(
+                        ingredient_id, array('I')
+                    ).append(position)
+            total = len(self._recipe_ids)
+            self._postings = {
+                ingredient_id: (
+                    positions_to_bitset(positions)
+                    if self._is_dense(len(positions), total) else positions
+                )
+                for ingredient_id, positions in postings.items()
+            }
+            self._size_planes = [
+                positions_to_bitset(array('I', (
+                    position for position, size in enumerate(sizes)
+                    if size >> j & 1
+                )))
+                for j in range(max(sizes, default=0).bit_length())
+            ]
+            self._loaded_at = time.monotonic()
+
+    def _is_dense(self, count, total):
+        # Битсет занимает total / 8 байт, array — 4 байта на позицию
+        return count * 32 > total
+
+    def _load(self):
+        self.build(
+            IngredientInRecipe.objects.order_by('recipe_id').values_list(
+                'recipe_id', 'ingredient_id'
+            ).iterator(chunk_size=10000)
+        )
+
+    def _refresh(self):
+        ttl = getattr(settings, 'RECIPE_MATCHER_TTL', 600)
+        if self._loaded_at is None or (
+            time.monotonic() - self._loaded_at >= ttl
+        ):
+            self._dirty.clear()
+            self._load()
+            return
+        if not self._dirty:
+            return
+        recipe_ids, self._dirty = self._dirty, set()
+        rows = IngredientInRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).order_by('recipe_id').values_list('recipe_id', 'ingredient_id')
+        ingredients = {
+            recipe_id: {ingredient_id for _, ingredient_id in group}
+            for recipe_id, group in groupby(rows, key=itemgetter(0))
+        }
+        for recipe_id in recipe_ids:
+            self._set_recipe(recipe_id, ingredients.get(recipe_id, set()))
+
+    def _set_recipe(self, recipe_id, ingredients):
+        position = self._positions.get(recipe_id)
+        if position is None:
+            if not ingredients:
+                return
+            position = len(self._recipe_ids)
+            self._recipe_ids.append(recipe_id)
+            self._positions[recipe_id] = position
+            self._ingredients.append(frozenset())
+        old = self._ingredients[position]
+        for ingredient_id in old - ingredients:
+            self._discard(ingredient_id, position)
+        for ingredient_id in ingredients - old:
+            self._add(ingredient_id, position)
+        self._ingredients[position] = frozenset(ingredients)
+        bit = 1 << position
+        while len(ingredients) >> len(self._size_planes):
+            self._size_planes.append(0)
+        for j, plane in enumerate(self._size_planes):
+            self._size_planes[j] = (
+                plane | bit if len(ingredients) >> j & 1 else plane & ~bit
+            )
+
+    def _add(self, ingredient_id, position):
+        posting = self._postings.get(ingredient_id, array('I'))
+        if isinstance(posting, int):
+            posting |= 1 << position
+        else:
+            insort(posting, position)
+        self._postings[ingredient_id] = posting
+
+    def _discard(self, ingredient_id, position):
+        posting = self._postings.get(ingredient_id)
+        if isinstance(posting, int):
+            self._postings[ingredient_id] = posting & ~(1 << position)
+        elif posting is not None:
+            index = bisect_left(posting, position)
+            if index < len(posting) and posting[index] == position:
+                del posting[index]
+
+    def _bitset(self, ingredient_id):
+        posting = self._postings.get(ingredient_id, 0)
+        if isinstance(posting, int):
+            return posting
+        return positions_to_bitset(posting)
+
+    def match(self, pantry, max_missing=None, ranking='coverage'):
+        """Рецепты, которые можно приготовить из pantry (id ингредиентов).
+
+        ranking='coverage' — сначала меньше недостающих, затем больше
+        совпавших; 'jaccard' — по |общих| / |объединения|.
+        """
+        pantry = set(pantry)
+        with self._lock:
+            self._refresh()
+            bitsets = [self._bitset(ingredient_id) for ingredient_id in pantry]
+            size_planes = list(self._size_planes)
+            recipe_ids = self._recipe_ids
+        candidates = 0
+        matched_planes = []
+        for bitset in bitsets:
+            candidates |= bitset
+            add_bitset(matched_planes, bitset)
+        missing_planes = subtract_planes(size_planes, matched_planes)
+
+        max_value = (1 << len(size_planes)) - 1
+        if max_missing is not None:
+            max_value = min(max_value, max_missing)
+        by_matched = {}
+        buckets = []
+        for missing in range(max_value + 1):
+            with_missing = equal_to(missing_planes, missing, candidates)
+            if not with_missing:
+                continue
+            for matched in range(len(pantry), 0, -1):
+                if matched not in by_matched:
+                    by_matched[matched] = equal_to(
+                        matched_planes, matched, candidates
+                    )
+                mask = with_missing & by_matched[matched]
+                if mask:
+                    buckets.append(
+                        (missing, matched, mask, mask.bit_count())
+                    )
+        if ranking == 'jaccard':
+            buckets.sort(key=lambda bucket: (
+                -bucket[1] / (bucket[0] + len(pantry)), bucket[0]
+            ))
+        return MatchResult(buckets, recipe_ids, len(pantry))
+
+
+recipe_matcher = RecipeMatcher()
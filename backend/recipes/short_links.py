@@ -0,0 +1,140 @@
+"""Короткие ссылки на рецепты: {BASE_URL}/s/<код>.
+
+Код — id рецепта в base62 и SIGNATURE_LENGTH символов HMAC от id на
+SECRET_KEY. Ссылка проверяется без обращения к БД, а чужие рецепты
+не найти перебором id. Переходы считаются в памяти процесса и
+записываются в Recipe.short_link_clicks пачками.
+"""
+import atexit
+import logging
+import string
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import F
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+ALPHABET = string.digits + string.ascii_letters
+SIGNATURE_LENGTH = 4
+SALT = 'recipes.short_links'
+
+
+def to_base62(number):
+    digits = []
+    while True:
+        number, digit = divmod(number, len(ALPHABET))
+        digits.append(ALPHABET[digit])
+        if not number:
+            return ''.join(reversed(digits))
+
+
+def signature(recipe_id):
+    digest = salted_hmac(SALT, str(recipe_id), algorithm='sha256').digest()
+    return to_base62(
+        int.from_bytes(digest[:8], 'big') % len(ALPHABET) ** SIGNATURE_LENGTH
+    ).rjust(SIGNATURE_LENGTH, ALPHABET[0])
+
+
+def make_code(recipe_id):
+    return to_base62(recipe_id) + signature(recipe_id)
+
+
+def parse_code(code):
+    """id рецепта по коду или None, если код не выдавался."""
+    encoded = code[:-SIGNATURE_LENGTH]
+    if not encoded or any(char not in ALPHABET for char in code):
+        return None
+    recipe_id = 0
+    for char in encoded:
+        recipe_id = recipe_id * len(ALPHABET) + ALPHABET.index(char)
+    # Единственная запись id: код с ведущими нулями не выдавался
+    if to_base62(recipe_id) != encoded or not constant_time_compare(
+        signature(recipe_id), code[-SIGNATURE_LENGTH:]
+    ):
+        return None
+    return recipe_id
+
+
+class ShortLinkResolver:
+    """LRU проверенных кодов: горячие ссылки не пересчитывают HMAC.
+
+    Неверные коды не кэшируются, чтобы перебор не вытеснял рабочие.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._codes = OrderedDict()
+
+    def resolve(self, code):
+        with self._lock:
+            recipe_id = self._codes.get(code)
+            if recipe_id is not None:
+                self._codes.move_to_end(code)
+                return recipe_id
+        recipe_id = parse_code(code)
+        if recipe_id is not None:
+            with self._lock:
+                self._codes[code] = recipe_id
+                while len(self._codes) > settings.SHORT_LINK_CACHE_SIZE:
+                    self._codes.popitem(last=False)
+        return recipe_id
+
+
+class ClickCounter:
+    """Счётчик переходов, сбрасываемый в БД пачками.
+
+    Запрос, на котором накопилось SHORT_LINK_FLUSH_SIZE переходов или
+    прошло SHORT_LINK_FLUSH_INTERVAL секунд с прошлой записи, пишет все
+    накопленные: по одному UPDATE на каждое встретившееся число
+    переходов, а не на каждый переход. Остаток пишется при выходе.
+    Если БД недоступна, переходы возвращаются в очередь до следующей
+    записи, а переход по ссылке всё равно выполняется.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = Counter()
+        self._flushed_at = time.monotonic()
+
+    def record(self, recipe_id):
+        with self._lock:
+            self._pending[recipe_id] += 1
+            due = (
+                self._pending.total() >= settings.SHORT_LINK_FLUSH_SIZE
+                or time.monotonic() - self._flushed_at
+                >= settings.SHORT_LINK_FLUSH_INTERVAL
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            self._flushed_at = time.monotonic()
+        by_count = defaultdict(list)
+        for recipe_id, count in pending.items():
+            by_count[count].append(recipe_id)
+        try:
+            with transaction.atomic():
+                for count, recipe_ids in by_count.items():
+                    Recipe.objects.filter(pk__in=recipe_ids).update(
+                        short_link_clicks=F('short_link_clicks') + count
+                    )
+        except DatabaseError:
+            logger.exception(
+                'Не удалось записать %d переходов', pending.total()
+            )
+            with self._lock:
+                self._pending.update(pending)
+
+
+short_link_resolver = ShortLinkResolver()
+click_counter = ClickCounter()
+atexit.register(click_counter.flush)
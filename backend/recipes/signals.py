@@ -0,0 +1,125 @@
+from django.db.models.signals import (
+    post_delete, post_init, post_save, pre_save
+)
+from django.conf import settings
+from django.db import transaction
+from django.dispatch import receiver
+
+from recipes.ingredient_index import ingredient_index
+from recipes.models import (
+    Ingredient, IngredientInRecipe, Recipe, StoredFile, TimelineEntry
+)
+from recipes.recipe_matcher import recipe_matcher
+from users.models import Follow, User
+
+# Поля с файлами из ContentAddressedStorage, на которые ведётся
+# подсчёт ссылок в StoredFile.
+STORED_FILE_FIELDS = {Recipe: ('image',), User: ('avatar',)}
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def invalidate_ingredient_index(sender, **kwargs):
+    # Сброс до коммита позволил бы другому запросу перечитать каталог
+    # без изменения и держать устаревший снимок до INGREDIENT_INDEX_TTL
+    transaction.on_commit(ingredient_index.invalidate)
+
+
+@receiver(post_save, sender=Ingredient)
+def update_recipe_search_vectors(sender, instance, created, **kwargs):
+    if not created:
+        Recipe.objects.filter(
+            ingredient_in_recipe__ingredient=instance
+        ).update_search_vector()
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+@receiver([post_save, post_delete], sender=IngredientInRecipe)
+def mark_recipe_for_matcher(sender, instance, **kwargs):
+    # Ингредиенты рецепта пишутся bulk_create уже после сохранения
+    # рецепта, поэтому перечитываем его после коммита.
+    recipe_id = instance.pk if sender is Recipe else instance.recipe_id
+    transaction.on_commit(lambda: recipe_matcher.mark_dirty([recipe_id]))
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(sender, instance, created, **kwargs):
+    if not created:
+        return
+    # instance.author может прийти из кэша токенов с устаревшим
+    # счётчиком подписчиков, поэтому читаем текущий из БД
+    followers_count = User.objects.filter(
+        pk=instance.author_id
+    ).values_list('followers_count', flat=True).first() or 0
+    if followers_count < settings.FEED_FANOUT_MAX_FOLLOWERS:
+        TimelineEntry.objects.fan_out(instance)
+
+
+@receiver(post_save, sender=Follow)
+def fill_timeline(sender, instance, created, **kwargs):
+    if created:
+        TimelineEntry.objects.add_recent(
+            instance.user_id, instance.following_id
+        )
+
+
+@receiver(post_delete, sender=Follow)
+def clear_timeline(sender, instance, **kwargs):
+    TimelineEntry.objects.filter(
+        user_id=instance.user_id, recipe__author_id=instance.following_id
+    ).delete()
+
+
+def file_name(value):
+    return getattr(value, 'name', value) or ''
+
+
+def remember_stored_files(sender, instance, **kwargs):
+    # Запоминаем имена файлов, загруженные из БД, чтобы при сохранении
+    # понять, какой файл освободился. Отложенные поля пропускаем.
+    instance._stored_files = {
+        field: file_name(instance.__dict__[field])
+        for field in STORED_FILE_FIELDS[sender]
+        if field in instance.__dict__
+    }
+
+
+def load_missing_stored_files(sender, instance, **kwargs):
+    if instance._state.adding:
+        return
+    missing = [
+        field for field in STORED_FILE_FIELDS[sender]
+        if field not in instance._stored_files
+    ]
+    if missing:
+        instance._stored_files.update(
+            sender.objects.filter(pk=instance.pk).values(*missing).first()
+            or {}
+        )
+
+
+def update_stored_file_refs(sender, instance, created, update_fields,
+                            **kwargs):
+    for field in STORED_FILE_FIELDS[sender]:
+        if update_fields is not None and field not in update_fields:
+            continue
+        old = '' if created else instance._stored_files.get(field, '')
+        new = file_name(getattr(instance, field))
+        if old != new:
+            StoredFile.objects.acquire(new)
+            StoredFile.objects.release(old)
+            instance._stored_files[field] = new
+
+
+def release_stored_files(sender, instance, **kwargs):
+    for field in STORED_FILE_FIELDS[sender]:
+        StoredFile.objects.release(
+            instance._stored_files.get(field)
+            or file_name(getattr(instance, field))
+        )
+
+
+for model in STORED_FILE_FIELDS:
+    post_init.connect(remember_stored_files, sender=model)
+    pre_save.connect(load_missing_stored_files, sender=model)
+    post_save.connect(update_stored_file_refs, sender=model)
+    post_delete.connect(release_stored_files, sender=model)
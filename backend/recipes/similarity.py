@@ -0,0 +1,97 @@
+"""Похожие рецепты: косинусная близость TF-IDF векторов ингредиентов.
+
+Модуль не импортирует Django: функции выполняются в процессах пула
+build_similar_recipes, которым БД не нужна.
+"""
+import heapq
+import math
+from collections import Counter, defaultdict
+from itertools import groupby
+from operator import itemgetter
+
+_state = {}
+
+
+def build_vectors(rows, max_df=1.0):
+    """Нормированные TF-IDF векторы и инвертированные списки.
+
+    rows — (recipe_id, ingredient_id, amount), упорядоченные по
+    recipe_id. Вес ингредиента в рецепте — log(1 + amount) * idf;
+    ингредиенты, которые есть больше чем в max_df доле рецептов
+    (соль, вода), не учитываются, как max_df в sklearn.
+    """
+    raw = {
+        recipe_id: {
+            ingredient_id: math.log1p(amount)
+            for _, ingredient_id, amount in group
+        }
+        for recipe_id, group in groupby(rows, key=itemgetter(0))
+    }
+    total = len(raw)
+    frequency = Counter(
+        ingredient_id for vector in raw.values() for ingredient_id in vector
+    )
+    idf = {
+        ingredient_id: math.log((1 + total) / (1 + count)) + 1
+        for ingredient_id, count in frequency.items()
+        if count <= max_df * total
+    }
+    vectors = {}
+    postings = defaultdict(list)
+    for recipe_id, vector in raw.items():
+        weights = {
+            ingredient_id: tf * idf[ingredient_id]
+            for ingredient_id, tf in vector.items() if ingredient_id in idf
+        }
+        norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+        vectors[recipe_id] = {
+            ingredient_id: weight / norm
+            for ingredient_id, weight in weights.items()
+        } if norm else {}
+        for ingredient_id, weight in vectors[recipe_id].items():
+            postings[ingredient_id].append((recipe_id, weight))
+    return vectors, dict(postings)
+
+
+def init_worker(vectors, postings, thresholds, top_k):
+    _state.update(
+        vectors=vectors, postings=postings, thresholds=thresholds,
+        top_k=top_k
+    )
+
+
+def scores_for(recipe_id):
+    # Строка произведения разреженных матриц V * V^T по спискам
+    scores = defaultdict(float)
+    postings = _state['postings']
+    for ingredient_id, weight in _state['vectors'].get(recipe_id, {}).items():
+        for other_id, other_weight in postings[ingredient_id]:
+            scores[other_id] += weight * other_weight
+    scores.pop(recipe_id, None)
+    return scores
+
+
+def neighbours_chunk(recipe_ids):
+    """Top-K соседей для рецептов порции.
+
+    Для инкрементального расчёта вместе с ними возвращаются рецепты,
+    в чей текущий top-K теперь входит рецепт порции: thresholds —
+    минимальное сходство в заполненных списках, незаполненные списки
+    принимают любого соседа.
+    """
+    thresholds = _state['thresholds']
+    results = []
+    for recipe_id in recipe_ids:
+        scores = scores_for(recipe_id)
+        top = heapq.nlargest(
+            _state['top_k'], scores.items(),
+            key=lambda item: (item[1], -item[0])
+        )
+        entering = []
+        if thresholds is not None:
+            entering = [
+                other_id for other_id, score in scores.items()
+                if score > thresholds.get(other_id, 0)
+            ]
+        results.append((recipe_id, top, entering))
+    return results
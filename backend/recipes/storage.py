@@ -0,0 +1,97 @@
+import hashlib
+import os
+import posixpath
+
+from django.apps import apps
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, default_storage
+
+RENDITIONS_DIR = 'renditions'
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    position = content.tell() if hasattr(content, 'tell') else None
+    if hasattr(content, 'seek'):
+        content.seek(0)
+    for chunk in content.chunks(HASH_CHUNK_SIZE):
+        digest.update(chunk)
+    if position is not None:
+        content.seek(position)
+    return digest.hexdigest()
+
+
+def hashed_name(name, content=None, digest=None):
+    # recipes/images/<uuid>.png -> recipes/images/ab/<sha256>.png
+    directory, filename = posixpath.split(name)
+    stem, extension = os.path.splitext(filename)
+    digest = digest or content_hash(content)
+    if stem == digest and posixpath.basename(directory) == digest[:2]:
+        return name
+    extension = extension.lower()
+    return posixpath.join(directory, digest[:2], f'{digest}{extension}')
+
+
+def rendition_path(name, width, extension):
+    stem, _ = posixpath.splitext(name)
+    return f'{RENDITIONS_DIR}/{stem}_{width}.{extension}'
+
+
+def rendition_source_stem(path):
+    # renditions/recipes/images/ab/<hash>_320.webp -> recipes/images/ab/<hash>
+    stem, _ = posixpath.splitext(path[len(RENDITIONS_DIR) + 1:])
+    return stem.rsplit('_', 1)[0]
+
+
+def walk(storage, directory):
+    try:
+        directories, files = storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in files:
+        yield posixpath.join(directory, name)
+    for subdirectory in directories:
+        yield from walk(storage, posixpath.join(directory, subdirectory))
+
+
+def delete_file(name, storage=default_storage):
+    """Удаляет файл вместе с его уменьшенными копиями."""
+    storage.delete(name)
+    stem = posixpath.splitext(name)[0]
+    directory = posixpath.dirname(f'{RENDITIONS_DIR}/{stem}')
+    try:
+        _, files = storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    prefix = f'{posixpath.basename(stem)}_'
+    for filename in files:
+        if filename.startswith(prefix):
+            storage.delete(posixpath.join(directory, filename))
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """Файловое хранилище, где имя файла — SHA-256 его содержимого.
+
+    Одинаковые загрузки ложатся в один файл: если файл с таким хэшем
+    уже есть, он не перезаписывается. Число ссылок на файл ведёт
+    StoredFile, а удаляются файлы только сборщиком мусора
+    (StoredFile.objects.collect), а не при замене поля. Сохранение
+    отмечает строку StoredFile (touch) до проверки файла, чтобы
+    сборщик не удалил найденный файл, пока модель не сослалась на него.
+    Уменьшенные копии (RENDITIONS_DIR) называются по исходному файлу
+    и сохраняются под своими именами.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        if name.startswith(f'{RENDITIONS_DIR}/'):
+            return super().save(name, content, max_length)
+        name = hashed_name(name, content)
+        apps.get_model('recipes', 'StoredFile').objects.touch(name)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
@@ -1,3 +1,2459 @@
-from django.test import TestCase
+import base64
+import io
+import json
+import random
+import re
+import shutil
+import tempfile
+import time
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.db.models import F
+from django.db.models.functions import Lower
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient, APIRequestFactory
+
+from api.notifications import user_group
+from api.profiling import RequestProfile, request_log
+from api.serializers import RecipeCreateSerializer
+from foodgram.asgi import application
+from recipes.ingredient_index import ingredient_index
+from recipes.models import (
+    Favorite, Ingredient, IngredientInRecipe, Recipe, ShoppingCart,
+    ShoppingListItem, SimilarRecipe, StoredFile, TimelineEntry
+)
+from recipes import short_links
+from recipes.management.commands import reclaim_media
+from recipes.recipe_matcher import RecipeMatcher, recipe_matcher
+from recipes.short_links import click_counter
+from users.models import Follow, User
+
+
+class RecipeListQueryCountTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Reader', last_name='Test', password='pass12345'
+        )
+        authors = [
+            User.objects.create_user(
+                email=f'author{i}@example.com', username=f'author{i}',
+                first_name='Author', last_name=str(i), password='pass12345'
+            )
+            for i in range(3)
+        ]
+        Follow.objects.create(user=cls.user, following=authors[0])
+        ingredients = Ingredient.objects.bulk_create([
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(4)
+        ])
+        for i in range(30):
+            recipe = Recipe.objects.create(
+                author=authors[i % len(authors)],
+                name=f'Рецепт {i}',
+                image='recipes/images/test.png',
+                text='Описание',
+                cooking_time=10,
+            )
+            IngredientInRecipe.objects.bulk_create([
+                IngredientInRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=i + 1
+                )
+                for ingredient in ingredients
+            ])
+            if i % 2:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+            if i % 3 == 0:
+                ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        cache.clear()
+
+    def count_queries(self, client, limit):
+        with CaptureQueriesContext(connection) as context:
+            response = client.get('/api/recipes/', {'limit': limit})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), limit)
+        return len(context.captured_queries)
+
+    def test_anonymous_query_count_does_not_depend_on_page_size(self):
+        client = APIClient()
+        self.assertEqual(
+            self.count_queries(client, 2), self.count_queries(client, 25)
+        )
+
+    def test_authenticated_query_count_does_not_depend_on_page_size(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(
+            self.count_queries(client, 2), self.count_queries(client, 25)
+        )
+
+    def test_user_flags_are_annotated(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get('/api/recipes/', {'limit': 30})
+        for item in response.data['results']:
+            recipe = Recipe.objects.get(id=item['id'])
+            self.assertEqual(
+                item['is_favorited'],
+                Favorite.objects.filter(
+                    user=self.user, recipe=recipe
+                ).exists()
+            )
+            self.assertEqual(
+                item['is_in_shopping_cart'],
+                ShoppingCart.objects.filter(
+                    user=self.user, recipe=recipe
+                ).exists()
+            )
+            self.assertEqual(
+                item['author']['is_subscribed'],
+                recipe.author.username == 'author0'
+            )
+            self.assertEqual(len(item['ingredients']), 4)
+
+
+class DownloadShoppingCartTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='buyer@example.com', username='buyer',
+            first_name='Buyer', last_name='Test', password='pass12345'
+        )
+        sugar = Ingredient.objects.create(name='сахар', measurement_unit='г')
+        milk = Ingredient.objects.create(name='молоко', measurement_unit='мл')
+        for amount in (100, 250):
+            recipe = Recipe.objects.create(
+                author=cls.user,
+                name=f'Рецепт {amount}',
+                image='recipes/images/test.png',
+                text='Описание',
+                cooking_time=10,
+            )
+            IngredientInRecipe.objects.create(
+                recipe=recipe, ingredient=sugar, amount=amount
+            )
+            IngredientInRecipe.objects.create(
+                recipe=recipe, ingredient=milk, amount=1
+            )
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        ShoppingListItem.objects.rebuild()
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def download(self, **params):
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/', params
+        )
+        self.assertEqual(response.status_code, 200)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_txt_is_default(self):
+        response, content = self.download()
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        self.assertIn('shopping_list.txt', response['Content-Disposition'])
+        self.assertEqual(content, 'молоко - 2 мл\nсахар - 350 г')
+
+    def test_csv(self):
+        response, content = self.download(format='csv')
+        self.assertTrue(response['Content-Type'].startswith('text/csv'))
+        self.assertEqual(content.splitlines(), [
+            'name,measurement_unit,amount',
+            'молоко,мл,2',
+            'сахар,г,350',
+        ])
+
+    def test_json(self):
+        response, content = self.download(format='json')
+        self.assertEqual(json.loads(content), [
+            {'name': 'молоко', 'measurement_unit': 'мл', 'amount': 2},
+            {'name': 'сахар', 'measurement_unit': 'г', 'amount': 350},
+        ])
+
+    def test_empty_cart(self):
+        for recipe in Recipe.objects.all():
+            self.client.delete(f'/api/recipes/{recipe.id}/shopping_cart/')
+        _, content = self.download(format='json')
+        self.assertEqual(json.loads(content), [])
+
+    def test_unknown_format(self):
+        response = self.client.get(
+            '/api/recipes/download_shopping_cart/', {'format': 'docx'}
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class ShoppingListConsistencyTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Test', password='pass12345'
+        )
+        cls.buyers = [
+            User.objects.create_user(
+                email=f'buyer{i}@example.com', username=f'buyer{i}',
+                first_name='Buyer', last_name=str(i), password='pass12345'
+            )
+            for i in range(2)
+        ]
+        cls.ingredients = Ingredient.objects.bulk_create([
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(4)
+        ])
+
+    def setUp(self):
+        self.recipes = []
+        for i in range(3):
+            recipe = Recipe.objects.create(
+                author=self.author,
+                name=f'Рецепт {i}',
+                image='recipes/images/test.png',
+                text='Описание',
+                cooking_time=10,
+            )
+            IngredientInRecipe.objects.bulk_create([
+                IngredientInRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=10 * (i + 1)
+                )
+                for ingredient in self.ingredients[i:i + 2]
+            ])
+            self.recipes.append(recipe)
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def assertConsistent(self):
+        expected = {
+            (row['user_id'], row['ingredient_id']): row['total_amount']
+            for row in ShoppingListItem.objects.calculate()
+        }
+        actual = {
+            (item.user_id, item.ingredient_id): item.total_amount
+            for item in ShoppingListItem.objects.all()
+        }
+        self.assertEqual(actual, expected)
+
+    def test_add_and_remove_recipes(self):
+        for buyer in self.buyers:
+            client = self.client_for(buyer)
+            for recipe in self.recipes:
+                response = client.post(
+                    f'/api/recipes/{recipe.id}/shopping_cart/'
+                )
+                self.assertEqual(response.status_code, 201)
+                self.assertConsistent()
+        client = self.client_for(self.buyers[0])
+        for recipe in self.recipes:
+            response = client.delete(
+                f'/api/recipes/{recipe.id}/shopping_cart/'
+            )
+            self.assertEqual(response.status_code, 204)
+            self.assertConsistent()
+        self.assertFalse(
+            ShoppingListItem.objects.filter(user=self.buyers[0]).exists()
+        )
+
+    def test_recipe_ingredients_update(self):
+        recipe = self.recipes[0]
+        for buyer in self.buyers:
+            self.client_for(buyer).post(
+                f'/api/recipes/{recipe.id}/shopping_cart/'
+            )
+        response = self.client_for(self.author).patch(
+            f'/api/recipes/{recipe.id}/',
+            {'ingredients': [
+                {'id': self.ingredients[1].id, 'amount': 5},
+                {'id': self.ingredients[3].id, 'amount': 7},
+            ]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertConsistent()
+
+    def test_recipe_delete(self):
+        recipe = self.recipes[1]
+        for buyer in self.buyers:
+            self.client_for(buyer).post(
+                f'/api/recipes/{recipe.id}/shopping_cart/'
+            )
+        response = self.client_for(self.author).delete(
+            f'/api/recipes/{recipe.id}/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertConsistent()
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+    def test_rebuild_command(self):
+        for recipe in self.recipes:
+            ShoppingCart.objects.create(user=self.buyers[0], recipe=recipe)
+        out = io.StringIO()
+        call_command('rebuild_shopping_lists', '--verify', stdout=out)
+        self.assertIn('mismatched', out.getvalue())
+        call_command('rebuild_shopping_lists', stdout=io.StringIO())
+        self.assertConsistent()
+        out = io.StringIO()
+        call_command('rebuild_shopping_lists', '--verify', stdout=out)
+        self.assertIn('consistent', out.getvalue())
+
+
+class RecipeIngredientsUpdateTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Test', password='pass12345'
+        )
+        cls.ingredients = Ingredient.objects.bulk_create([
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(5)
+        ])
+
+    def setUp(self):
+        cache.clear()
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Текст',
+            image='recipes/images/test.png', cooking_time=10
+        )
+        IngredientInRecipe.objects.bulk_create([
+            IngredientInRecipe(
+                recipe=self.recipe, ingredient=ingredient, amount=10
+            )
+            for ingredient in self.ingredients[:3]
+        ])
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def rows(self):
+        return {
+            item.ingredient_id: (item.pk, item.amount)
+            for item in IngredientInRecipe.objects.filter(recipe=self.recipe)
+        }
+
+    def patch(self, amounts):
+        return self.client.patch(
+            f'/api/recipes/{self.recipe.id}/',
+            {'ingredients': [
+                {'id': ingredient.id, 'amount': amount}
+                for ingredient, amount in amounts
+            ]},
+            format='json'
+        )
+
+    def test_only_differences_are_written(self):
+        first, second, third, fourth, _ = self.ingredients
+        before = self.rows()
+        ShoppingCart.objects.create(user=self.author, recipe=self.recipe)
+        ShoppingListItem.objects.rebuild()
+        response = self.patch([(first, 10), (second, 25), (fourth, 5)])
+        self.assertEqual(response.status_code, 200)
+        after = self.rows()
+        # Строки сохраняют id: неизменённая и обновлённая
+        self.assertEqual(after[first.id], before[first.id])
+        self.assertEqual(after[second.id], (before[second.id][0], 25))
+        self.assertNotIn(third.id, after)
+        self.assertEqual(after[fourth.id][1], 5)
+        self.assertEqual(
+            dict(ShoppingListItem.objects.values_list(
+                'ingredient_id', 'total_amount'
+            )),
+            {first.id: 10, second.id: 25, fourth.id: 5}
+        )
+
+    def test_unchanged_ingredients_are_not_rewritten(self):
+        table = IngredientInRecipe._meta.db_table
+        with CaptureQueriesContext(connection) as context:
+            response = self.patch([
+                (ingredient, 10) for ingredient in self.ingredients[:3]
+            ])
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse([
+            query for query in context.captured_queries
+            if table in query['sql'] and not (
+                query['sql'].startswith('SELECT')
+            )
+        ])
+
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class CountersTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Test', password='pass12345'
+        )
+        cls.reader = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Reader', last_name='Test', password='pass12345'
+        )
+        cls.ingredient = Ingredient.objects.create(
+            name='соль', measurement_unit='г'
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def client_for(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def test_counters_follow_write_paths(self):
+        author_client = self.client_for(self.author)
+        response = author_client.post('/api/recipes/', {
+            'ingredients': [{'id': self.ingredient.id, 'amount': 1}],
+            'image': (
+                'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAA'
+                'fFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+            ),
+            'name': 'Рецепт',
+            'text': 'Описание',
+            'cooking_time': 5,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        recipe_id = response.data['id']
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 1)
+
+        reader_client = self.client_for(self.reader)
+        reader_client.post(f'/api/recipes/{recipe_id}/favorite/')
+        reader_client.post(f'/api/recipes/{recipe_id}/shopping_cart/')
+        reader_client.post(f'/api/users/{self.author.id}/subscribe/')
+        recipe = Recipe.objects.get(id=recipe_id)
+        self.author.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(recipe.in_carts_count, 1)
+        self.assertEqual(self.author.followers_count, 1)
+
+        reader_client.delete(f'/api/recipes/{recipe_id}/favorite/')
+        reader_client.delete(f'/api/recipes/{recipe_id}/shopping_cart/')
+        reader_client.delete(f'/api/users/{self.author.id}/subscribe/')
+        recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+        self.assertEqual(recipe.in_carts_count, 0)
+        self.assertEqual(self.author.followers_count, 0)
+
+        author_client.delete(f'/api/recipes/{recipe_id}/')
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 0)
+
+    def test_recipe_edit_keeps_concurrent_counters(self):
+        recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт',
+            image='recipes/images/test.png', text='Описание', cooking_time=10
+        )
+        IngredientInRecipe.objects.create(
+            recipe=recipe, ingredient=self.ingredient, amount=1
+        )
+        serializer = RecipeCreateSerializer(
+            recipe, data={'name': 'Щи'}, partial=True,
+            context={'request': APIRequestFactory().patch('/')}
+        )
+        serializer.is_valid(raise_exception=True)
+        # Счётчики выросли после чтения рецепта, но до сохранения
+        Recipe.objects.filter(pk=recipe.pk).update(
+            favorites_count=F('favorites_count') + 1,
+            in_carts_count=F('in_carts_count') + 1,
+            short_link_clicks=F('short_link_clicks') + 3
+        )
+        serializer.save()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.name, 'Щи')
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(recipe.in_carts_count, 1)
+        self.assertEqual(recipe.short_link_clicks, 3)
+
+    def test_recount_command(self):
+        recipe = Recipe.objects.create(
+            author=self.author,
+            name='Рецепт',
+            image='recipes/images/test.png',
+            text='Описание',
+            cooking_time=10,
+        )
+        Favorite.objects.create(user=self.reader, recipe=recipe)
+        ShoppingCart.objects.create(user=self.reader, recipe=recipe)
+        Follow.objects.create(user=self.reader, following=self.author)
+        call_command('recount', stdout=io.StringIO())
+        recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 1)
+        self.assertEqual(recipe.in_carts_count, 1)
+        self.assertEqual(self.author.recipes_count, 1)
+        self.assertEqual(self.author.followers_count, 1)
+
+
+class IngredientIndexTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create([
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('Сахар', 'сахарная пудра', 'соль', 'сыр', 'мука')
+        ])
+
+    def setUp(self):
+        ingredient_index.invalidate()
+        self.client = APIClient()
+
+    def search(self, **params):
+        response = self.client.get('/api/ingredients/', params)
+        self.assertEqual(response.status_code, 200)
+        return [item['name'] for item in response.data]
+
+    def test_prefix_search_is_case_insensitive(self):
+        self.assertEqual(self.search(name='сах'), ['Сахар', 'сахарная пудра'])
+        self.assertEqual(self.search(name='С'), [
+            'Сахар', 'сахарная пудра', 'соль', 'сыр'
+        ])
+        self.assertEqual(self.search(name='хлеб'), [])
+
+    def test_empty_name_returns_catalogue(self):
+        self.assertEqual(len(self.search()), 5)
+
+    def test_limit(self):
+        self.assertEqual(self.search(name='с', limit=2), [
+            'Сахар', 'сахарная пудра'
+        ])
+        response = self.client.get('/api/ingredients/', {'limit': 0})
+        self.assertEqual(response.status_code, 400)
+
+    def test_search_does_not_query_database(self):
+        self.search(name='с')
+        with self.assertNumQueries(0):
+            self.search(name='со')
+
+    def test_index_is_invalidated_on_change(self):
+        self.search(name='с')
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='сливки', measurement_unit='мл')
+        self.assertIn('сливки', self.search(name='сл'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.filter(name='соль').get().delete()
+        self.assertEqual(self.search(name='со'), [])
+
+    def test_index_is_invalidated_after_commit(self):
+        self.search(name='с')
+        with self.captureOnCommitCallbacks() as callbacks:
+            Ingredient.objects.create(name='сливки', measurement_unit='мл')
+            # До коммита индекс не сбрасывается и не перечитывается
+            self.assertEqual(self.search(name='сл'), [])
+        for callback in callbacks:
+            callback()
+        self.assertEqual(self.search(name='сл'), ['сливки'])
+
+
+class RecipeMatcherTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Test', password='pass12345'
+        )
+        cls.ingredients = Ingredient.objects.bulk_create([
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(5)
+        ])
+        cls.recipes = []
+        for i, indexes in enumerate(((0, 1), (0, 1, 2), (2, 3, 4), (4,))):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {i}', text='Текст',
+                image='recipes/images/test.png', cooking_time=10,
+            )
+            IngredientInRecipe.objects.bulk_create([
+                IngredientInRecipe(
+                    recipe=recipe, ingredient=cls.ingredients[index],
+                    amount=1
+                )
+                for index in indexes
+            ])
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        recipe_matcher.invalidate()
+        self.client = APIClient()
+
+    def scan(self, recipes, pantry, max_missing=None, ranking='coverage'):
+        matches = []
+        for recipe_id, ingredients in recipes.items():
+            matched = len(ingredients & pantry)
+            missing = len(ingredients) - matched
+            if not matched or (
+                max_missing is not None and missing > max_missing
+            ):
+                continue
+            jaccard = matched / (missing + len(pantry))
+            key = (
+                (-jaccard, missing) if ranking == 'jaccard'
+                else (missing, -matched)
+            )
+            matches.append((key, -recipe_id, recipe_id))
+        return [recipe_id for *_, recipe_id in sorted(matches)]
+
+    def match_ids(self, matcher, *args, **kwargs):
+        return [match['id'] for match in matcher.match(*args, **kwargs)[:]]
+
+    def test_ranking_matches_full_scan(self):
+        generator = random.Random(1)
+        recipes = {
+            recipe_id: set(generator.sample(range(1, 40), generator.randint(
+                1, 12
+            )))
+            for recipe_id in range(1, 300)
+        }
+        matcher = RecipeMatcher()
+        matcher.build(
+            (recipe_id, ingredient_id)
+            for recipe_id, ingredients in sorted(recipes.items())
+            for ingredient_id in ingredients
+        )
+        # Изменения применяются к индексу без перестроения
+        for recipe_id in range(1, 300, 7):
+            recipes[recipe_id] = set(generator.sample(range(1, 60), 5))
+            matcher._set_recipe(recipe_id, recipes[recipe_id])
+        for recipe_id in range(2, 300, 11):
+            recipes.pop(recipe_id)
+            matcher._set_recipe(recipe_id, set())
+        for _ in range(20):
+            pantry = set(generator.sample(range(1, 60), 10))
+            for kwargs in (
+                {}, {'max_missing': 0}, {'max_missing': 3},
+                {'ranking': 'jaccard'},
+            ):
+                with self.subTest(pantry=pantry, **kwargs):
+                    self.assertEqual(
+                        self.match_ids(matcher, pantry, **kwargs),
+                        self.scan(recipes, pantry, **kwargs)
+                    )
+
+    def test_pages_are_sliced_lazily(self):
+        matches = recipe_matcher.match([self.ingredients[0].id, 99])
+        self.assertEqual(len(matches), 2)
+        self.assertEqual(matches[1:2], [{
+            'id': self.recipes[1].id, 'matched': 1, 'missing': 2,
+            'jaccard': 0.25,
+        }])
+
+    def get(self, **params):
+        response = self.client.get(
+            '/api/recipes/filter_by_ingredients/', params
+        )
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_endpoint_ranks_by_coverage(self):
+        ids = ','.join(str(self.ingredients[i].id) for i in (0, 1, 4))
+        response = self.get(ingredients=ids)
+        self.assertEqual(response.data['count'], 4)
+        self.assertEqual(
+            [
+                (item['id'], item['matched_count'], item['missing_count'])
+                for item in response.data['results']
+            ],
+            [
+                (self.recipes[0].id, 2, 0),
+                (self.recipes[3].id, 1, 0),
+                (self.recipes[1].id, 2, 1),
+                (self.recipes[2].id, 1, 2),
+            ]
+        )
+        response = self.get(ingredients=ids, max_missing=0, limit=1)
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual(
+            response.data['results'][0]['id'], self.recipes[0].id
+        )
+        self.assertIsNotNone(response.data['next'])
+
+    def test_invalid_params(self):
+        for params in (
+            {}, {'ingredients': 'abc'},
+            {'ingredients': '1', 'max_missing': -1},
+            {'ingredients': '1', 'ranking': 'random'},
+        ):
+            with self.subTest(params=params):
+                response = self.client.get(
+                    '/api/recipes/filter_by_ingredients/', params
+                )
+                self.assertEqual(response.status_code, 400)
+
+    def test_index_follows_recipe_changes(self):
+        self.client.force_authenticate(self.author)
+        ids = f'{self.ingredients[3].id}'
+        self.assertEqual(self.get(ingredients=ids).data['count'], 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'/api/recipes/{self.recipes[0].id}/',
+                {'ingredients': [
+                    {'id': self.ingredients[3].id, 'amount': 2},
+                ]},
+                format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        results = self.get(ingredients=ids, max_missing=0).data['results']
+        self.assertEqual([item['id'] for item in results], [
+            self.recipes[0].id
+        ])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/recipes/{self.recipes[2].id}/')
+        self.assertEqual(self.get(ingredients=ids).data['count'], 1)
+
+
+class SimilarRecipesTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Test', password='pass12345'
+        )
+        cls.ingredients = Ingredient.objects.bulk_create([
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(6)
+        ])
+        cls.recipes = []
+        for i, indexes in enumerate(
+            ((0, 1, 2), (0, 1, 3), (4, 5), (0, 1, 2, 4))
+        ):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {i}', text='Текст',
+                image='recipes/images/test.png', cooking_time=10,
+            )
+            IngredientInRecipe.objects.bulk_create([
+                IngredientInRecipe(
+                    recipe=recipe, ingredient=cls.ingredients[index],
+                    amount=10
+                )
+                for index in indexes
+            ])
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def build(self, *args):
+        out = io.StringIO()
+        call_command(
+            'build_similar_recipes', '--max-df', '1', *args, stdout=out
+        )
+        return out.getvalue()
+
+    def similar(self, recipe):
+        response = self.client.get(f'/api/recipes/{recipe.id}/similar/')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_neighbours_are_ranked_by_similarity(self):
+        self.assertIn('Full run', self.build('--workers', '0'))
+        data = self.similar(self.recipes[0])
+        self.assertEqual([item['id'] for item in data], [
+            self.recipes[3].id, self.recipes[1].id
+        ])
+        self.assertGreater(data[0]['score'], data[1]['score'])
+        self.assertEqual(
+            set(data[0]), {
+                'id', 'name', 'image', 'image_renditions', 'cooking_time',
+                'score'
+            }
+        )
+        with self.assertNumQueries(2):
+            self.similar(self.recipes[2])
+
+    def test_process_pool_matches_inline(self):
+        self.build('--workers', '0', '--top-k', '2')
+        inline = list(SimilarRecipe.objects.values_list(
+            'recipe_id', 'similar_id', 'score'
+        ))
+        self.build('--workers', '2', '--top-k', '2', '--full')
+        self.assertEqual(list(SimilarRecipe.objects.values_list(
+            'recipe_id', 'similar_id', 'score'
+        )), inline)
+
+    def test_incremental_run_recomputes_affected_recipes(self):
+        self.build('--workers', '0')
+        self.assertIn('neighbours of 0 recipes', self.build('--workers', '0'))
+        recipe = self.recipes[2]
+        recipe.ingredient_in_recipe.all().delete()
+        IngredientInRecipe.objects.bulk_create([
+            IngredientInRecipe(
+                recipe=recipe, ingredient=self.ingredients[index], amount=10
+            )
+            for index in (0, 1, 2)
+        ])
+        recipe.save()
+        output = self.build('--workers', '0')
+        self.assertIn('Incremental run', output)
+        # Изменённый рецепт и три рецепта, в чьи списки он вошёл
+        self.assertIn('neighbours of 4 recipes', output)
+        self.assertEqual(
+            self.similar(self.recipes[0])[0]['id'], recipe.id
+        )
+
+    def test_unknown_recipe(self):
+        response = self.client.get('/api/recipes/0/similar/')
+        self.assertEqual(response.status_code, 404)
+
+
+class FeedTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader, cls.author, cls.star = [
+            User.objects.create_user(
+                email=f'{name}@example.com', username=name,
+                first_name=name, last_name='Test', password='pass12345'
+            )
+            for name in ('reader', 'author', 'star')
+        ]
+        User.objects.filter(pk=cls.star.pk).update(followers_count=100)
+        cls.old_recipe = cls.create_recipe(cls.author)
+
+    @classmethod
+    def create_recipe(cls, author):
+        return Recipe.objects.create(
+            author=User.objects.get(pk=author.pk), name='Рецепт',
+            text='Текст', image='recipes/images/test.png', cooking_time=10
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def follow(self, author):
+        response = self.client.post(f'/api/users/{author.id}/subscribe/')
+        self.assertEqual(response.status_code, 201)
+
+    def feed(self, **params):
+        response = self.client.get('/api/recipes/feed/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def feed_ids(self, **params):
+        return [item['id'] for item in self.feed(**params)['results']]
+
+    def test_recipes_are_fanned_out_on_write(self):
+        self.follow(self.author)
+        self.assertEqual(self.feed_ids(), [self.old_recipe.id])
+        recipe = self.create_recipe(self.author)
+        self.assertTrue(
+            TimelineEntry.objects.filter(
+                user=self.reader, recipe=recipe
+            ).exists()
+        )
+        self.assertEqual(self.feed_ids(), [recipe.id, self.old_recipe.id])
+
+    @override_settings(FEED_FANOUT_MAX_FOLLOWERS=50)
+    def test_popular_authors_are_pulled_on_read(self):
+        self.follow(self.star)
+        recipe = self.create_recipe(self.star)
+        self.assertFalse(TimelineEntry.objects.filter(recipe=recipe).exists())
+        self.assertEqual(self.feed_ids(), [recipe.id])
+        follow = Follow.objects.get(user=self.reader, following=self.star)
+        self.assertIsNotNone(follow.feed_synced_at)
+        newer = self.create_recipe(self.star)
+        self.assertEqual(self.feed_ids(), [newer.id, recipe.id])
+
+    @override_settings(FEED_FANOUT_MAX_FOLLOWERS=50)
+    def test_fan_out_reads_current_followers_count(self):
+        self.follow(self.star)
+        # У автора из кэша токенов счётчик подписчиков мог устареть
+        stale_star = User.objects.get(pk=self.star.pk)
+        stale_star.followers_count = 0
+        recipe = Recipe.objects.create(
+            author=stale_star, name='Рецепт', text='Текст',
+            image='recipes/images/test.png', cooking_time=10
+        )
+        self.assertFalse(TimelineEntry.objects.filter(recipe=recipe).exists())
+
+    def test_unfollow_clears_timeline(self):
+        self.follow(self.author)
+        response = self.client.delete(
+            f'/api/users/{self.author.id}/subscribe/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.feed_ids(), [])
+
+    @override_settings(FEED_MAX_ENTRIES=3)
+    def test_timeline_is_trimmed_and_paginated_by_key(self):
+        self.follow(self.author)
+        recipes = [self.create_recipe(self.author) for _ in range(4)]
+        data = self.feed(limit=2)
+        self.assertEqual(
+            [item['id'] for item in data['results']],
+            [recipes[3].id, recipes[2].id]
+        )
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.reader).count(), 3
+        )
+        response = self.client.get(data['next'])
+        self.assertEqual(
+            [item['id'] for item in response.data['results']],
+            [recipes[1].id]
+        )
+        self.assertIsNone(response.data['next'])
+
+    def test_feed_requires_authentication(self):
+        response = APIClient().get('/api/recipes/feed/')
+        self.assertEqual(response.status_code, 401)
+
+
+@override_settings(ROOT_URLCONF='foodgram.async_urls')
+class AsyncReadViewsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader, cls.author = [
+            User.objects.create_user(
+                email=f'{name}@example.com', username=name,
+                first_name=name, last_name='Test', password='pass12345'
+            )
+            for name in ('reader', 'author')
+        ]
+        cls.token = Token.objects.create(user=cls.reader)
+        Follow.objects.create(user=cls.reader, following=cls.author)
+        cls.ingredient = Ingredient.objects.create(
+            name='соль', measurement_unit='г'
+        )
+        cls.recipes = []
+        for i in range(3):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {i}', text='Текст',
+                image='recipes/images/test.png', cooking_time=10
+            )
+            IngredientInRecipe.objects.create(
+                recipe=recipe, ingredient=cls.ingredient, amount=i + 1
+            )
+            cls.recipes.append(recipe)
+        Favorite.objects.create(user=cls.reader, recipe=cls.recipes[0])
+
+    def setUp(self):
+        cache.clear()
+        ingredient_index.invalidate()
+        self.client = APIClient()
+
+    def get(self, url, authorized=False):
+        client = APIClient()
+        if authorized:
+            client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        return client.get(url)
+
+    def assert_same_as_sync(self, url, authorized=False):
+        response = self.get(url, authorized)
+        self.assertEqual(response.status_code, 200)
+        # Ответ асинхронного обработчика без заголовка Allow от DRF
+        self.assertNotIn('Allow', response)
+        with override_settings(ROOT_URLCONF='foodgram.urls'):
+            expected = self.get(url, authorized)
+        self.assertEqual(json.loads(response.content), expected.json())
+
+    def test_responses_match_sync_views(self):
+        recipe = self.recipes[0]
+        for url in (
+            '/api/recipes/',
+            '/api/recipes/?limit=1&page=2',
+            f'/api/recipes/?author={self.author.id}',
+            f'/api/recipes/{recipe.id}/',
+            '/api/ingredients/?name=со',
+            f'/api/users/{self.author.id}/',
+        ):
+            for authorized in (False, True):
+                with self.subTest(url=url, authorized=authorized):
+                    self.assert_same_as_sync(url, authorized)
+
+    def test_user_flags(self):
+        data = self.get(f'/api/recipes/{self.recipes[0].id}/', True).json()
+        self.assertTrue(data['is_favorited'])
+        self.assertTrue(data['author']['is_subscribed'])
+
+    def add_favorite(self, recipe):
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.reader, recipe=recipe)
+
+    async def test_conditional_get_matches_sync_views(self):
+        url = f'/api/recipes/{self.recipes[0].id}/'
+        with override_settings(ROOT_URLCONF='foodgram.urls'):
+            expected = await sync_to_async(self.get)(url)
+        response = await self.async_client.get(url)
+        self.assertNotIn('Allow', response)
+        self.assertEqual(response['ETag'], expected['ETag'])
+        self.assertEqual(response['Last-Modified'], expected['Last-Modified'])
+        # Ответ синхронного представления уже лежит в общем кэше
+        self.assertEqual(response['X-Cache'], 'HIT')
+        response = await self.async_client.get(
+            url, headers={'If-None-Match': expected['ETag']}
+        )
+        self.assertEqual(response.status_code, 304)
+        self.assertNotIn('Allow', response)
+
+        authorization = {'Authorization': f'Token {self.token.key}'}
+        response = await self.async_client.get(
+            '/api/recipes/', headers=authorization
+        )
+        self.assertIn('Authorization', response['Vary'])
+        response = await self.async_client.get(
+            '/api/recipes/',
+            headers={**authorization, 'If-None-Match': response['ETag']}
+        )
+        self.assertEqual(response.status_code, 304)
+        await sync_to_async(self.add_favorite)(self.recipes[1])
+        response = await self.async_client.get(
+            '/api/recipes/',
+            headers={**authorization, 'If-None-Match': response['ETag']}
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_other_requests_fall_back_to_drf(self):
+        for url, status in (
+            ('/api/recipes/?is_favorited=1', 200),
+            ('/api/recipes/?page=9', 404),
+            ('/api/recipes/0/', 404),
+            ('/api/users/0/', 404),
+            ('/api/ingredients/?limit=0', 400),
+        ):
+            with self.subTest(url=url):
+                response = self.get(url, True)
+                self.assertEqual(response.status_code, status)
+                self.assertIn('Allow', response)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Token invalid')
+        self.assertEqual(client.get('/api/recipes/').status_code, 401)
+        response = self.client.post('/api/recipes/', {}, format='json')
+        with override_settings(ROOT_URLCONF='foodgram.urls'):
+            expected = self.client.post('/api/recipes/', {}, format='json')
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.json(), expected.json())
+
+
+@override_settings(NOTIFY_BATCH_DELAY=0.05)
+class NotificationsTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader, self.author, self.star, *self.fans = [
+            User.objects.create_user(
+                email=f'{name}@example.com', username=name,
+                first_name=name, last_name='Test', password='pass12345'
+            )
+            for name in ('reader', 'author', 'star', 'fan1', 'fan2', 'fan3')
+        ]
+        self.tokens = {
+            user.pk: Token.objects.create(user=user).key
+            for user in (self.reader, self.author, self.star)
+        }
+        Follow.objects.create(user=self.reader, following=self.author)
+
+    async def connect(self, user):
+        communicator = WebsocketCommunicator(
+            application, f'/ws/notify/?token={self.tokens[user.pk]}'
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def receive(self, communicator):
+        message = await communicator.receive_json_from(timeout=1)
+        return message['notifications']
+
+    @staticmethod
+    @sync_to_async
+    def create_recipe(author):
+        return Recipe.objects.create(
+            author=author, name='Рецепт', text='Текст',
+            image='recipes/images/test.png', cooking_time=10
+        )
+
+    async def test_rejects_socket_without_valid_token(self):
+        for url in ('/ws/notify/', '/ws/notify/?token=wrong'):
+            communicator = WebsocketCommunicator(application, url)
+            connected, _ = await communicator.connect()
+            self.assertFalse(connected)
+
+    async def test_token_in_authorization_header(self):
+        communicator = WebsocketCommunicator(
+            application, '/ws/notify/', headers=[(
+                b'authorization',
+                f'Token {self.tokens[self.reader.pk]}'.encode()
+            )]
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.disconnect()
+
+    async def test_new_recipe_of_followed_author(self):
+        reader = await self.connect(self.reader)
+        recipe = await self.create_recipe(self.author)
+        self.assertEqual(await self.receive(reader), [{
+            'type': 'recipe',
+            'recipe': {'id': recipe.pk, 'name': 'Рецепт'},
+            'author': {'id': self.author.pk, 'username': 'author'},
+        }])
+        await self.create_recipe(self.star)
+        self.assertTrue(await reader.receive_nothing(timeout=0.2))
+        await reader.disconnect()
+
+    async def test_favorite_burst_is_coalesced(self):
+        recipe = await self.create_recipe(self.author)
+        author = await self.connect(self.author)
+        for user in [*self.fans, self.author]:
+            await sync_to_async(Favorite.objects.create)(
+                user=user, recipe=recipe
+            )
+        self.assertEqual(await self.receive(author), [{
+            'type': 'favorite',
+            'recipe': {'id': recipe.pk, 'name': 'Рецепт'},
+            'user': {'id': self.fans[-1].pk, 'username': 'fan3'},
+            'count': 3,
+        }])
+        self.assertTrue(await author.receive_nothing(timeout=0.2))
+        await author.disconnect()
+
+    async def test_follow_and_unfollow_update_open_sockets(self):
+        reader = await self.connect(self.reader)
+        star = await self.connect(self.star)
+        follow = await sync_to_async(Follow.objects.create)(
+            user=self.reader, following=self.star
+        )
+        self.assertEqual(await self.receive(star), [{
+            'type': 'follower',
+            'user': {'id': self.reader.pk, 'username': 'reader'},
+        }])
+        recipe = await self.create_recipe(self.star)
+        notifications = await self.receive(reader)
+        self.assertEqual(notifications[0]['recipe']['id'], recipe.pk)
+
+        await sync_to_async(follow.delete)()
+        await self.create_recipe(self.star)
+        self.assertTrue(await reader.receive_nothing(timeout=0.2))
+        await reader.disconnect()
+        await star.disconnect()
+
+    @override_settings(NOTIFY_MAX_PENDING=2)
+    async def test_slow_socket_keeps_only_latest_events(self):
+        reader = await self.connect(self.reader)
+        for number in range(5):
+            await get_channel_layer().group_send(
+                user_group(self.reader.pk), {
+                    'type': 'notify.event', 'key': f'event.{number}',
+                    'event': {'type': 'test', 'number': number},
+                }
+            )
+        message = await reader.receive_json_from(timeout=1)
+        self.assertEqual(message, {
+            'notifications': [
+                {'type': 'test', 'number': 3},
+                {'type': 'test', 'number': 4},
+            ],
+            'dropped': 3,
+        })
+        await reader.disconnect()
+
+
+@override_settings(SHORT_LINK_FLUSH_SIZE=3, SHORT_LINK_FLUSH_INTERVAL=3600)
+class ShortLinksTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Test', password='pass12345'
+        )
+        cls.recipes = [
+            Recipe.objects.create(
+                author=author, name=f'Рецепт {i}', text='Текст',
+                image='recipes/images/test.png', cooking_time=10
+            )
+            for i in range(2)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        click_counter.flush()
+        self.client = APIClient()
+
+    def get_code(self, recipe):
+        response = self.client.get(f'/api/recipes/{recipe.id}/get-link/')
+        self.assertEqual(response.status_code, 200)
+        prefix = 'https://foodgram.example.org/s/'
+        link = response.json()['short-link']
+        self.assertTrue(link.startswith(prefix))
+        return link[len(prefix):]
+
+    def test_codes_round_trip(self):
+        for recipe_id in (1, 61, 62, 3843, 10 ** 9):
+            with self.subTest(recipe_id=recipe_id):
+                self.assertEqual(
+                    short_links.parse_code(short_links.make_code(recipe_id)),
+                    recipe_id
+                )
+
+    def test_redirect_without_queries(self):
+        code = self.get_code(self.recipes[0])
+        with self.assertNumQueries(0):
+            response = self.client.get(f'/s/{code}')
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(
+            response['Location'], f'/recipes/{self.recipes[0].id}'
+        )
+        self.assertEqual(self.client.get(f'/s/{code}/').status_code, 302)
+
+    def test_unsigned_and_tampered_codes_are_rejected(self):
+        code = self.get_code(self.recipes[0])
+        other = short_links.to_base62(self.recipes[1].id)
+        for bad in (
+            str(self.recipes[0].id), other + code[-4:], code[:-1] + (
+                'a' if code[-1] != 'a' else 'b'
+            ),
+            '0' + code,
+        ):
+            with self.subTest(code=bad):
+                self.assertEqual(self.client.get(f'/s/{bad}').status_code, 404)
+
+    def test_clicks_are_written_in_batches(self):
+        first, second = [self.get_code(recipe) for recipe in self.recipes]
+        with self.assertNumQueries(0):
+            self.client.get(f'/s/{first}')
+            self.client.get(f'/s/{first}')
+        # Третий переход: одно UPDATE на каждое встретившееся число
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(f'/s/{second}')
+        updates = [
+            query for query in context.captured_queries
+            if query['sql'].startswith('UPDATE')
+        ]
+        self.assertEqual(len(updates), 2)
+        clicks = dict(Recipe.objects.values_list('id', 'short_link_clicks'))
+        self.assertEqual(clicks, {
+            self.recipes[0].id: 2, self.recipes[1].id: 1
+        })
+
+
+    def test_failed_flush_keeps_clicks_and_redirects(self):
+        code = self.get_code(self.recipes[0])
+        with mock.patch.object(
+            Recipe.objects, 'filter', side_effect=OperationalError
+        ), self.assertLogs('recipes.short_links', 'ERROR'):
+            # Третий переход сбрасывает счётчик в БД, и запись падает
+            for _ in range(3):
+                response = self.client.get(f'/s/{code}')
+                self.assertEqual(response.status_code, 302)
+        click_counter.flush()
+        self.assertEqual(
+            Recipe.objects.get(pk=self.recipes[0].pk).short_link_clicks, 3
+        )
+
+
+class BatchWriteTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Test', password='pass12345'
+        )
+        cls.reader = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Reader', last_name='Test', password='pass12345'
+        )
+        cls.ingredients = Ingredient.objects.bulk_create([
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(3)
+        ])
+        cls.recipes = []
+        for i in range(3):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {i}', text='Текст',
+                image='recipes/images/test.png', cooking_time=10
+            )
+            IngredientInRecipe.objects.bulk_create([
+                IngredientInRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=i + 1
+                )
+                for ingredient in cls.ingredients[i:i + 2]
+            ])
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+
+    def counters(self, field):
+        return dict(Recipe.objects.values_list('id', field))
+
+    def test_favorite_batch(self):
+        first, second, third = [recipe.id for recipe in self.recipes]
+        self.client.post(f'/api/recipes/{first}/favorite/')
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(
+                '/api/recipes/favorite/',
+                {'ids': [first, second, third, second, 999]},
+                format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], [
+            {'id': first, 'status': 'exists'},
+            {'id': second, 'status': 'created'},
+            {'id': third, 'status': 'created'},
+            {'id': 999, 'status': 'not_found'},
+        ])
+        inserts = [
+            query for query in context.captured_queries
+            if query['sql'].startswith('INSERT')
+        ]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(
+            self.counters('favorites_count'),
+            {first: 1, second: 1, third: 1}
+        )
+        # Сигналы отправлены: флаги пользователя в ответах обновились
+        response = self.client.get(f'/api/recipes/{second}/')
+        self.assertTrue(response.data['is_favorited'])
+
+        response = self.client.delete(
+            '/api/recipes/favorite/', {'ids': [second, 999]}, format='json'
+        )
+        self.assertEqual(response.json()['results'], [
+            {'id': second, 'status': 'deleted'},
+            {'id': 999, 'status': 'missing'},
+        ])
+        self.assertEqual(
+            self.counters('favorites_count'),
+            {first: 1, second: 0, third: 1}
+        )
+        self.assertFalse(
+            Favorite.objects.filter(user=self.reader, recipe_id=second)
+            .exists()
+        )
+
+    def test_shopping_cart_batch_keeps_shopping_list(self):
+        ids = [recipe.id for recipe in self.recipes]
+        response = self.client.post(
+            '/api/recipes/shopping_cart/', {'ids': ids}, format='json'
+        )
+        self.assertEqual(
+            [item['status'] for item in response.json()['results']],
+            ['created'] * 3
+        )
+        response = self.client.delete(
+            '/api/recipes/shopping_cart/', {'ids': ids[:2]}, format='json'
+        )
+        self.assertEqual(
+            [item['status'] for item in response.json()['results']],
+            ['deleted'] * 2
+        )
+        self.assertEqual(
+            self.counters('in_carts_count'),
+            {ids[0]: 0, ids[1]: 0, ids[2]: 1}
+        )
+        expected = {
+            (row['user_id'], row['ingredient_id']): row['total_amount']
+            for row in ShoppingListItem.objects.calculate()
+        }
+        actual = {
+            (item.user_id, item.ingredient_id): item.total_amount
+            for item in ShoppingListItem.objects.all()
+        }
+        self.assertEqual(actual, expected)
+
+    def test_recipe_deleted_before_insert_is_not_found(self):
+        first = self.recipes[0]
+        # Рецепт 998 удалили между выборкой и вставкой
+        deleted = Recipe(pk=998, author=self.author)
+        with mock.patch.object(
+            Recipe.objects, 'in_bulk',
+            return_value={first.id: first, deleted.pk: deleted}
+        ):
+            response = self.client.post(
+                '/api/recipes/favorite/', {'ids': [first.id, deleted.pk]},
+                format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], [
+            {'id': first.id, 'status': 'created'},
+            {'id': deleted.pk, 'status': 'not_found'},
+        ])
+        self.assertEqual(self.counters('favorites_count')[first.id], 1)
+
+    def test_batch_validation(self):
+        for data in ({}, {'ids': []}, {'ids': ['x']}, {'ids': [0]}):
+            with self.subTest(data=data):
+                response = self.client.post(
+                    '/api/recipes/favorite/', data, format='json'
+                )
+                self.assertEqual(response.status_code, 400)
+        with override_settings(BATCH_MAX_ITEMS=2):
+            response = self.client.post(
+                '/api/recipes/favorite/', {'ids': [1, 2, 3]}, format='json'
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            APIClient().post(
+                '/api/recipes/favorite/', {'ids': [1]}, format='json'
+            ).status_code,
+            401
+        )
+
+    def test_single_item_relies_on_constraint(self):
+        url = f'/api/recipes/{self.recipes[0].id}/favorite/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(any(
+            'EXISTS' in query['sql'] or query['sql'].startswith('UPDATE')
+            for query in context.captured_queries
+        ))
+        self.assertEqual(self.counters('favorites_count')[
+            self.recipes[0].id
+        ], 1)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 400)
+        self.assertEqual(APIClient().post(url).status_code, 401)
+
+
+class RequestProfilingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='user@example.com', username='user',
+            first_name='User', last_name='Test', password='pass12345'
+        )
+        cls.staff = User.objects.create_user(
+            email='staff@example.com', username='staff',
+            first_name='Staff', last_name='Test', password='pass12345',
+            is_staff=True
+        )
+        Recipe.objects.create(
+            author=cls.user, name='Рецепт', text='Текст',
+            image='recipes/images/test.png', cooking_time=10
+        )
+
+    def setUp(self):
+        cache.clear()
+        request_log.clear()
+        self.client = APIClient()
+
+    def test_server_timing_and_request_log(self):
+        self.client.force_authenticate(self.staff)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/recipes/')
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(
+            response['Server-Timing'],
+            rf'^db;dur=[\d.]+;desc="{len(context.captured_queries)} '
+            rf'queries", serializer;dur=[\d.]+, total;dur=[\d.]+$'
+        )
+        [record] = request_log.records()
+        self.assertEqual(record['view'], 'RecipeViewSet.list')
+        self.assertEqual(record['status'], 200)
+        self.assertEqual(
+            record['db_queries'], len(context.captured_queries)
+        )
+        self.assertGreater(record['serializer_ms'], 0)
+
+    def test_server_timing_is_for_staff_only(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/recipes/'))
+        self.client.force_authenticate(self.user)
+        self.assertNotIn('Server-Timing', self.client.get('/api/recipes/'))
+        with override_settings(PROFILING_SERVER_TIMING=True):
+            response = self.client.get('/api/recipes/')
+        self.assertIn('Server-Timing', response)
+
+    @override_settings(PROFILING_DUPLICATE_THRESHOLD=3)
+    def test_duplicate_queries_are_grouped(self):
+        profile = RequestProfile()
+        for size in range(1, 4):
+            profile.add_query(
+                'SELECT * FROM "recipes_recipe" WHERE "id" IN ('
+                + ', '.join(['%s'] * size) + ') LIMIT 21', 0.001
+            )
+        profile.add_query('SELECT 1', 0.001)
+        self.assertEqual(profile.duplicates(), [{
+            'sql': (
+                'SELECT * FROM "recipes_recipe" WHERE "id" IN (...) '
+                'LIMIT N'
+            ),
+            'count': 3,
+        }])
+
+    def test_debug_endpoint_is_staff_only(self):
+        url = '/api/_debug/requests/'
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.client.force_authenticate(self.staff)
+        self.client.get('/api/recipes/')
+        response = self.client.get(url, {'view': 'RecipeViewSet.list'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [record['path'] for record in response.data['requests']],
+            ['/api/recipes/']
+        )
+        summary = {
+            row['view']: row['requests'] for row in response.data['summary']
+        }
+        self.assertEqual(summary['RecipeViewSet.list'], 1)
+
+
+class RecipeSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Test', password='pass12345'
+        )
+        beet = Ingredient.objects.create(name='свёкла', measurement_unit='г')
+        recipes = {}
+        for name, text in (
+            ('Борщ', 'Классический суп'),
+            ('Салат', 'Винегрет с капустой'),
+            ('Блины', 'На молоке'),
+        ):
+            recipes[name] = Recipe.objects.create(
+                author=author, name=name, image='recipes/images/test.png',
+                text=text, cooking_time=10,
+            )
+        for name in ('Борщ', 'Салат'):
+            IngredientInRecipe.objects.create(
+                recipe=recipes[name], ingredient=beet, amount=100
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, query):
+        response = APIClient().get('/api/recipes/', {'search': query})
+        self.assertEqual(response.status_code, 200)
+        return sorted(item['name'] for item in response.data['results'])
+
+    def test_search_by_name(self):
+        self.assertEqual(self.search('Борщ'), ['Борщ'])
+
+    def test_search_by_text(self):
+        self.assertEqual(self.search('Винегрет'), ['Салат'])
+
+    def test_search_by_ingredient(self):
+        self.assertEqual(self.search('свёкла'), ['Борщ', 'Салат'])
+
+    def test_blank_search_returns_everything(self):
+        self.assertEqual(len(self.search(' ')), 3)
+
+
+@skipUnless(
+    connection.vendor == 'postgresql',
+    'tsvector и pg_trgm есть только в PostgreSQL'
+)
+class RecipePostgresSearchTest(TestCase):
+    """Поиск через search_vector и pg_trgm с индексами из миграции 0006."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Test', password='pass12345'
+        )
+        beet = Ingredient.objects.create(name='свёкла', measurement_unit='г')
+        for name, text in (
+            ('Борщ', 'Классический суп со сметаной'),
+            ('Щи', 'Почти как борщ, только с капустой'),
+            ('Carbonara', 'Паста с беконом'),
+            ('Блины', 'На молоке'),
+        ):
+            recipe = Recipe.objects.create(
+                author=author, name=name, image='recipes/images/test.png',
+                text=text, cooking_time=10,
+            )
+            if name == 'Борщ':
+                IngredientInRecipe.objects.create(
+                    recipe=recipe, ingredient=beet, amount=100
+                )
+        Recipe.objects.update_search_vector()
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, query):
+        response = APIClient().get('/api/recipes/', {'search': query})
+        self.assertEqual(response.status_code, 200)
+        return [item['name'] for item in response.data['results']]
+
+    def test_extension_and_indexes_exist(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+            )
+            self.assertIsNotNone(cursor.fetchone())
+            cursor.execute(
+                "SELECT indexname FROM pg_indexes "
+                "WHERE tablename = 'recipes_recipe'"
+            )
+            indexes = {row[0] for row in cursor.fetchall()}
+        self.assertLessEqual(
+            {'recipes_recipe_name_trgm', 'recipes_recipe_search_vector'},
+            indexes
+        )
+
+    def test_word_forms_are_matched(self):
+        self.assertEqual(sorted(self.search('борща')), ['Борщ', 'Щи'])
+        self.assertEqual(self.search('блин'), ['Блины'])
+
+    def test_search_by_ingredient(self):
+        self.assertEqual(self.search('свёкла'), ['Борщ'])
+
+    def test_name_ranks_above_text(self):
+        self.assertEqual(
+            list(Recipe.objects.search('борщ').values_list('name', flat=True)),
+            ['Борщ', 'Щи']
+        )
+
+    def test_misspelt_name_is_matched_by_trigrams(self):
+        self.assertEqual(self.search('Karbonara'), ['Carbonara'])
+
+    def test_search_uses_gin_indexes(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = Recipe.objects.search('борщ').explain()
+        self.assertIn('recipes_recipe_search_vector', plan)
+        self.assertIn('recipes_recipe_name_trgm', plan)
+
+
+class RecipePaginationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Test', password='pass12345'
+        )
+        for i in range(11):
+            Recipe.objects.create(
+                author=author, name=f'Рецепт {i}',
+                image='recipes/images/test.png',
+                text='Описание', cooking_time=10,
+            )
+        # Одинаковое время публикации — порядок определяет id
+        Recipe.objects.filter(name__in=['Рецепт 3', 'Рецепт 4', 'Рецепт 5']) \
+            .update(created_at=Recipe.objects.get(name='Рецепт 3').created_at)
+        cls.expected = list(
+            Recipe.objects.order_by('-created_at', '-id')
+            .values_list('id', flat=True)
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_cursor_walks_forward_and_back(self):
+        response = self.client.get('/api/recipes/', {'cursor': '', 'limit': 4})
+        self.assertNotIn('count', response.data)
+        self.assertIsNone(response.data['previous'])
+        pages = [[item['id'] for item in response.data['results']]]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            pages.append([item['id'] for item in response.data['results']])
+        self.assertEqual(sum(pages, []), self.expected)
+        self.assertEqual([len(page) for page in pages], [4, 4, 3])
+
+        backwards = []
+        while response.data['previous']:
+            response = self.client.get(response.data['previous'])
+            backwards.append([item['id'] for item in response.data['results']])
+        self.assertEqual(backwards, pages[-2::-1])
+
+    def test_invalid_cursor(self):
+        response = self.client.get('/api/recipes/', {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_cursor_with_wrong_value_types(self):
+        self.client.force_authenticate(User.objects.get(username='author'))
+        for payload in (
+            [['x', 1], False],
+            [[{'a': 1}, 1], False],
+            [[None, None], False],
+            [['2026-01-01T00:00:00+00:00', 'x'], True],
+        ):
+            cursor = base64.urlsafe_b64encode(
+                json.dumps(payload).encode()
+            ).decode()
+            for url in (
+                '/api/recipes/', '/api/users/', '/api/users/subscriptions/'
+            ):
+                with self.subTest(url=url, payload=payload):
+                    response = self.client.get(url, {'cursor': cursor})
+                    self.assertEqual(response.status_code, 404)
+
+    def test_page_number_without_count(self):
+        response = self.client.get(
+            '/api/recipes/', {'count': 'none', 'limit': 5, 'page': 3}
+        )
+        self.assertIsNone(response.data['count'])
+        self.assertIsNone(response.data['next'])
+        self.assertIsNotNone(response.data['previous'])
+        self.assertEqual(
+            [item['id'] for item in response.data['results']],
+            self.expected[10:]
+        )
+
+    def test_estimated_count_is_opt_in(self):
+        response = self.client.get(
+            '/api/recipes/', {'count': 'estimate', 'limit': 5, 'page': 3}
+        )
+        # Оценка по статистике есть только в PostgreSQL, иначе точный счёт
+        self.assertEqual(response.data['count'], 11)
+        self.assertIs(response.data['count_estimated'], False)
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(
+            [item['id'] for item in response.data['results']],
+            self.expected[10:]
+        )
+        response = self.client.get('/api/recipes/', {'limit': 5})
+        self.assertNotIn('count_estimated', response.data)
+
+    def test_page_number_mode_is_unchanged(self):
+        response = self.client.get('/api/recipes/', {'limit': 5, 'page': 2})
+        self.assertEqual(response.data['count'], 11)
+        self.assertCountEqual(
+            [item['id'] for item in response.data['results']],
+            self.expected[5:10]
+        )
+
+
+class ResponseCacheTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Test', password='pass12345'
+        )
+        cls.reader = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Reader', last_name='Test', password='pass12345'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Борщ', image='recipes/images/test.png',
+            text='Описание', cooking_time=10,
+        )
+        Favorite.objects.create(user=cls.reader, recipe=cls.recipe)
+        Follow.objects.create(user=cls.reader, following=cls.author)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_responses_are_cached(self):
+        client = APIClient()
+        self.assertEqual(client.get('/api/recipes/')['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            response = client.get('/api/recipes/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertEqual(
+            client.get('/api/recipes/', {'limit': 5})['X-Cache'], 'MISS'
+        )
+
+    def test_user_overlay(self):
+        APIClient().get(f'/api/recipes/{self.recipe.id}/')
+        client = APIClient()
+        client.force_authenticate(self.reader)
+        response = client.get(f'/api/recipes/{self.recipe.id}/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertTrue(response.data['is_favorited'])
+        self.assertFalse(response.data['is_in_shopping_cart'])
+        self.assertTrue(response.data['author']['is_subscribed'])
+        anonymous = APIClient().get(f'/api/recipes/{self.recipe.id}/')
+        self.assertFalse(anonymous.data['is_favorited'])
+
+    def test_personal_filters_bypass_cache(self):
+        client = APIClient()
+        client.force_authenticate(self.reader)
+        response = client.get('/api/recipes/', {'is_favorited': 1})
+        self.assertNotIn('X-Cache', response)
+
+    def test_recipe_change_invalidates(self):
+        client = APIClient()
+        client.get('/api/recipes/')
+        client.get(f'/api/recipes/{self.recipe.id}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.name = 'Щи'
+            self.recipe.save()
+        response = client.get(f'/api/recipes/{self.recipe.id}/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['name'], 'Щи')
+        response = client.get('/api/recipes/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+    def test_local_cache_entries_expire_quickly(self):
+        # Изменение из другого процесса (без сигналов в этом) видно
+        # через RESPONSE_CACHE_LOCAL_TIMEOUT, а не RESPONSE_CACHE_TIMEOUT
+        client = APIClient()
+        client.get(f'/api/recipes/{self.recipe.id}/')
+        Recipe.objects.filter(pk=self.recipe.pk).update(name='Щи')
+        response = client.get(f'/api/recipes/{self.recipe.id}/')
+        self.assertEqual(response['X-Cache'], 'HIT')
+        later = time.time() + settings.RESPONSE_CACHE_LOCAL_TIMEOUT + 1
+        with mock.patch('time.time', return_value=later):
+            response = client.get(f'/api/recipes/{self.recipe.id}/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['name'], 'Щи')
+
+
+class ConditionalGetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Test', password='pass12345'
+        )
+        cls.reader = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Reader', last_name='Test', password='pass12345'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Борщ', image='recipes/images/test.png',
+            text='Описание', cooking_time=10,
+        )
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+
+    def setUp(self):
+        cache.clear()
+        ingredient_index.invalidate()
+        self.url = f'/api/recipes/{self.recipe.id}/'
+
+    def test_recipe_detail_not_modified(self):
+        client = APIClient()
+        response = client.get(self.url)
+        self.assertIn('Last-Modified', response)
+        etag = response['ETag']
+        with self.assertNumQueries(1):
+            response = client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = client.get(
+            self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(response.status_code, 304)
+
+        self.recipe.name = 'Щи'
+        self.recipe.save()
+        response = client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_etag_depends_on_user_flags(self):
+        client = APIClient()
+        client.force_authenticate(self.reader)
+        response = client.get(self.url)
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        self.assertEqual(
+            client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304
+        )
+        Favorite.objects.create(user=self.reader, recipe=self.recipe)
+        response = client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['is_favorited'])
+
+    def test_list_not_modified_until_recipe_changes(self):
+        client = APIClient()
+        etag = client.get('/api/recipes/')['ETag']
+        with self.assertNumQueries(0):
+            response = client.get('/api/recipes/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.save()
+        response = client.get('/api/recipes/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_ingredient_catalogue_version(self):
+        client = APIClient()
+        etag = client.get('/api/ingredients/')['ETag']
+        self.assertEqual(
+            client.get(
+                '/api/ingredients/', HTTP_IF_NONE_MATCH=etag
+            ).status_code,
+            304
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='перец', measurement_unit='г')
+        response = client.get('/api/ingredients/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 2)
+
+    def test_ingredient_etag_ignores_user_flags(self):
+        client = APIClient()
+        client.force_authenticate(self.reader)
+        response = client.get('/api/ingredients/')
+        etag = response['ETag']
+        self.assertEqual(APIClient().get('/api/ingredients/')['ETag'], etag)
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.reader, recipe=self.recipe)
+        response = client.get('/api/ingredients/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+
+IMAGES_MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(
+    MEDIA_ROOT=IMAGES_MEDIA_ROOT, IMAGE_RENDITIONS_SYNC=True,
+    IMAGE_RENDITION_WIDTHS=(320, 640)
+)
+class ImageRenditionsTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Test', password='pass12345'
+        )
+        cls.ingredient = Ingredient.objects.create(
+            name='соль', measurement_unit='г'
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(IMAGES_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def encode_image(self, size=(800, 400)):
+        output = io.BytesIO()
+        Image.new('RGB', size, 'red').save(output, 'PNG')
+        return (
+            'data:image/png;base64,'
+            + base64.b64encode(output.getvalue()).decode()
+        )
+
+    def create_recipe(self, image):
+        return self.client.post('/api/recipes/', {
+            'ingredients': [{'id': self.ingredient.id, 'amount': 1}],
+            'image': image,
+            'name': 'Рецепт',
+            'text': 'Описание',
+            'cooking_time': 5,
+        }, format='json')
+
+    def test_renditions_built_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.create_recipe(self.encode_image())
+        self.assertEqual(response.status_code, 201)
+        recipe = Recipe.objects.get(id=response.data['id'])
+        self.assertEqual(recipe.image_renditions['source'], recipe.image.name)
+        self.assertEqual(set(recipe.image_renditions['webp']), {'320', '640'})
+
+        response = self.client.get(f'/api/recipes/{recipe.id}/')
+        renditions = response.data['image_renditions']
+        self.assertEqual(set(renditions), {'webp', 'jpeg'})
+        self.assertTrue(renditions['jpeg']['320'].endswith('_320.jpeg'))
+
+    def test_renditions_hidden_until_ready(self):
+        response = self.create_recipe(self.encode_image())
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['image_renditions'], {})
+
+    @override_settings(MAX_IMAGE_UPLOAD_SIZE=100)
+    def test_upload_size_limit(self):
+        response = self.create_recipe(self.encode_image())
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+        self.assertFalse(Recipe.objects.exists())
+
+    @override_settings(MAX_IMAGE_PIXELS=1000)
+    def test_pixel_limit(self):
+        response = self.create_recipe(self.encode_image())
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+
+    def test_base64_with_line_breaks(self):
+        output = io.BytesIO()
+        Image.new('RGB', (800, 400), 'red').save(output, 'PNG')
+        # Перенос по 76 символов, как у base64 в MIME
+        wrapped = base64.encodebytes(output.getvalue()).decode()
+        self.assertIn('\n', wrapped)
+        response = self.create_recipe(
+            'data:image/png;base64,' + wrapped.replace('\n', '\r\n ')
+        )
+        self.assertEqual(response.status_code, 201)
+        with default_storage.open(
+            Recipe.objects.get(id=response.data['id']).image.name
+        ) as file:
+            self.assertEqual(file.read(), output.getvalue())
+
+    def test_invalid_base64_character(self):
+        image = self.encode_image()
+        response = self.create_recipe(image[:-8] + '!' + image[-7:])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('image', response.data)
+
+
+STORAGE_MEDIA_ROOT = tempfile.mkdtemp()
+
+
+# Без паузы: файлы, загруженные в тесте, собираются сразу
+@override_settings(
+    MEDIA_ROOT=STORAGE_MEDIA_ROOT, IMAGE_RENDITIONS_SYNC=True,
+    STORED_FILE_GRACE_PERIOD=0
+)
+class ContentAddressedStorageTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Test', password='pass12345'
+        )
+        cls.ingredient = Ingredient.objects.create(
+            name='соль', measurement_unit='г'
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(STORAGE_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def encode_image(self, color):
+        output = io.BytesIO()
+        Image.new('RGB', (4, 4), color).save(output, 'PNG')
+        return (
+            'data:image/png;base64,'
+            + base64.b64encode(output.getvalue()).decode()
+        )
+
+    def create_recipe(self, image):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/recipes/', {
+                'ingredients': [{'id': self.ingredient.id, 'amount': 1}],
+                'image': image,
+                'name': 'Рецепт',
+                'text': 'Описание',
+                'cooking_time': 5,
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return Recipe.objects.get(id=response.data['id'])
+
+    def test_identical_uploads_share_one_file(self):
+        first = self.create_recipe(self.encode_image('red'))
+        second = self.create_recipe(self.encode_image('red'))
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(
+            StoredFile.objects.get(name=first.image.name).ref_count, 2
+        )
+
+    def test_replaced_image_collected_when_unreferenced(self):
+        first = self.create_recipe(self.encode_image('red'))
+        second = self.create_recipe(self.encode_image('red'))
+        old_name = first.image.name
+        for recipe in (first, second):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.patch(
+                    f'/api/recipes/{recipe.id}/',
+                    {'image': self.encode_image('blue')}, format='json'
+                )
+            self.assertEqual(response.status_code, 200)
+            if recipe is first:
+                self.assertTrue(default_storage.exists(old_name))
+        self.assertFalse(default_storage.exists(old_name))
+        self.assertFalse(StoredFile.objects.filter(name=old_name).exists())
+
+    def test_avatar_delete_collects_file(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(
+                '/api/users/avatar/',
+                {'avatar': self.encode_image('green')}, format='json'
+            )
+        self.author.refresh_from_db()
+        name = self.author.avatar.name
+        self.assertTrue(default_storage.exists(name))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.delete('/api/users/avatar/')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(default_storage.exists(name))
+
+    def test_reclaim_media_command(self):
+        recipe = self.create_recipe(self.encode_image('red'))
+        orphan = default_storage.save(
+            'recipes/images/orphan.png', ContentFile(b'orphan')
+        )
+        StoredFile.objects.filter(name=recipe.image.name).update(ref_count=5)
+        out = io.StringIO()
+        call_command('reclaim_media', '--delete', stdout=out)
+        self.assertIn('Orphaned: 1', out.getvalue())
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertTrue(default_storage.exists(recipe.image.name))
+        self.assertEqual(
+            StoredFile.objects.get(name=recipe.image.name).ref_count, 1
+        )
+
+    @override_settings(STORED_FILE_GRACE_PERIOD=600)
+    def test_reclaim_media_rechecks_orphans_before_delete(self):
+        # Файлы без строк StoredFile: остались от прежнего хранилища
+        legacy = FileSystemStorage(location=settings.MEDIA_ROOT)
+        uploaded = legacy.save(
+            'recipes/images/uploaded.png', ContentFile(b'1')
+        )
+        stale = legacy.save('recipes/images/stale.png', ContentFile(b'2'))
+        rendition = default_storage.save(
+            'renditions/recipes/images/gone_320.webp', ContentFile(b'3')
+        )
+        for name in (uploaded, stale, rendition):
+            self.addCleanup(default_storage.delete, name)
+        walk = reclaim_media.walk
+
+        def walk_during_upload(storage, directory):
+            yield from walk(storage, directory)
+            # Пока шёл обход, тот же файл загрузили заново
+            StoredFile.objects.touch(uploaded)
+
+        with mock.patch.object(reclaim_media, 'walk', walk_during_upload):
+            call_command('reclaim_media', '--delete', stdout=io.StringIO())
+        self.assertTrue(default_storage.exists(uploaded))
+        self.assertFalse(default_storage.exists(stale))
+        self.assertFalse(default_storage.exists(rendition))
+        self.assertFalse(StoredFile.objects.filter(name=stale).exists())
+
+    @override_settings(STORED_FILE_GRACE_PERIOD=600)
+    def test_recently_saved_file_survives_collect(self):
+        # Файл сохранён, но модель ещё не сослалась на него
+        name = default_storage.save(
+            'recipes/images/upload.png', ContentFile(b'upload')
+        )
+        self.addCleanup(default_storage.delete, name)
+        self.assertEqual(StoredFile.objects.collect(), [])
+        call_command('reclaim_media', '--delete', stdout=io.StringIO())
+        self.assertTrue(default_storage.exists(name))
+
+    def test_save_after_collect_rewrites_file(self):
+        name = default_storage.save(
+            'recipes/images/upload.png', ContentFile(b'upload')
+        )
+        self.assertEqual(StoredFile.objects.collect(), [name])
+        self.assertFalse(default_storage.exists(name))
+        self.assertEqual(
+            default_storage.save(
+                'recipes/images/again.png', ContentFile(b'upload')
+            ),
+            name
+        )
+        self.addCleanup(default_storage.delete, name)
+        self.assertTrue(default_storage.exists(name))
+        self.assertTrue(StoredFile.objects.filter(name=name).exists())
+
+
+TRANSFER_MEDIA_ROOT = tempfile.mkdtemp()
+
+
+@override_settings(MEDIA_ROOT=TRANSFER_MEDIA_ROOT)
+class RecipeImportExportTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Author', last_name='Test', password='pass12345'
+        )
+        cls.salt = Ingredient.objects.create(name='соль', measurement_unit='г')
+        cls.milk = Ingredient.objects.create(
+            name='молоко', measurement_unit='мл'
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(TRANSFER_MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def setUp(self):
+        output = io.BytesIO()
+        Image.new('RGB', (4, 4), 'red').save(output, 'PNG')
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Описание',
+            cooking_time=10, image=default_storage.save(
+                'recipes/images/source.png', ContentFile(output.getvalue())
+            )
+        )
+        IngredientInRecipe.objects.create(
+            recipe=self.recipe, ingredient=self.salt, amount=5
+        )
+        IngredientInRecipe.objects.create(
+            recipe=self.recipe, ingredient=self.milk, amount=200
+        )
+        self.path = tempfile.mktemp(suffix='.jsonl', dir=TRANSFER_MEDIA_ROOT)
+
+    def import_recipes(self):
+        out = io.StringIO()
+        call_command(
+            'import_recipes', self.path, '--workers', '0',
+            stdout=out, stderr=io.StringIO()
+        )
+        return out.getvalue()
+
+    def test_round_trip(self):
+        call_command(
+            'export_recipes', self.path, '--inline-images',
+            stderr=io.StringIO()
+        )
+        with open(self.path, encoding='utf-8') as file:
+            exported = [json.loads(line) for line in file]
+        self.assertEqual(len(exported), 1)
+        self.assertTrue(exported[0]['image'].startswith('data:image/png'))
+
+        self.assertIn('Imported 1 recipes, 0 errors', self.import_recipes())
+        imported = Recipe.objects.exclude(pk=self.recipe.pk).get()
+        self.assertEqual(imported.author, self.author)
+        self.assertEqual(
+            set(imported.ingredient_in_recipe.values_list(
+                'ingredient__name', 'amount'
+            )),
+            {('соль', 5), ('молоко', 200)}
+        )
+        # То же содержимое — тот же файл в хранилище
+        self.assertEqual(imported.image.name, self.recipe.image.name)
+        self.assertEqual(
+            StoredFile.objects.get(name=imported.image.name).ref_count, 2
+        )
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 2)
+
+    def test_invalid_lines_are_skipped(self):
+        lines = [
+            {
+                'author': {'email': 'partner@example.com',
+                           'username': 'partner'},
+                'name': 'Импорт', 'text': 'Текст', 'cooking_time': 15,
+                'image': self.recipe.image.name,
+                'ingredients': [
+                    {'name': 'соль', 'measurement_unit': 'г', 'amount': 1}
+                ],
+            },
+            {'author': 'partner@example.com', 'name': 'Без ингредиентов'},
+            {
+                'author': 'partner@example.com', 'name': 'Нет картинки',
+                'text': 'Текст', 'cooking_time': 15,
+                'image': 'recipes/images/missing.png',
+                'ingredients': [
+                    {'name': 'соль', 'measurement_unit': 'г', 'amount': 1}
+                ],
+            },
+        ]
+        with open(self.path, 'w', encoding='utf-8') as file:
+            for line in lines:
+                file.write(json.dumps(line, ensure_ascii=False) + '\n')
+            file.write('not json\n')
+        self.assertIn('Imported 1 recipes, 3 errors', self.import_recipes())
+        partner = User.objects.get(email='partner@example.com')
+        self.assertFalse(partner.has_usable_password())
+        self.assertEqual(partner.recipes.get().name, 'Импорт')
+
+
+class LoadIngredientsTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def write(self, name, content):
+        path = f'{self.directory}/{name}'
+        with open(path, 'w', encoding='utf-8') as file:
+            file.write(content)
+        return path
+
+    def load(self, path, *args):
+        out = io.StringIO()
+        call_command(
+            'load_ingredients', '--path', path, *args, stdout=out
+        )
+        return out.getvalue()
+
+    def test_rerun_is_idempotent(self):
+        path = self.write('catalogue.csv', 'соль,г\nмолоко,мл\nсоль,г\n')
+        self.load(path)
+        output = self.load(path, '--chunk-size', '1')
+        self.assertIn('0 added', output)
+        self.assertEqual(Ingredient.objects.count(), 2)
+
+    def test_json_input(self):
+        path = self.write('catalogue.json', json.dumps([
+            {'name': 'соль', 'measurement_unit': 'г'},
+            {'name': 'молоко', 'measurement_unit': 'мл'},
+        ], ensure_ascii=False))
+        self.load(path, '--chunk-size', '1')
+        self.assertEqual(
+            set(Ingredient.objects.values_list('name', 'measurement_unit')),
+            {('соль', 'г'), ('молоко', 'мл')}
+        )
+
+    def test_dry_run_and_update_units(self):
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+        path = self.write('catalogue.csv', 'соль,кг\nперец,г\n')
+        output = self.load(path, '--dry-run', '--update-units')
+        self.assertIn('+ перец (г)', output)
+        self.assertIn('~ соль: г -> кг', output)
+        self.assertEqual(Ingredient.objects.count(), 1)
+
+        self.load(path, '--update-units')
+        self.assertEqual(
+            set(Ingredient.objects.values_list('name', 'measurement_unit')),
+            {('соль', 'кг'), ('перец', 'г')}
+        )
+
+
+# Таблицы, которые растут с числом пользователей и рецептов: полный
+# просмотр любой из них в горячем запросе считается регрессией.
+LARGE_TABLES = {
+    'recipes_recipe', 'recipes_ingredientinrecipe', 'recipes_favorite',
+    'recipes_shoppingcart', 'recipes_shoppinglistitem', 'users_follow',
+    'users_user',
+}
+
+
+def full_scans(sql):
+    """Возвращает большие таблицы, которые план запроса читает целиком."""
+    aliases = dict(
+        (alias, table) for table, alias in
+        re.findall(r'"(\w+)" (?:AS )?"?([A-Z]\d+)"?', sql)
+    )
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # Без seqscan планировщик выберет индекс, если он вообще
+            # подходит, — так маленькая тестовая БД не маскирует проблему.
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN {sql}')
+            scans = re.findall(
+                r'Seq Scan on (\w+)',
+                '\n'.join(row[0] for row in cursor.fetchall())
+            )
+        else:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            scans = [
+                match.group(1) for row in cursor.fetchall()
+                if (match := re.match(r'SCAN (\w+)$', row[-1]))
+            ]
+    return {aliases.get(name, name) for name in scans} & LARGE_TABLES
+
+
+class QueryPlanTest(TestCase):
+    """EXPLAIN для запросов горячих эндпоинтов: без полных просмотров."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Reader', last_name='Test', password='pass12345'
+        )
+        cls.ingredients = Ingredient.objects.bulk_create([
+            Ingredient(name=f'ингредиент {i}', measurement_unit='г')
+            for i in range(5)
+        ])
+        for i in range(3):
+            author = User.objects.create_user(
+                email=f'author{i}@example.com', username=f'author{i}',
+                first_name='Author', last_name=str(i), password='pass12345'
+            )
+            Follow.objects.create(user=cls.user, following=author)
+            for j in range(3):
+                recipe = Recipe.objects.create(
+                    author=author, name=f'Рецепт {i}-{j}',
+                    image='recipes/images/test.png', text='Описание',
+                    cooking_time=10,
+                )
+                for ingredient in cls.ingredients[j:j + 2]:
+                    IngredientInRecipe.objects.create(
+                        recipe=recipe, ingredient=ingredient, amount=1
+                    )
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+                ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        cls.author = author
+        ShoppingListItem.objects.rebuild()
+
+    def setUp(self):
+        cache.clear()
+        # Индекс подбора по кладовой строится полным чтением таблицы
+        # один раз на процесс, а не на каждый запрос.
+        recipe_matcher.invalidate()
+        recipe_matcher.match([])
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assert_no_full_scans(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 200)
+        selects = [
+            query['sql'] for query in context.captured_queries
+            if query['sql'].startswith('SELECT')
+        ]
+        self.assertTrue(selects)
+        for sql in selects:
+            with self.subTest(url=url, sql=sql):
+                self.assertEqual(full_scans(sql), set())
+
+    def test_hot_queries_use_indexes(self):
+        by_ingredients = (
+            '/api/recipes/filter_by_ingredients/?ingredients='
+            f'{self.ingredients[0].id},{self.ingredients[1].id}'
+        )
+        for url in (
+            '/api/recipes/',
+            '/api/recipes/?cursor=',
+            f'/api/recipes/?author={self.author.id}',
+            '/api/recipes/?is_favorited=1',
+            '/api/recipes/?is_in_shopping_cart=1',
+            f'/api/recipes/{self.author.recipes.first().id}/',
+            by_ingredients,
+            '/api/recipes/feed/',
+            '/api/recipes/download_shopping_cart/',
+            '/api/users/subscriptions/?recipes_limit=2',
+        ):
+            self.assert_no_full_scans(url)
+
+    def explain(self, queryset):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        return queryset.explain()
+
+    def test_composite_indexes_used(self):
+        for queryset, index in (
+            (
+                Recipe.objects.filter(author=self.author)
+                .order_by('-created_at', '-id'),
+                'recipe_author_created_idx'
+            ),
+            (
+                IngredientInRecipe.objects.filter(
+                    ingredient__in=self.ingredients[:2]
+                ).values('recipe'),
+                'ingredient_recipe_idx'
+            ),
+            (
+                Follow.objects.filter(following=self.author).values('user'),
+                'follow_following_user_idx'
+            ),
+            (
+                User.objects.annotate(email_lower=Lower('email')).filter(
+                    email_lower='reader@example.com'
+                ),
+                'user_email_lower_idx'
+            ),
+        ):
+            with self.subTest(index=index):
+                self.assertIn(index, self.explain(queryset))
@@ -1,3 +1,16 @@
-from django.shortcuts import render
+from django.http import HttpResponseNotFound, HttpResponseRedirect
 
-# Create your views here.
+from recipes.short_links import click_counter, short_link_resolver
+
+
+def short_link_redirect(request, code):
+    """Переход по короткой ссылке на страницу рецепта.
+
+    Обычное представление Django вне DRF: без сериализаторов,
+    аутентификации и запросов к БД, переход только учитывается.
+    """
+    recipe_id = short_link_resolver.resolve(code)
+    if recipe_id is None:
+        return HttpResponseNotFound()
+    click_counter.record(recipe_id)
+    return HttpResponseRedirect(f'/recipes/{recipe_id}')
@@ -5,14 +5,13 @@ from users.models import User, Follow
 
 @admin.register(User)
 class CustomUserAdmin(UserAdmin):
-    list_display = ('username', 'email', 'first_name', 'last_name', 'recipe_count')
+    list_display = (
+        'username', 'email', 'first_name', 'last_name',
+        'recipes_count', 'followers_count'
+    )
     search_fields = ('username', 'email', 'first_name', 'last_name')
     list_filter = ('email', 'first_name')
 
-    def recipe_count(self, obj):
-        return obj.recipes.count()
-    recipe_count.short_description = 'Количество рецептов'
-
 
 @admin.register(Follow)
 class FollowAdmin(admin.ModelAdmin):
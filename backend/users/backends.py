@@ -1,23 +1,32 @@
+import logging
+
 from django.contrib.auth.backends import ModelBackend
 from django.contrib.auth import get_user_model
-from django.db.models import Q
+from django.db.models.functions import Lower
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
+
 
 class EmailBackend(ModelBackend):
     def authenticate(self, request, email=None, password=None, **kwargs):
-        print(f"Debug: EmailBackend.authenticate called with email={email}, password={password}")
+        if email is None:
+            return None
         try:
-            user = User.objects.get(Q(email__iexact=email))
-            print(f"Debug: Found user: {user}")
-            print(f"Debug: Stored password hash: {user.password}")
-            if user.check_password(password):
-                print("Debug: Password is correct")
-                return user
-            else:
-                print("Debug: Password is incorrect")
+            # Сравнение lower(email) использует индекс user_email_lower_idx;
+            # email__iexact в PostgreSQL сравнивает UPPER() и его не видит.
+            user = User.objects.annotate(email_lower=Lower('email')).get(
+                email_lower=email.lower()
+            )
         except User.DoesNotExist:
-            print("Debug: User not found")
+            logger.info('login failed', extra={'reason': 'unknown_email'})
+            return None
+        if user.check_password(password):
+            return user
+        logger.info(
+            'login failed',
+            extra={'reason': 'wrong_password', 'user_id': user.pk}
+        )
         return None
 
     def get_user(self, user_id):
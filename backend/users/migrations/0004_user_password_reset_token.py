@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 06:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_alter_user_managers_alter_user_avatar'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='password_reset_token',
+            field=models.CharField(blank=True, max_length=128, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 06:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_follow_following_user_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='follow',
+            name='feed_synced_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+    ]
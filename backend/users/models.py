@@ -1,22 +1,27 @@
+import logging
+
 from django.contrib.auth.models import AbstractUser, UserManager
 from django.db import models
+from django.db.models.functions import Lower
+
+from foodgram.managers import UserRelationManager
+
+logger = logging.getLogger(__name__)
+
 
 class CustomUserManager(UserManager):
     def create_user(self, email, username, password=None, **extra_fields):
-        print(f"Debug: create_user called with email={email}, username={username}, password={password}")
         if not email:
             raise ValueError('Email обязателен')
         email = self.normalize_email(email)
         user = self.model(email=email, username=username, **extra_fields)
-        print(f"Debug: About to call set_password with password={password}")
-        if password:
-            user.set_password(password)
-            print(f"Debug: Password set, hash={user.password}")
-        else:
-            print("Debug: No password provided")
-            user.set_password(None)
+        # Без пароля set_password(None) ставит непригодный для входа хэш
+        user.set_password(password or None)
         user.save(using=self._db)
-        print(f"Debug: User saved with password={user.password}")
+        logger.info(
+            'user created',
+            extra={'user_id': user.pk, 'has_password': bool(password)}
+        )
         return user
 
     def create_superuser(self, email, username, password=None, **extra_fields):
@@ -30,7 +35,17 @@ class User(AbstractUser):
     first_name = models.CharField(max_length=150)
     last_name = models.CharField(max_length=150)
     avatar = models.ImageField(upload_to='avatars/', null=True, blank=True)
+    avatar_renditions = models.JSONField(
+        default=dict, blank=True, editable=False,
+        verbose_name='Уменьшенные копии аватара'
+    )
     password_reset_token = models.CharField(max_length=128, null=True, blank=True)
+    recipes_count = models.PositiveIntegerField(
+        default=0, verbose_name='Количество рецептов'
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0, verbose_name='Количество подписчиков'
+    )
 
     objects = CustomUserManager()
 
@@ -40,6 +55,13 @@ class User(AbstractUser):
     class Meta:
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
+        indexes = [
+            models.Index(
+                fields=['date_joined', 'id'], name='user_date_joined_id_idx'
+            ),
+            # Вход по email без учёта регистра
+            models.Index(Lower('email'), name='user_email_lower_idx'),
+        ]
 
     def __str__(self):
         return self.username
@@ -50,12 +72,25 @@ class Follow(models.Model):
         User, on_delete=models.CASCADE, related_name='follower'
     )
     following = models.ForeignKey(
-        User, on_delete=models.CASCADE, related_name='following'
+        User, on_delete=models.CASCADE, related_name='following',
+        db_index=False
     )
+    # До какого момента рецепты автора забраны в ленту подписчика
+    # (для авторов, чьи рецепты не раскладываются по лентам при публикации)
+    feed_synced_at = models.DateTimeField(null=True, editable=False)
+
+    objects = UserRelationManager()
 
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
+        indexes = [
+            # Подписчики автора и проверка is_subscribed по автору
+            models.Index(
+                fields=['following', 'user'],
+                name='follow_following_user_idx'
+            ),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['user', 'following'], name='unique_follow'
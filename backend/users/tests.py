@@ -1,3 +1,314 @@
+import contextlib
+import io
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.authentication import token_cache
+from recipes.models import Recipe, TimelineEntry
+from users.models import Follow, User
+
+
+class SubscriptionsQueryCountTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Reader', last_name='Test', password='pass12345'
+        )
+        for i in range(12):
+            author = User.objects.create_user(
+                email=f'author{i}@example.com', username=f'author{i}',
+                first_name='Author', last_name=str(i), password='pass12345'
+            )
+            Follow.objects.create(user=cls.user, following=author)
+            for j in range(i % 5):
+                Recipe.objects.create(
+                    author=author,
+                    name=f'Рецепт {i}-{j}',
+                    image='recipes/images/test.png',
+                    text='Описание',
+                    cooking_time=10,
+                )
+        call_command('recount', stdout=io.StringIO())
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_subscriptions(self, **params):
+        return self.client.get('/api/users/subscriptions/', params)
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        counts = []
+        for limit in (2, 12):
+            with CaptureQueriesContext(connection) as context:
+                response = self.get_subscriptions(limit=limit, recipes_limit=2)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.data['results']), limit)
+            counts.append(len(context.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_recipes_limit_and_count(self):
+        response = self.get_subscriptions(limit=12, recipes_limit=2)
+        for item in response.data['results']:
+            author = User.objects.get(id=item['id'])
+            latest = list(
+                author.recipes.order_by('-created_at', '-id')
+                .values_list('id', flat=True)[:2]
+            )
+            self.assertEqual([r['id'] for r in item['recipes']], latest)
+            self.assertEqual(item['recipes_count'], author.recipes.count())
+            self.assertTrue(item['is_subscribed'])
+
+    def test_without_recipes_limit_returns_all_recipes(self):
+        response = self.get_subscriptions(limit=12)
+        for item in response.data['results']:
+            self.assertEqual(len(item['recipes']), item['recipes_count'])
+
+    def test_invalid_recipes_limit(self):
+        for value in ('abc', '0', '-1'):
+            response = self.get_subscriptions(recipes_limit=value)
+            self.assertEqual(response.status_code, 400)
+
+
+class CachedTokenAuthenticationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='Reader@Example.com', username='reader',
+            first_name='Reader', last_name='Test', password='pass12345'
+        )
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def get_me(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/users/me/')
+        token_queries = [
+            query for query in context.captured_queries
+            if 'authtoken_token' in query['sql']
+        ]
+        return response, len(token_queries)
+
+    def test_token_is_looked_up_once(self):
+        response, queries = self.get_me()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, 1)
+        for _ in range(3):
+            response, queries = self.get_me()
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['username'], 'reader')
+            self.assertEqual(queries, 0)
+
+    # В тестах LocMemCache; считаем его общим, как Redis
+    @mock.patch('api.authentication.is_shared', return_value=True)
+    def test_shared_cache_serves_other_processes(self, is_shared):
+        self.get_me()
+        # Другой процесс: своего LRU нет, общий кэш есть
+        token_cache.clear()
+        response, queries = self.get_me()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, 0)
+
+    def test_process_local_cache_is_not_a_shared_tier(self):
+        # Сброс токена не дошёл бы до LocMemCache других процессов
+        self.get_me()
+        token_cache.clear()
+        response, queries = self.get_me()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(queries, 1)
+
+    def test_logout_revokes_cached_token(self):
+        self.get_me()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/auth/token/logout/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.get_me()[0].status_code, 401)
+
+    def test_password_change_refreshes_cached_user(self):
+        self.get_me()
+        User.objects.filter(pk=self.user.pk).update(followers_count=7)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/users/set_password/', {
+                'current_password': 'pass12345',
+                'new_password': 'new-pass-54321',
+            })
+        self.assertEqual(response.status_code, 204)
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password('new-pass-54321'))
+        # Пользователь из кэша не затёр счётчик, изменённый после кэширования
+        self.assertEqual(self.user.followers_count, 7)
+        response, queries = self.get_me()
+        self.assertEqual(queries, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/users/set_password/', {
+                'current_password': 'new-pass-54321',
+                'new_password': 'pass12345',
+            })
+        self.assertEqual(response.status_code, 204)
+
+    def test_deactivated_user_is_rejected(self):
+        self.get_me()
+        self.user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(self.get_me()[0].status_code, 401)
+
+    def test_login_ignores_email_case(self):
+        response = APIClient().post('/api/auth/token/login/', {
+            'email': 'reader@EXAMPLE.com', 'password': 'pass12345',
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['auth_token'], self.token.key)
+
+
+class SubscribeBatchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Reader', last_name='Test', password='pass12345'
+        )
+        cls.authors = []
+        for i in range(3):
+            author = User.objects.create_user(
+                email=f'author{i}@example.com', username=f'author{i}',
+                first_name='Author', last_name=str(i), password='pass12345'
+            )
+            Recipe.objects.create(
+                author=author, name=f'Рецепт {i}', text='Текст',
+                image='recipes/images/test.png', cooking_time=10
+            )
+            cls.authors.append(author)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_subscribe_and_unsubscribe_batch(self):
+        first, second, third = [author.id for author in self.authors]
+        self.client.post(f'/api/users/{first}/subscribe/')
+        response = self.client.post(
+            '/api/users/subscribe/',
+            {'ids': [first, second, third, self.user.id, 999]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'], [
+            {'id': first, 'status': 'exists'},
+            {'id': second, 'status': 'created'},
+            {'id': third, 'status': 'created'},
+            {'id': self.user.id, 'status': 'self'},
+            {'id': 999, 'status': 'not_found'},
+        ])
+        self.assertEqual(
+            dict(User.objects.filter(pk__in=[first, second, third])
+                 .values_list('id', 'followers_count')),
+            {first: 1, second: 1, third: 1}
+        )
+        # Лента заполнена обработчиком post_save, как при одиночной подписке
+        self.assertEqual(
+            TimelineEntry.objects.filter(user=self.user).count(), 3
+        )
+
+        response = self.client.delete(
+            '/api/users/subscribe/', {'ids': [second, 999]}, format='json'
+        )
+        self.assertEqual(response.json()['results'], [
+            {'id': second, 'status': 'deleted'},
+            {'id': 999, 'status': 'missing'},
+        ])
+        self.assertEqual(
+            User.objects.get(pk=second).followers_count, 0
+        )
+        self.assertFalse(TimelineEntry.objects.filter(
+            user=self.user, recipe__author_id=second
+        ).exists())
+        self.assertEqual(
+            set(Follow.objects.filter(user=self.user)
+                .values_list('following_id', flat=True)),
+            {first, third}
+        )
+
+    def test_single_subscribe_errors(self):
+        url = f'/api/users/{self.authors[0].id}/subscribe/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertEqual(
+            self.client.post(
+                f'/api/users/{self.user.id}/subscribe/'
+            ).status_code,
+            400
+        )
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.client.delete(url).status_code, 400)
+        self.assertEqual(
+            User.objects.get(pk=self.authors[0].id).followers_count, 0
+        )
+
+
+class LoginLoggingTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Reader', last_name='Test', password='pass12345'
+        )
+
+    def login(self, email, password):
+        return APIClient().post(
+            '/api/auth/token/login/',
+            {'email': email, 'password': password},
+            format='json'
+        )
 
-# Create your tests here.
+    def test_passwords_are_not_printed_or_logged(self):
+        stdout = io.StringIO()
+        with contextlib.redirect_stdout(stdout), self.assertLogs(
+            'users', 'INFO'
+        ) as logs:
+            User.objects.create_user(
+                email='new@example.com', username='new',
+                password='secret-one'
+            )
+            self.assertEqual(
+                self.login('reader@example.com', 'secret-two').status_code,
+                401
+            )
+            self.assertEqual(
+                self.login('nobody@example.com', 'secret-three').status_code,
+                401
+            )
+            self.assertEqual(
+                self.login('reader@example.com', 'pass12345').status_code,
+                200
+            )
+        self.assertEqual(stdout.getvalue(), '')
+        self.assertEqual(
+            [
+                (record.getMessage(), getattr(record, 'reason', None))
+                for record in logs.records
+            ],
+            [
+                ('user created', None),
+                ('login failed', 'wrong_password'),
+                ('login failed', 'unknown_email'),
+            ]
+        )
+        for record in logs.records:
+            self.assertNotIn('secret', str(vars(record)))
+            self.assertNotIn('pass12345', str(vars(record)))